@@ -0,0 +1,278 @@
+import asyncio
+import json
+import math
+import threading
+import time
+from array import array
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from config import IngressRule
+from httpclient import ConnectionPool
+
+DEFAULT_CONNECTIONS = 16
+DEFAULT_DURATION = 10.0
+DEFAULT_TIMEOUT = 5.0
+RELAY_BUFFER = 64 * 1024
+PERCENTILES = (0.5, 0.9, 0.99, 0.999)
+
+
+class BenchError(Exception):
+    """Raised when a rule can't be benchmarked."""
+
+
+@dataclass
+class BenchSettings:
+    connections: int = DEFAULT_CONNECTIONS
+    rate: float = 0.0 # Requests per second across all connections; 0 = as fast as possible
+    duration: float = DEFAULT_DURATION
+    timeout: float = DEFAULT_TIMEOUT
+    hop_delay: float = 0.0 # Extra one-way delay added by the relay, in seconds
+
+
+def pick_rule(rules: List[IngressRule], name: Optional[str]) -> IngressRule:
+    """The HTTP(S) rule named by id or hostname, or the only one if `name` is None."""
+    candidates = [r for r in rules if urlsplit(r.service).scheme.lower() in ("http", "https")]
+    if name is None:
+        if len(candidates) == 1:
+            return candidates[0]
+        if not candidates:
+            raise BenchError("no HTTP(S) ingress rules to benchmark")
+        raise BenchError("several HTTP(S) rules; pick one of: " + ", ".join(r.id for r in candidates))
+    for rule in candidates:
+        if name in (rule.id, rule.hostname):
+            return rule
+    if any(name in (r.id, r.hostname) for r in rules):
+        raise BenchError(f"rule {name} does not point at an HTTP(S) service")
+    raise BenchError(f"no ingress rule named {name}")
+
+
+def target_url(rule: IngressRule) -> str:
+    """The origin URL to load, honouring the rule's health check path."""
+    health = rule.raw.get("health") if isinstance(rule.raw.get("health"), dict) else {}
+    if health.get("path"):
+        return rule.service.rstrip("/") + "/" + str(health["path"]).lstrip("/")
+    return rule.service
+
+
+class Relay:
+    """
+    A local TCP relay in front of an origin: a stand-in for cloudflared's
+    hop, so the bench can show what an extra proxy leg costs. Bytes are
+    copied unchanged (TLS passes straight through), optionally held for
+    `delay` seconds each way to model the edge round trip.
+
+    The relay runs its own event loop in a thread, so it doesn't queue
+    behind the load generator's callbacks.
+    """
+
+    def __init__(self, host: str, port: int, delay: float = 0.0):
+        self.host = host
+        self.port = port
+        self.delay = delay
+        self.address: Optional[Tuple[str, int]] = None
+        self._loop = asyncio.new_event_loop()
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._loop.run_forever, name="bench-relay", daemon=True)
+        self._thread.start()
+        listening = asyncio.start_server(self._handle, "127.0.0.1", 0)
+        self._server = asyncio.run_coroutine_threadsafe(listening, self._loop).result()
+        self.address = self._server.sockets[0].getsockname()[:2]
+
+    async def _pipe(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                data = await reader.read(RELAY_BUFFER)
+                if not data:
+                    break
+                if self.delay:
+                    await asyncio.sleep(self.delay)
+                writer.write(data)
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _handle(self, client_reader: asyncio.StreamReader, client_writer: asyncio.StreamWriter):
+        try:
+            origin_reader, origin_writer = await asyncio.open_connection(self.host, self.port)
+        except OSError:
+            client_writer.close()
+            return
+        try:
+            await asyncio.gather(self._pipe(client_reader, origin_writer),
+                                 self._pipe(origin_reader, client_writer))
+        except asyncio.CancelledError:
+            client_writer.close() # Relay shutting down
+            origin_writer.close()
+
+    async def _shutdown(self):
+        self._server.close()
+        tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def close(self):
+        if self._thread is not None:
+            asyncio.run_coroutine_threadsafe(self._shutdown(), self._loop).result(timeout=5)
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout=5)
+        self._loop.close()
+
+
+def summarize(latencies: array, errors: Dict[str, int], statuses: Dict[int, int],
+              elapsed: float, scheduled: int) -> dict:
+    """Throughput and latency distribution of one run, in milliseconds."""
+    ordered = sorted(latencies)
+    count = len(ordered)
+    summary = {
+        "requests": count + sum(errors.values()),
+        "ok": count,
+        "errors": dict(sorted(errors.items())),
+        "statuses": {str(k): v for k, v in sorted(statuses.items())},
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(count / elapsed, 1) if elapsed > 0 else 0.0,
+        "latency_ms": None,
+    }
+    if scheduled:
+        summary["unsent"] = scheduled - summary["requests"] # Rate the origin couldn't keep up with
+    if count:
+        latency = {f"p{q * 100:g}": round(ordered[min(count - 1, math.ceil(q * count) - 1)] * 1000, 3)
+                   for q in PERCENTILES}
+        latency["min"] = round(ordered[0] * 1000, 3)
+        latency["mean"] = round(sum(ordered) / count * 1000, 3)
+        latency["max"] = round(ordered[-1] * 1000, 3)
+        summary["latency_ms"] = latency
+    return summary
+
+
+async def load(url: str, settings: BenchSettings, verify: bool = True, method: str = "GET",
+               address: Optional[Tuple[str, int]] = None) -> dict:
+    """
+    Drive `settings.connections` keep-alive connections at `url` for
+    `settings.duration` seconds and summarize the run.
+
+    Without a rate each connection sends back to back (closed loop). With
+    a rate, requests are scheduled at fixed intervals and latency is
+    measured from when a request was due, not when a free connection
+    sent it, so a stalling origin shows up as latency instead of quietly
+    lowering the offered load.
+    """
+    pool = ConnectionPool(per_host=settings.connections, address=address)
+    latencies = array("d")
+    errors: Dict[str, int] = {}
+    statuses: Dict[int, int] = {}
+    interval = 1.0 / settings.rate if settings.rate > 0 else 0.0
+    started = time.monotonic()
+    deadline = started + settings.duration
+    next_index = 0
+
+    async def worker():
+        nonlocal next_index
+        while True:
+            if interval:
+                due = started + next_index * interval
+                next_index += 1
+                if due >= deadline:
+                    return
+                delay = due - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            else:
+                due = time.monotonic()
+                if due >= deadline:
+                    return
+            try:
+                response = await asyncio.wait_for(pool.request(method, url, verify=verify), settings.timeout)
+            except asyncio.TimeoutError:
+                errors["timeout"] = errors.get("timeout", 0) + 1
+                continue
+            except Exception as e:
+                kind = type(e).__name__
+                errors[kind] = errors.get(kind, 0) + 1
+                continue
+            latencies.append(time.monotonic() - due)
+            statuses[response.status] = statuses.get(response.status, 0) + 1
+
+    try:
+        await asyncio.gather(*(worker() for _ in range(settings.connections)))
+    finally:
+        pool.close()
+    elapsed = time.monotonic() - started
+    scheduled = int(settings.duration * settings.rate) if interval else 0
+    return summarize(latencies, errors, statuses, elapsed, scheduled)
+
+
+async def bench(rule: IngressRule, settings: BenchSettings) -> dict:
+    """Load the rule's origin directly, then through a relay, and report both."""
+    url = target_url(rule)
+    parts = urlsplit(url)
+    host = parts.hostname or "localhost"
+    port = parts.port or (443 if parts.scheme.lower() == "https" else 80)
+    origin_request = rule.raw.get("originRequest") or {}
+    verify = not (isinstance(origin_request, dict) and origin_request.get("noTLSVerify"))
+    health = rule.raw.get("health") if isinstance(rule.raw.get("health"), dict) else {}
+    method = str(health.get("method", "GET")).upper()
+
+    # One request first, so an unreachable origin fails fast instead of
+    # spinning through both phases.
+    pool = ConnectionPool()
+    try:
+        await asyncio.wait_for(pool.request(method, url, verify=verify), settings.timeout)
+    except asyncio.TimeoutError:
+        raise BenchError(f"{url} did not answer within {settings.timeout:g}s")
+    except Exception as e:
+        raise BenchError(f"cannot reach {url}: {e or type(e).__name__}")
+    finally:
+        pool.close()
+
+    direct = await load(url, settings, verify, method)
+    relay = Relay(host, port, settings.hop_delay)
+    relay.start()
+    try:
+        relayed = await load(url, settings, verify, method, address=relay.address)
+    finally:
+        relay.close()
+
+    result = {
+        "rule": rule.id,
+        "hostname": rule.hostname,
+        "url": url,
+        "time": time.time(),
+        "settings": {
+            "connections": settings.connections,
+            "rate": settings.rate or None,
+            "duration_s": settings.duration,
+            "timeout_s": settings.timeout,
+            "hop_delay_ms": settings.hop_delay * 1000,
+        },
+        "direct": direct,
+        "tunnel": relayed,
+    }
+    result["overhead"] = overhead(direct, relayed)
+    return result
+
+
+def overhead(base: dict, other: dict) -> dict:
+    """Latency added and throughput lost going from `base` to `other`."""
+    diff = {}
+    if base["latency_ms"] and other["latency_ms"]:
+        for key in ("p50", "p99"):
+            diff[f"{key}_ms"] = round(other["latency_ms"][key] - base["latency_ms"][key], 3)
+    if base["throughput_rps"]:
+        diff["throughput_ratio"] = round(other["throughput_rps"] / base["throughput_rps"], 3)
+    return diff
+
+
+def load_result(path) -> dict:
+    with open(path, "r") as f:
+        result = json.load(f)
+    if not isinstance(result, dict) or "direct" not in result or "tunnel" not in result:
+        raise BenchError(f"{path} is not a bench result")
+    return result
@@ -0,0 +1,94 @@
+"""
+CLI start-up benchmark.
+
+Measures how long `import main` takes (via -X importtime) and the wall
+time of quick scripted commands, each in a fresh interpreter. Run from the
+repository root:
+
+    python benchmarks/startup.py
+    python benchmarks/startup.py --runs 20 --max-import-ms 80
+
+With --max-import-ms the script exits non-zero when the median import
+time exceeds the budget, so it can guard against eager imports creeping
+back in.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# Modules the fast path must not import; they belong to specific commands.
+LAZY_MODULES = ("yaml", "asyncio", "textual", "requests", "rich.progress", "rich.table", "rich.prompt",
+                "bluegreen", "logparse", "logtail")
+
+
+def import_time_ms() -> float:
+    """Cumulative import time of `main`, in milliseconds."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"],
+                            cwd=ROOT, stderr=subprocess.PIPE, stdout=subprocess.DEVNULL, text=True)
+    for line in result.stderr.splitlines():
+        parts = line.split("|")
+        if len(parts) == 3 and parts[2].strip() == "main":
+            return int(parts[1]) / 1000
+    raise RuntimeError(result.stderr[-500:])
+
+
+def wall_time_ms_raw() -> float:
+    """Bare interpreter start-up, for reference."""
+    started = time.perf_counter()
+    subprocess.run([sys.executable, "-c", "pass"])
+    return (time.perf_counter() - started) * 1000
+
+
+def wall_time_ms(args, env) -> float:
+    started = time.perf_counter()
+    subprocess.run([sys.executable, "main.py"] + args, cwd=ROOT, env=env,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return (time.perf_counter() - started) * 1000
+
+
+def eager_imports():
+    code = "import sys, main; print(' '.join(m for m in %r if m in sys.modules))" % (LAZY_MODULES,)
+    result = subprocess.run([sys.executable, "-c", code], cwd=ROOT, stdout=subprocess.PIPE, text=True)
+    return result.stdout.split()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--max-import-ms", type=float, default=None)
+    args = parser.parse_args()
+
+    # An empty HOME so commands find no tunnels and return straight away.
+    home = tempfile.mkdtemp(prefix="tunnelflare-bench-")
+    env = dict(os.environ, HOME=home)
+
+    rows = [("python -c pass", [wall_time_ms_raw() for _ in range(args.runs)])]
+    rows.append(("import main", [import_time_ms() for _ in range(args.runs)]))
+    for command in (["-q", "stop"], ["-q", "start"], ["--help"]):
+        rows.append(("tunnelflare " + " ".join(command),
+                     [wall_time_ms(command, env) for _ in range(args.runs)]))
+
+    print(f"{'benchmark':<28}{'median ms':>12}{'min ms':>10}")
+    for name, samples in rows:
+        print(f"{name:<28}{statistics.median(samples):>12.1f}{min(samples):>10.1f}")
+
+    eager = eager_imports()
+    if eager:
+        print(f"\nimported eagerly by main: {', '.join(eager)}")
+
+    median_import = statistics.median(rows[1][1])
+    if args.max_import_ms is not None and (median_import > args.max_import_ms or eager):
+        print(f"\nFAIL: import main took {median_import:.1f} ms (budget {args.max_import_ms:.0f} ms)"
+              + (", with eager imports" if eager else ""))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
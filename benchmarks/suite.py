@@ -0,0 +1,297 @@
+"""
+Performance regression suite for TunnelFlare's hot paths.
+
+Measures CLI cold start per command, config load and ingress lint time
+by ingress size, log-scan throughput of the health detection, the
+dashboard's topology frame and resources table, each as the best of
+several runs. Tunnels run against the cloudflared simulator
+(simulator.py) in a throwaway HOME.
+Run from the repository root:
+
+    python benchmarks/suite.py --save              # Record a baseline
+    python benchmarks/suite.py                     # Compare against it
+    python benchmarks/suite.py --only config --threshold 0.5
+
+The run fails (exit 1) when a benchmark is more than --threshold slower
+than its baseline and by more than --min-delta-ms, so timer noise on
+sub-millisecond paths doesn't trip it. Before each group a fixed
+pure-Python workload is timed, and baselines are scaled by how its speed
+changed, so a busy or throttled machine isn't reported as a regression.
+Baselines are machine specific and kept out of git.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict, List
+
+ROOT = Path(__file__).resolve().parent.parent
+BASELINE = Path(__file__).resolve().parent / "baseline.json"
+SIMULATOR = ROOT / "simulator.py"
+# Connections come up at once, so `start` is timed without the simulated handshake.
+SCENARIO = {"run": {"connect-delay": 0, "request-rate": 0}}
+RULE_COUNTS = (10, 100, 1000)
+LOG_LINES = 100_000
+FRAMES = 200
+GROUPS = ("cli", "config", "logs", "topology", "resources")
+
+
+def sandbox() -> Dict[str, str]:
+    """A temporary HOME with a configured default tunnel and the simulator as `cloudflared` on PATH."""
+    home = Path(tempfile.mkdtemp(prefix="tunnelflare-suite-"))
+    bin_dir = home / "bin"
+    bin_dir.mkdir()
+    subprocess.run([sys.executable, str(SIMULATOR), "--install-shim", str(bin_dir)],
+                   stdout=subprocess.DEVNULL, check=True)
+    creds = home / ".cloudflared" / "bench.json"
+    creds.parent.mkdir()
+    creds.write_text("{}")
+    (home / ".cloudflared" / "cert.pem").write_text("")
+    write_config(home / ".tunnelflare" / "config.yml", 10, creds)
+    return dict(os.environ, HOME=str(home), PATH=f"{bin_dir}{os.pathsep}{os.environ.get('PATH', '')}",
+                TUNNELFLARE_SIM=json.dumps(SCENARIO))
+
+
+def write_config(path: Path, rules: int, creds: Path = Path("/dev/null")):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    lines = ["tunnel: 00000000-0000-4000-8000-000000000000", f"credentials-file: {creds}", "ingress:"]
+    for i in range(rules):
+        lines += [f"- hostname: app{i}.example.com", f"  service: http://127.0.0.1:{9 + i % 2}"]
+    lines.append("- service: http_status:404")
+    path.write_text("\n".join(lines) + "\n")
+
+
+def timed(func: Callable[[], object], runs: int, inner: int = 1) -> List[float]:
+    """Milliseconds per call of `func`, one sample per run of `inner` calls, after a warm-up call."""
+    func()
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        for _ in range(inner):
+            func()
+        samples.append((time.perf_counter() - started) * 1000 / inner)
+    return samples
+
+
+def calibrate(runs: int = 5) -> float:
+    """Best time of a fixed pure-Python workload, to factor out machine speed."""
+    def work():
+        table = {}
+        for i in range(200_000):
+            table[i % 1000] = table.get(i % 1000, 0) + i * i
+        return sorted(str(v) for v in table.values())
+    return min(timed(work, runs))
+
+
+def bench_cli(env, runs) -> Dict[str, List[float]]:
+    """Wall time of each command in a fresh interpreter: --help for all, real runs for the quick ones."""
+    def cli(args):
+        return lambda: subprocess.run([sys.executable, "main.py", "-q"] + args, cwd=ROOT, env=env,
+                                      stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    listing = subprocess.run([sys.executable, "-c", "import typer.main, main; "
+                              "print(' '.join(sorted(c.name for c in typer.main.get_command(main.app).commands.values() if not c.hidden)))"],
+                             cwd=ROOT, env=env, stdout=subprocess.PIPE, text=True, check=True)
+    results = {}
+    for command in listing.stdout.split():
+        results[f"cli: {command} --help"] = timed(cli([command, "--help"]), runs)
+    for args in (["status", "--json"], ["history"], ["stop"]):
+        results[f"cli: {' '.join(args)}"] = timed(cli(args), runs)
+
+    # start/stop against the simulator: spawning the supervisor included.
+    starts = []
+    for _ in range(runs):
+        starts += timed(cli(["start"]), 1)
+        cli(["stop"])()
+    results["cli: start"] = starts
+    return results
+
+
+def bench_config(runs) -> Dict[str, List[float]]:
+    from config import ConfigStore
+    from ingress import IngressIndex, lint
+
+    results = {}
+    directory = Path(tempfile.mkdtemp(prefix="tunnelflare-config-"))
+    for count in RULE_COUNTS:
+        path = directory / f"config-{count}.yml"
+        write_config(path, count)
+        results[f"config: parse {count} rules"] = timed(lambda: ConfigStore(path).ingress(), runs,
+                                                        inner=max(1, 1000 // count))
+        store = ConfigStore(path)
+        store.ingress()
+        results[f"config: cached {count} rules"] = timed(store.ingress, runs, inner=1000)
+        rules = store.ingress()
+        results[f"config: index+lint {count} rules"] = timed(lambda: lint(rules, IngressIndex(rules)), runs,
+                                                             inner=max(1, 1000 // count))
+    return results
+
+
+def log_lines(count: int) -> List[str]:
+    """A cloudflared log with a realistic mix of levels and connection events."""
+    stamp = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+    patterns = [
+        f"{stamp} INF Registered tunnel connection connIndex={{i}} location=lhr0{{i}} protocol=quic",
+        f"{stamp} INF Updated to new configuration config=\"{{{{}}}}\" version={{n}}",
+        f"{stamp} WRN Serve tunnel error error=\"timeout: no recent network activity\" connIndex={{i}}",
+        f"{stamp} ERR Request failed error=\"dial tcp 127.0.0.1:8000: connect: connection refused\" connIndex={{i}}",
+        f"{stamp} INF Unregistered tunnel connection connIndex={{i}} event=0",
+        f"{stamp} DBG 200 OK originService=http://localhost:8000 path=/api/v1/items/{{n}}",
+    ]
+    return [patterns[n % len(patterns)].format(i=n % 4, n=n) for n in range(count)]
+
+
+def bench_logs(runs) -> Dict[str, List[float]]:
+    from logparse import LogMonitor
+
+    lines = log_lines(LOG_LINES)
+
+    def scan():
+        monitor = LogMonitor()
+        monitor.feed(lines)
+        monitor.status()
+
+    return {f"logs: scan {LOG_LINES // 1000}k lines": timed(scan, runs)}
+
+
+async def _bench_app(runs) -> Dict[str, List[float]]:
+    from textual.geometry import Region
+    from config import CONFIG_FILE
+    from latency import LatencyHistogram
+    from tui import TopologyWidget, TunnelFlareApp
+
+    results = {}
+    app = TunnelFlareApp()
+    async with app.run_test(size=(200, 50)) as pilot:
+        await pilot.pause()
+        topology = app.query_one(TopologyWidget)
+
+        widgets = list(topology.nodes.values()) + topology.flows
+
+        def frame(change: bool):
+            def render():
+                if change: # Alternate the tunnel's health so every node is rebuilt
+                    topology.tunnel_status = "error" if topology.tunnel_status == "ok" else "ok"
+                topology.refresh_topology()
+                topology.animate_flows()
+                for widget in widgets:
+                    widget.render_lines(Region(0, 0, widget.size.width, widget.size.height))
+            return render
+
+        results["topology: frame (health change)"] = timed(frame(True), runs, inner=FRAMES)
+        results["topology: frame (animation)"] = timed(frame(False), runs, inner=FRAMES)
+
+        for count in RULE_COUNTS:
+            write_config(CONFIG_FILE, count)
+            rules = app.profile.store.ingress()
+            now = time.time()
+            app.view.latency = {}
+            for rule in rules:
+                histogram = app.view.latency[rule.id] = LatencyHistogram()
+                for n in range(24):
+                    histogram.record(0.001 + n / 10000, n % 7 != 0, now=now - n)
+            results[f"resources: table {count} rules"] = timed(app.refresh_resources, runs)
+
+            def probe_round():
+                # Every rule gets a new result: each row is recomputed and its changed cells updated.
+                for histogram in app.view.latency.values():
+                    histogram.record(0.002, True, now=now)
+                app.refresh_resources()
+            results[f"resources: probe round {count} rules"] = timed(probe_round, runs)
+    return results
+
+
+def bench_app(runs) -> Dict[str, List[float]]:
+    return asyncio.run(_bench_app(runs))
+
+
+def compare(results: Dict[str, float], baseline: Dict[str, float], threshold: float, min_delta: float) -> List[str]:
+    failures = []
+    for name, value in results.items():
+        before = baseline.get(name)
+        if before is not None and value > before * (1 + threshold) and value - before > min_delta:
+            failures.append(name)
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--only", choices=GROUPS, action="append", help="Run only these groups (repeatable).")
+    parser.add_argument("--baseline", type=Path, default=BASELINE)
+    parser.add_argument("--save", action="store_true", help="Write the results as the new baseline.")
+    parser.add_argument("--threshold", type=float, default=0.25, help="Allowed slowdown, as a fraction (default 0.25).")
+    parser.add_argument("--min-delta-ms", type=float, default=0.05, help="Ignore slowdowns smaller than this.")
+    args = parser.parse_args()
+
+    env = sandbox()
+    # In-process benchmarks read the sandbox too: TUNNEL_DIR is fixed at import.
+    os.environ.update(HOME=env["HOME"], PATH=env["PATH"])
+    sys.path.insert(0, str(ROOT))
+    groups = args.only or GROUPS
+
+    samples: Dict[str, List[float]] = {}
+    calibration: Dict[str, float] = {} # Per benchmark, measured just before its group
+    def run(group_samples: Dict[str, List[float]], speed: float):
+        samples.update(group_samples)
+        calibration.update(dict.fromkeys(group_samples, round(speed, 4)))
+
+    if "cli" in groups:
+        run(bench_cli(env, args.runs), calibrate())
+    if "config" in groups:
+        run(bench_config(args.runs), calibrate())
+    if "logs" in groups:
+        run(bench_logs(args.runs), calibrate())
+    if "topology" in groups or "resources" in groups:
+        speed = calibrate()
+        run({name: values for name, values in bench_app(args.runs).items() if name.split(":")[0] in groups}, speed)
+
+    # Regressions are judged on the best run: it is the least disturbed by
+    # whatever else the machine is doing. The median is shown for context.
+    results = {name: round(min(values), 4) for name, values in samples.items()}
+    medians = {name: statistics.median(values) for name, values in samples.items()}
+    baseline = {}
+    if args.baseline.exists() and not args.save:
+        saved = json.loads(args.baseline.read_text())
+        # Scale the baseline by how fast the machine is running now compared to then.
+        baseline = {name: value * calibration[name] / saved["calibration"][name]
+                    for name, value in saved.get("results", {}).items()
+                    if name in calibration and saved.get("calibration", {}).get(name)}
+    failures = compare(results, baseline, args.threshold, args.min_delta_ms)
+
+    print(f"{'benchmark':<40}{'best ms':>10}{'median ms':>12}{'baseline':>12}{'change':>10}")
+    for name, value in results.items():
+        before = baseline.get(name)
+        change = f"{(value / before - 1) * 100:+.0f}%" if before else ""
+        mark = "  REGRESSED" if name in failures else ""
+        shown = f"{before:.3f}" if before is not None else ""
+        print(f"{name:<40}{value:>10.3f}{medians[name]:>12.3f}{shown:>12}{change:>10}{mark}")
+    scan = results.get(f"logs: scan {LOG_LINES // 1000}k lines")
+    if scan:
+        print(f"\nlog scan throughput: {LOG_LINES / scan * 1000:,.0f} lines/s")
+
+    if args.save:
+        args.baseline.write_text(json.dumps({
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "saved_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "results": results,
+            "calibration": calibration,
+        }, indent=2) + "\n")
+        print(f"\nbaseline saved to {args.baseline}")
+    elif not baseline:
+        print(f"\nno baseline at {args.baseline}; run with --save to record one")
+    if failures:
+        print(f"\nFAIL: {len(failures)} benchmark(s) regressed more than {args.threshold:.0%}: {', '.join(failures)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
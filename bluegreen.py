@@ -0,0 +1,186 @@
+import fcntl
+import os
+import signal
+import time
+from contextlib import asynccontextmanager, contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+from logparse import LogMonitor
+from logtail import LogTailer
+from profiles import DEFAULT_GRACE_PERIOD, Profile, pid_alive, wait_for_exit
+
+DEFAULT_READY_TIMEOUT = 30.0
+DEFAULT_MIN_CONNECTIONS = 1
+POLL_INTERVAL = 0.1
+
+# Lines an outgoing cloudflared logs when it cuts a request short.
+DROP_MARKERS = ("context canceled", "Request failed", "stream canceled", "connection reset")
+
+
+@dataclass
+class RestartReport:
+    mode: str # "blue-green", "cold" or "rolled-back"
+    old_pid: Optional[int]
+    new_pid: Optional[int]
+    ready_after: Optional[float] # Seconds until the new process registered
+    downtime: float # Seconds with no process serving the tunnel
+    dropped: int # In-flight requests the old process reported cutting off
+    connections: int # Edge connections the new process had registered
+    error: Optional[str] = None
+
+
+def _previous_log(profile: Profile) -> Path:
+    return profile.log_file.with_name(profile.log_file.name + ".1")
+
+
+def _wait_ready(profile: Profile, pid: int, min_connections: int, timeout: float):
+    """Follow the new process's log until it registers enough edge connections."""
+    tailer = LogTailer(profile.log_file, backfill_bytes=1 << 30)
+    monitor = LogMonitor()
+    deadline = time.monotonic() + timeout
+    try:
+        while True:
+            monitor.feed(tailer.read_lines())
+            if len(monitor.connections) >= min_connections:
+                return True, len(monitor.connections), None
+            if not pid_alive(pid):
+                error = monitor.last_error.message if monitor.last_error else "process exited"
+                return False, len(monitor.connections), f"new cloudflared exited: {error}"
+            if time.monotonic() >= deadline:
+                return False, len(monitor.connections), f"no edge connection registered within {timeout:.0f}s"
+            time.sleep(POLL_INTERVAL)
+    finally:
+        tailer.close()
+
+
+def _count_drops(f) -> int:
+    """Count request-abort lines in `f` from its current position (when draining began)."""
+    dropped = 0
+    for line in f:
+        text = line.decode("utf-8", errors="replace")
+        if any(marker in text for marker in DROP_MARKERS):
+            dropped += 1
+    return dropped
+
+
+def _drain(pid: int, grace_period: float) -> bool:
+    """SIGINT the old process, then SIGKILL it if it outlives the grace period."""
+    try:
+        os.kill(pid, signal.SIGINT)
+    except ProcessLookupError:
+        return True
+    if wait_for_exit(pid, grace_period):
+        return True
+    try:
+        os.kill(pid, signal.SIGKILL)
+    except ProcessLookupError:
+        return True
+    wait_for_exit(pid, 5)
+    return False
+
+
+@contextmanager
+def restart_lock(profile: Profile):
+    """One restart, stop or reload of a profile at a time, across the dashboard and CLI processes."""
+    profile.restart_lock_file.parent.mkdir(parents=True, exist_ok=True)
+    with open(profile.restart_lock_file, "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        yield
+
+
+@asynccontextmanager
+async def restart_lock_async(profile: Profile):
+    """Asyncio version of `restart_lock`: the wait happens in a thread, not on the event loop."""
+    import asyncio
+
+    profile.restart_lock_file.parent.mkdir(parents=True, exist_ok=True)
+    with open(profile.restart_lock_file, "a") as lock:
+        await asyncio.to_thread(fcntl.flock, lock, fcntl.LOCK_EX)
+        yield
+
+
+def blue_green_restart(profile: Profile, tunnel_id: str, cred_path: Path,
+                       grace_period: float = DEFAULT_GRACE_PERIOD,
+                       ready_timeout: float = DEFAULT_READY_TIMEOUT,
+                       min_connections: int = DEFAULT_MIN_CONNECTIONS,
+                       if_running: bool = False) -> Optional[RestartReport]:
+    """
+    Restart a profile's tunnel without a gap in service.
+
+    A second cloudflared replica is started for the same tunnel while the
+    old one keeps serving. Only after the new replica has registered
+    `min_connections` edge connections is the old one sent SIGINT, which
+    lets cloudflared finish in-flight requests for up to `grace_period`
+    seconds. If the new replica never becomes ready, it is killed and the
+    old one is left running.
+
+    Restarts of the same profile are serialized: a second one waits for
+    the first to finish, then replaces the replica it left running. With
+    `if_running`, a tunnel that is no longer running by then (it was stopped
+    meanwhile) stays stopped and None is returned.
+    """
+    with restart_lock(profile):
+        if if_running and profile.running_pid() is None:
+            return None
+        return _restart(profile, tunnel_id, cred_path, grace_period, ready_timeout, min_connections)
+
+
+def _restart(profile: Profile, tunnel_id: str, cred_path: Path, grace_period: float,
+             ready_timeout: float, min_connections: int) -> RestartReport:
+    old_pid = profile.running_pid()
+    previous_log = _previous_log(profile)
+
+    # The old process keeps its file descriptor, so moving the log aside
+    # gives the new process a log of its own to watch for readiness.
+    if profile.log_file.exists():
+        os.replace(profile.log_file, previous_log)
+
+    # The new replica's supervisor records its own PID, metrics address and
+    # control socket; a rollback has to put the old ones back.
+    old_state = profile.read_state() if old_pid is not None else None
+
+    started = time.monotonic()
+    new_pid = profile.spawn(tunnel_id, cred_path, grace_period=grace_period)
+    ready, connections, error = _wait_ready(profile, new_pid, min_connections, ready_timeout)
+    ready_at = time.monotonic()
+
+    if not ready:
+        # Hand the PID file back first, so the new replica's supervisor
+        # sees its exit as intended rather than restarting it.
+        if old_pid is not None:
+            profile.adopt(old_pid, old_state)
+        else:
+            profile.release()
+        if pid_alive(new_pid):
+            _drain(new_pid, 5)
+        if old_pid is not None:
+            failed_log = profile.log_file.with_name(profile.log_file.name + ".failed")
+            if profile.log_file.exists():
+                os.replace(profile.log_file, failed_log)
+            if previous_log.exists():
+                os.replace(previous_log, profile.log_file)
+            return RestartReport("rolled-back", old_pid, None, None, 0.0, 0, 0, error)
+        return RestartReport("cold", None, None, None, ready_at - started, 0, connections, error)
+
+    if old_pid is None:
+        # Nothing was serving before, so the whole start-up was downtime.
+        return RestartReport("cold", None, new_pid, ready_at - started, ready_at - started, 0, connections)
+
+    # If the old process died on its own while we waited, there was a gap.
+    downtime = 0.0 if pid_alive(old_pid) else ready_at - started
+    # Hold the old log open: its supervisor archives it once the old process exits.
+    try:
+        old_log = open(previous_log, "rb")
+        old_log.seek(0, os.SEEK_END)
+    except OSError:
+        old_log = None
+    _drain(old_pid, grace_period)
+    if old_log is None:
+        dropped = 0
+    else:
+        with old_log:
+            time.sleep(POLL_INTERVAL) # Let the supervisor flush the old process's last lines
+            dropped = _count_drops(old_log)
+    return RestartReport("blue-green", old_pid, new_pid, ready_at - started, downtime, dropped, connections)
@@ -36,6 +36,27 @@ echo -e "${GREEN}Building binary with PyInstaller...${NC}"
 pyinstaller --onefile --name "$APP_NAME" \
     --add-data "tui.py:." \
     --add-data "utils.py:." \
+    --add-data "logtail.py:." \
+    --add-data "logparse.py:." \
+    --add-data "config.py:." \
+    --add-data "profiles.py:." \
+    --add-data "bluegreen.py:." \
+    --add-data "httpclient.py:." \
+    --add-data "probe.py:." \
+    --add-data "routing.py:." \
+    --add-data "inventory.py:." \
+    --add-data "reconcile.py:." \
+    --add-data "metrics.py:." \
+    --add-data "logrotate.py:." \
+    --add-data "supervisor.py:." \
+    --add-data "control.py:." \
+    --add-data "exporter.py:." \
+    --add-data "latency.py:." \
+    --add-data "history.py:." \
+    --add-data "bench.py:." \
+    --add-data "simulator.py:." \
+    --add-data "ingress.py:." \
+    --add-data "changeset.py:." \
     --collect-all "rich" \
     --collect-all "textual" \
     --collect-all "typer" \
@@ -0,0 +1,108 @@
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from config import ConfigStore, IngressRule
+from routing import Route, merge_ingress
+
+
+@dataclass
+class StagedRemoval:
+    rule_id: str
+    index: int # Position when it was staged; the rule is found again by content
+    raw: dict
+    label: str
+
+
+@dataclass
+class CommitResult:
+    added: int = 0
+    updated: int = 0
+    removed: int = 0
+    skipped: List[str] = field(default_factory=list) # Removals of rules that were already gone
+
+    @property
+    def changed(self) -> bool:
+        return bool(self.added or self.updated or self.removed)
+
+
+def _label(hostname, path) -> str:
+    return f"{hostname or '*'}{' ' + path if path else ''}"
+
+
+class Changeset:
+    """
+    Ingress edits staged in the dashboard and written together: one locked,
+    atomic config write and one tunnel reload for a whole burst of edits.
+
+    Adds are keyed by (hostname, path), so a second add for the same rule
+    replaces the first, and removing a staged add just unstages it. On
+    commit the removals go first, then the adds through `merge_ingress`,
+    against the config as it is on disk at that moment.
+    """
+
+    def __init__(self):
+        self.adds: Dict[Tuple[str, Optional[str]], Route] = {}
+        self.removals: Dict[str, StagedRemoval] = {} # rule id -> removal
+
+    def __len__(self) -> int:
+        return len(self.adds) + len(self.removals)
+
+    def add(self, route: Route):
+        self.adds[(route.hostname, route.path)] = route
+
+    def remove(self, rule: IngressRule):
+        self.removals[rule.id] = StagedRemoval(rule.id, rule.index, dict(rule.raw),
+                                               _label(rule.hostname, rule.path))
+
+    def keep(self, rule: IngressRule) -> bool:
+        """Drop a staged removal of `rule`; returns whether there was one."""
+        return self.removals.pop(rule.id, None) is not None
+
+    def unstage(self, key: Tuple[str, Optional[str]]) -> Optional[Route]:
+        """Drop a staged add; returns it, or None if there was none."""
+        return self.adds.pop(key, None)
+
+    def pending(self, rule: IngressRule) -> Optional[str]:
+        """How a staged edit changes `rule`: "remove", "update" or None."""
+        if rule.id in self.removals:
+            return "remove"
+        route = self.adds.get((rule.hostname, rule.path))
+        if route is not None and route.service != rule.service:
+            return "update"
+        return None
+
+    def clear(self):
+        self.adds.clear()
+        self.removals.clear()
+
+    def apply(self, config: dict) -> CommitResult:
+        """Apply the staged edits to `config` in place."""
+        result = CommitResult()
+        ingress = config.get("ingress")
+        if not isinstance(ingress, list):
+            ingress = []
+        # A rule is found again by content, preferring the position it had
+        # when staged: edits made elsewhere since may have moved it.
+        doomed = set()
+        for removal in self.removals.values():
+            found = [i for i, raw in enumerate(ingress) if raw == removal.raw and i not in doomed]
+            if not found:
+                result.skipped.append(removal.label)
+                continue
+            doomed.add(removal.index if removal.index in found else found[0])
+        if doomed:
+            ingress[:] = [raw for i, raw in enumerate(ingress) if i not in doomed]
+            result.removed = len(doomed)
+        if self.adds:
+            result.added, result.updated = merge_ingress(config, list(self.adds.values()))
+        return result
+
+    def commit(self, store: ConfigStore) -> CommitResult:
+        """
+        Write the staged edits in one transaction on `store` and clear them.
+        If the write fails, they stay staged.
+        """
+        with store.transaction() as config:
+            result = self.apply(config)
+        self.clear()
+        return result
@@ -0,0 +1,245 @@
+import copy
+import fcntl
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+_YAML = None
+
+
+def _yaml():
+    """
+    (yaml, SafeLoader, SafeDumper), importing PyYAML on first use and
+    preferring libyaml's C loader/dumper.
+
+    Commands like `stop` never parse YAML, so they don't pay for the import.
+    """
+    global _YAML
+    if _YAML is None:
+        import yaml
+        try:
+            from yaml import CSafeLoader as Loader, CSafeDumper as Dumper
+        except ImportError:
+            from yaml import SafeLoader as Loader, SafeDumper as Dumper
+        _YAML = (yaml, Loader, Dumper)
+    return _YAML
+
+
+def __getattr__(name):
+    # `from config import SafeLoader` keeps working, it just imports yaml then.
+    if name == "SafeLoader":
+        return _yaml()[1]
+    if name == "SafeDumper":
+        return _yaml()[2]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+TUNNEL_DIR = Path.home() / ".tunnelflare"
+PID_FILE = TUNNEL_DIR / "tunnel.pid"
+LOG_FILE = TUNNEL_DIR / "tunnel.log"
+CONFIG_FILE = TUNNEL_DIR / "config.yml"
+
+CATCH_ALL_SERVICE = "http_status:404"
+
+
+@dataclass
+class IngressRule:
+    """One entry of the `ingress` list, with a stable identifier."""
+    id: str
+    index: int
+    hostname: Optional[str]
+    path: Optional[str]
+    service: str
+    raw: dict = field(repr=False, default_factory=dict)
+
+    @property
+    def is_catch_all(self) -> bool:
+        return not self.hostname and not self.path
+
+
+def build_ingress(config: Optional[dict]) -> List[IngressRule]:
+    """
+    Turn the raw `ingress` list into IngressRule objects.
+
+    Rule ids are derived from hostname and path, with an occurrence suffix
+    for duplicates, so they stay the same across reloads as long as the
+    rules themselves don't change.
+    """
+    rules = []
+    seen: Dict[str, int] = {}
+    if not config:
+        return rules
+    for index, raw in enumerate(config.get("ingress") or []):
+        if not isinstance(raw, dict):
+            continue
+        hostname = raw.get("hostname")
+        path = raw.get("path")
+        key = f"{hostname or '*'}{path or ''}"
+        count = seen.get(key, 0)
+        seen[key] = count + 1
+        rule_id = key if count == 0 else f"{key}#{count}"
+        rules.append(IngressRule(rule_id, index, hostname, path, str(raw.get("service", "")), raw))
+    return rules
+
+
+class ConfigStore:
+    """
+    Cached view of a tunnel `config.yml`.
+
+    The file is parsed once and the result is reused until its stat
+    signature (mtime, size, inode, device) changes, so polling callers pay
+    one `stat()` instead of a full YAML parse.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._signature = None
+        self._config = None
+        self._ingress: List[IngressRule] = []
+        self._index = None
+
+    def _stat_signature(self) -> Optional[Tuple[int, int, int, int]]:
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size, st.st_ino, st.st_dev)
+
+    def exists(self) -> bool:
+        return self._stat_signature() is not None
+
+    def _refresh(self):
+        signature = self._stat_signature()
+        if signature == self._signature:
+            return
+        if signature is None:
+            config = None
+        else:
+            with open(self.path, "r") as f:
+                yaml, loader, _ = _yaml()
+                config = yaml.load(f, Loader=loader)
+        self._config = config
+        self._ingress = build_ingress(config)
+        self._index = None
+        self._signature = signature
+
+    def load(self) -> Optional[dict]:
+        """
+        Return the parsed config, or None if the file does not exist.
+
+        The returned dict is shared with other callers; use `edit()` to get
+        a copy that is safe to modify.
+        """
+        with self._lock:
+            self._refresh()
+            return self._config
+
+    def edit(self) -> Optional[dict]:
+        """Return a private deep copy of the config for modification."""
+        return copy.deepcopy(self.load())
+
+    def ingress(self) -> List[IngressRule]:
+        with self._lock:
+            self._refresh()
+            return self._ingress
+
+    def ingress_index(self):
+        """The ingress rules compiled for matching (see ingress.py), rebuilt when the file changes."""
+        from ingress import IngressIndex
+
+        with self._lock:
+            self._refresh()
+            if self._index is None:
+                self._index = IngressIndex(self._ingress)
+            return self._index
+
+    def get(self, key: str, default=None):
+        config = self.load()
+        if not isinstance(config, dict):
+            return default
+        return config.get(key, default)
+
+    @contextmanager
+    def locked(self):
+        """
+        Hold the config's write lock: an flock on a `.lock` file next to
+        it, so TunnelFlare processes (the dashboard, `route`, `apply`)
+        take turns writing instead of overwriting each other's edits.
+        """
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path.with_name(self.path.name + ".lock"), "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+
+    def _write(self, config: dict):
+        # A temporary file renamed over the config: readers see the old or
+        # the new file, never half of one. mkstemp creates it with mode 600.
+        fd, tmp = tempfile.mkstemp(dir=self.path.parent, prefix=f".{self.path.name}.")
+        try:
+            with os.fdopen(fd, "w") as f:
+                yaml, _, dumper = _yaml()
+                yaml.dump(config, f, Dumper=dumper, sort_keys=False)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+        except BaseException:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            raise
+        with self._lock:
+            self._config = config
+            self._ingress = build_ingress(config)
+            self._index = None
+            self._signature = self._stat_signature()
+
+    def save(self, config: dict):
+        """Write `config` to disk atomically, under the write lock, and prime the cache with it."""
+        with self.locked():
+            self._write(config)
+
+    @contextmanager
+    def transaction(self):
+        """
+        Read-modify-write under the write lock. Yields a private copy of
+        the config as it is on disk now ({} if there is none yet); if the
+        block changes it, it is written back atomically on exit.
+
+            with store.transaction() as config:
+                config["ingress"].append(rule)
+        """
+        with self.locked():
+            with self._lock:
+                self._signature = None # Reread: another process may have just written it
+            current = self.load()
+            config = copy.deepcopy(current) if current is not None else {}
+            yield config
+            if config != (current if current is not None else {}):
+                self._write(config)
+
+    def invalidate(self):
+        with self._lock:
+            self._signature = None
+            self._config = None
+            self._ingress = []
+            self._index = None
+
+
+_stores: Dict[Path, ConfigStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(path: Path = CONFIG_FILE) -> ConfigStore:
+    """Return the process-wide ConfigStore for `path`."""
+    path = Path(path)
+    with _stores_lock:
+        store = _stores.get(path)
+        if store is None:
+            store = _stores[path] = ConfigStore(path)
+        return store
@@ -0,0 +1,224 @@
+import json
+import os
+import selectors
+import socket
+import time
+from pathlib import Path
+from typing import Callable, Dict, Optional
+
+from profiles import Profile
+
+SOCKET_TIMEOUT = 0.5 # Seconds a client may take; a live supervisor answers in well under 1 ms
+MAX_REQUEST = 1024
+
+
+class _Client:
+    __slots__ = ("request", "reply", "deadline")
+
+    def __init__(self, deadline: float):
+        self.request = bytearray()
+        self.reply: Optional[memoryview] = None # Left to send, once answered
+        self.deadline = deadline
+
+
+class ControlServer:
+    """
+    A profile's control socket, served by its supervisor.
+
+    Clients connect, send one command line (only "status" for now) and
+    read one JSON line back; `handler(command)` builds the reply. Nothing
+    here blocks: the listening socket and every client are waited on in
+    the supervisor's own selector (see `attach()`), so a slow or stalled
+    client never holds up cloudflared's output. A client that hasn't
+    finished after SOCKET_TIMEOUT seconds is dropped by `expire()`.
+    """
+
+    def __init__(self, path: Path, handler: Callable[[str], dict]):
+        self.path = Path(path)
+        self.handler = handler
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._clients: Dict[socket.socket, _Client] = {}
+        self._selector: Optional[selectors.BaseSelector] = None
+        self._bind()
+
+    def _bind(self):
+        # Bound under a temporary name and renamed over the path (replacing a
+        # dead supervisor's socket, or the replica we take over from), so
+        # the path never goes missing: see `stale()`.
+        tmp = self.path.with_name(f"{self.path.name}.{os.getpid()}")
+        try:
+            tmp.unlink()
+        except FileNotFoundError:
+            pass
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.bind(str(tmp))
+        os.chmod(tmp, 0o600)
+        self.sock.listen(16)
+        self.sock.setblocking(False)
+        os.replace(tmp, self.path)
+        self._inode = os.stat(self.path).st_ino
+
+    def attach(self, selector: selectors.BaseSelector):
+        """
+        Wait on the socket and its clients in `selector`. Their keys carry
+        this server as data; pass ready ones to `handle()`.
+        """
+        self._selector = selector
+        selector.register(self.sock, selectors.EVENT_READ, self)
+        for conn, client in self._clients.items():
+            selector.register(conn, selectors.EVENT_WRITE if client.reply else selectors.EVENT_READ, self)
+
+    def detach(self):
+        """Stop using the selector given to `attach()` (about to be closed)."""
+        self._selector = None
+
+    def handle(self, key: selectors.SelectorKey):
+        if key.fileobj is self.sock:
+            self._accept()
+        elif key.fileobj in self._clients:
+            self._progress(key.fileobj)
+
+    def _accept(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                return # Out of descriptors, say: retried on the next wakeup
+            conn.setblocking(False)
+            self._clients[conn] = _Client(time.monotonic() + SOCKET_TIMEOUT)
+            if self._selector is not None:
+                self._selector.register(conn, selectors.EVENT_READ, self)
+
+    def _progress(self, conn: socket.socket):
+        client = self._clients[conn]
+        try:
+            if client.reply is None:
+                chunk = conn.recv(MAX_REQUEST)
+                client.request += chunk
+                if chunk and b"\n" not in client.request and len(client.request) < MAX_REQUEST:
+                    return # Wait for the rest of the line
+                command = client.request.decode("utf-8", errors="replace").strip() or "status"
+                try:
+                    reply = self.handler(command)
+                except Exception as e:
+                    reply = {"error": str(e) or type(e).__name__}
+                client.reply = memoryview(json.dumps(reply).encode() + b"\n")
+                if self._selector is not None:
+                    self._selector.modify(conn, selectors.EVENT_WRITE, self)
+            sent = conn.send(client.reply)
+            client.reply = client.reply[sent:]
+            if client.reply:
+                return # The rest when the client has read some
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            pass # Client went away
+        self._drop(conn)
+
+    def _drop(self, conn: socket.socket):
+        del self._clients[conn]
+        if self._selector is not None:
+            try:
+                self._selector.unregister(conn)
+            except (KeyError, ValueError):
+                pass
+        conn.close()
+
+    def expire(self, now: Optional[float] = None):
+        """Drop clients that have taken longer than SOCKET_TIMEOUT."""
+        now = time.monotonic() if now is None else now
+        for conn in [c for c, client in self._clients.items() if client.deadline <= now]:
+            self._drop(conn)
+
+    def next_deadline(self) -> Optional[float]:
+        """When `expire()` has something to do next, as a time.monotonic() value."""
+        return min((client.deadline for client in self._clients.values()), default=None)
+
+    def stale(self) -> bool:
+        """
+        True if the socket path is gone: a replica took it over and has
+        since exited, e.g. after a rolled-back blue/green restart.
+        """
+        return not self.path.exists()
+
+    def reclaim(self):
+        """Serve on the path again, with a new socket."""
+        if self._selector is not None:
+            self._selector.unregister(self.sock)
+        self.sock.close()
+        self._bind()
+        if self._selector is not None:
+            self._selector.register(self.sock, selectors.EVENT_READ, self)
+
+    def close(self):
+        for conn in list(self._clients):
+            self._drop(conn)
+        self.sock.close()
+        try:
+            # Only remove the socket if a newer supervisor hasn't replaced it.
+            if os.stat(self.path).st_ino == self._inode:
+                self.path.unlink()
+        except OSError:
+            pass
+
+
+def query(path: Path, command: str = "status", timeout: float = SOCKET_TIMEOUT) -> dict:
+    """Send `command` to a control socket and return the decoded reply."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(str(path))
+        sock.sendall(command.encode() + b"\n")
+        reply = b""
+        while not reply.endswith(b"\n"):
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            reply += chunk
+    return json.loads(reply)
+
+
+def offline_status(profile: Profile) -> dict:
+    """
+    What the PID and state files say, for profiles without a supervisor
+    to ask. Live-only fields (connections, ingress health) are None.
+    """
+    state = profile.read_state()
+    pid = profile.running_pid()
+    if pid:
+        status = "running"
+    elif state.get("supervisor_status") == "crash-loop":
+        status = "crash-loop"
+    else:
+        status = "stopped"
+    started_at = state.get("started_at") if pid else None
+    return {
+        "profile": profile.name,
+        "state": status,
+        "pid": pid,
+        "supervisor_pid": None,
+        "tunnel_id": state.get("tunnel_id"),
+        "started_at": started_at,
+        "uptime": round(time.time() - started_at, 3) if started_at else None,
+        "restarts": state.get("restarts") or 0,
+        "last_exit": state.get("last_exit"),
+        "connections": None,
+        "locations": None,
+        "last_error": None,
+        "errors_last_minute": None,
+        "metrics": state.get("metrics") if pid else None,
+        "ingress": None,
+    }
+
+
+def profile_status(profile: Profile, timeout: float = SOCKET_TIMEOUT) -> dict:
+    """Live status from the profile's supervisor, falling back to its files."""
+    if profile.socket_file.exists():
+        try:
+            status = query(profile.socket_file, "status", timeout)
+            if isinstance(status, dict) and "error" not in status:
+                return status
+        except (OSError, ValueError):
+            pass # Stale socket from a killed supervisor
+    return offline_status(profile)
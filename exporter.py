@@ -0,0 +1,268 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+
+from control import profile_status
+from logparse import LogMonitor
+from logtail import LogTailer
+from probe import ProbeEngine, ProbeSpec, build_specs
+from profiles import Profile, process_resources
+
+DEFAULT_LISTEN = "127.0.0.1:9464"
+DEFAULT_INTERVAL = 15.0
+# Probe latency buckets, in seconds; probes time out after 1s.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+INTERNET_PROBE = ProbeSpec("internet", "tcp://1.1.1.1:443", "CONNECT")
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _value(value: float) -> str:
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+def _labels(labels: Labels, extra: str = "") -> str:
+    parts = [f'{k}="{_escape(v)}"' for k, v in labels]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Histogram:
+    """Cumulative Prometheus histogram with fixed buckets."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+
+class Registry:
+    """
+    Metric families for one exposition, rendered in the Prometheus text
+    format. Families keep the order they are first written in.
+    """
+
+    def __init__(self):
+        self._families: Dict[str, Tuple[str, str, List[str]]] = {}
+
+    def _family(self, name: str, kind: str, help_text: str) -> List[str]:
+        if name not in self._families:
+            self._families[name] = (kind, help_text, [])
+        return self._families[name][2]
+
+    def sample(self, name: str, kind: str, help_text: str, value: float, labels: Labels = ()):
+        self._family(name, kind, help_text).append(f"{name}{_labels(labels)} {_value(value)}")
+
+    def histogram(self, name: str, help_text: str, histogram: Histogram, labels: Labels = ()):
+        lines = self._family(name, "histogram", help_text)
+        for bound, count in zip(histogram.buckets, histogram.counts):
+            le = 'le="%g"' % bound
+            lines.append(f"{name}_bucket{_labels(labels, le)} {count}")
+        le = 'le="+Inf"'
+        lines.append(f"{name}_bucket{_labels(labels, le)} {histogram.count}")
+        lines.append(f"{name}_sum{_labels(labels)} {_value(histogram.sum)}")
+        lines.append(f"{name}_count{_labels(labels)} {histogram.count}")
+
+    def render(self) -> bytes:
+        out = []
+        for name, (kind, help_text, lines) in self._families.items():
+            out.append(f"# HELP {name} {help_text}")
+            out.append(f"# TYPE {name} {kind}")
+            out.extend(lines)
+        return ("\n".join(out) + "\n").encode()
+
+
+class _ProbeSeries:
+    """The probe metrics of one rule, exported with the same labels."""
+
+    def __init__(self, labels: Labels):
+        self.labels = labels
+        self.latency = Histogram()
+        self.failures = 0
+        self.up = 0
+
+
+class _ProfileWatch:
+    """Log-derived counters for one profile, fed incrementally."""
+
+    def __init__(self, profile: Profile):
+        self.profile = profile
+        # Start at the end: counters cover what is logged while we watch.
+        self.tailer = LogTailer(profile.log_file, backfill_bytes=0)
+        self.monitor = LogMonitor()
+        self.lines_by_level: Dict[str, int] = {}
+
+    def poll(self):
+        for event in self.monitor.feed(self.tailer.read_lines()):
+            self.lines_by_level[event.level] = self.lines_by_level.get(event.level, 0) + 1
+
+
+class Exporter:
+    """
+    Collects TunnelFlare's health signals for Prometheus.
+
+    A single background thread runs one probe sweep over every profile's
+    origins (plus an internet reachability check) per `interval`, reads
+    the tunnels' logs and /proc, and renders the whole exposition once.
+    Scrapes are served that cached text, so any number of scrapers cost
+    the same as one and never trigger probes of their own.
+    """
+
+    def __init__(self, profiles: List[Profile], interval: float = DEFAULT_INTERVAL):
+        self.profiles = profiles
+        self.interval = interval
+        self.engine = ProbeEngine()
+        self.probes: Dict[str, _ProbeSeries] = {} # "profile/rule id" -> its series
+        self.internet_up = 0
+        self.watches = {profile.name: _ProfileWatch(profile) for profile in profiles}
+        self.sweeps = 0
+        self.sweep_seconds = 0.0
+        self.body = Registry().render()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def collect(self):
+        """Run one round of probes and rebuild the exposition."""
+        started = time.monotonic()
+        specs: List[ProbeSpec] = [INTERNET_PROBE]
+        owners: Dict[str, Profile] = {}
+        for profile in self.profiles:
+            try:
+                rules = profile.store.ingress()
+            except Exception:
+                continue # Unreadable config: the profile still gets process metrics
+            for spec in build_specs(rules):
+                rule_id = f"{profile.name}/{spec.rule_id}"
+                owners[rule_id] = profile
+                specs.append(ProbeSpec(rule_id, spec.url, spec.method, spec.expect, spec.verify))
+
+        results = self.engine.run(specs)
+        internet = results.pop(INTERNET_PROBE.rule_id, None)
+        self.internet_up = int(bool(internet and internet.ok))
+        for rule_id, result in results.items():
+            labels = (("profile", owners[rule_id].name), ("rule", rule_id.split("/", 1)[1]),
+                      ("service", result.url))
+            series = self.probes.get(rule_id)
+            if series is None or series.labels != labels:
+                # New rule, or its service changed: a new origin starts from zero.
+                series = self.probes[rule_id] = _ProbeSeries(labels)
+            if result.latency is not None:
+                series.latency.observe(result.latency)
+            series.failures += 0 if result.ok else 1
+            series.up = int(result.ok)
+        # Rules removed from the config (or no longer probeable) stop being exported.
+        for rule_id in [r for r in self.probes if r not in results]:
+            del self.probes[rule_id]
+
+        for watch in self.watches.values():
+            try:
+                watch.poll()
+            except OSError:
+                pass
+        self.sweeps += 1
+        self.sweep_seconds = time.monotonic() - started
+        self.body = self.render()
+
+    def render(self) -> bytes:
+        registry = Registry()
+        registry.sample("tunnelflare_internet_up", "gauge",
+                        "Whether the internet reachability check succeeded.", self.internet_up)
+        for series in self.probes.values():
+            registry.histogram("tunnelflare_probe_duration_seconds",
+                               "Origin health check latency.", series.latency, series.labels)
+            registry.sample("tunnelflare_probe_failures_total", "counter",
+                            "Failed origin health checks.", series.failures, series.labels)
+            registry.sample("tunnelflare_probe_up", "gauge",
+                            "Whether the last origin health check succeeded.", series.up, series.labels)
+
+        for profile in self.profiles:
+            labels = (("profile", profile.name),)
+            # The supervisor knows the live connection count; the log only
+            # shows connections registered since we started following it.
+            status = profile_status(profile)
+            pid = status["pid"]
+            watch = self.watches[profile.name]
+            connections = status["connections"]
+            if connections is None:
+                connections = len(watch.monitor.connections)
+            registry.sample("tunnelflare_tunnel_up", "gauge",
+                            "Whether the tunnel's cloudflared process is running.", int(pid is not None), labels)
+            registry.sample("tunnelflare_tunnel_restarts_total", "counter",
+                            "Restarts by the tunnel's supervisor since it started.", status["restarts"], labels)
+            registry.sample("tunnelflare_tunnel_crash_loop", "gauge",
+                            "Whether the supervisor gave up after a crash loop.",
+                            int(status["state"] == "crash-loop"), labels)
+            registry.sample("tunnelflare_tunnel_edge_connections", "gauge",
+                            "Registered edge connections.", connections, labels)
+            for level, count in sorted(watch.lines_by_level.items()):
+                registry.sample("tunnelflare_log_lines_total", "counter",
+                                "Tunnel log lines by level.", count, labels + (("level", level),))
+            resources = process_resources(pid) if pid else None
+            for key, value in (resources or {}).items():
+                kind = "counter" if key.endswith("_total") else "gauge"
+                registry.sample(f"tunnelflare_process_{key}", kind,
+                                f"cloudflared process {key.replace('_', ' ')}.", value, labels)
+
+        registry.sample("tunnelflare_exporter_sweeps_total", "counter",
+                        "Probe sweeps run by the exporter.", self.sweeps)
+        registry.sample("tunnelflare_exporter_sweep_duration_seconds", "gauge",
+                        "How long the last probe sweep took.", self.sweep_seconds)
+        return registry.render()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                self.collect()
+            except Exception:
+                pass # Keep serving the previous exposition
+            self._stop.wait(self.interval)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, name="exporter", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        self.engine.close()
+        for watch in self.watches.values():
+            watch.tailer.close()
+
+
+def serve(exporter: Exporter, listen: str = DEFAULT_LISTEN) -> ThreadingHTTPServer:
+    """An HTTP server exposing `exporter` on /metrics (call serve_forever())."""
+    host, _, port = listen.rpartition(":")
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.split("?", 1)[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = exporter.body
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    return ThreadingHTTPServer((host or "127.0.0.1", int(port)), Handler)
@@ -0,0 +1,199 @@
+import math
+import sqlite3
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# (bucket seconds, how long buckets are kept). Every sample is added to
+# each rollup as it is written, so nothing needs a downsampling pass.
+RESOLUTIONS = ((60, 2 * 86400), (3600, 90 * 86400))
+PRUNE_INTERVAL = 3600
+BUSY_TIMEOUT_MS = 2000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS series (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS points (
+    resolution INTEGER NOT NULL,
+    series_id INTEGER NOT NULL,
+    bucket INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    sum REAL NOT NULL,
+    min REAL NOT NULL,
+    max REAL NOT NULL,
+    PRIMARY KEY (resolution, series_id, bucket)
+) WITHOUT ROWID;
+"""
+
+_UPSERT = """
+INSERT INTO points (resolution, series_id, bucket, count, sum, min, max)
+VALUES (?, ?, ?, 1, ?, ?, ?)
+ON CONFLICT (resolution, series_id, bucket) DO UPDATE SET
+    count = count + 1,
+    sum = sum + excluded.sum,
+    min = MIN(min, excluded.min),
+    max = MAX(max, excluded.max)
+"""
+
+
+@dataclass
+class Point:
+    """One rollup bucket of a series."""
+    time: int # Bucket start, epoch seconds
+    count: int
+    sum: float
+    min: float
+    max: float
+
+    @property
+    def avg(self) -> float:
+        return self.sum / self.count if self.count else math.nan
+
+
+def pick_resolution(start: float, end: float, max_points: int = 1500) -> int:
+    """The finest resolution that covers start..end in at most `max_points` buckets."""
+    now = time.time()
+    for seconds, keep in RESOLUTIONS:
+        if start >= now - keep and (end - start) / seconds <= max_points:
+            return seconds
+    return RESOLUTIONS[-1][0]
+
+
+class HistoryStore:
+    """
+    A tunnel's health history in an SQLite database (WAL mode).
+
+    The supervisor appends one sample per series per probe round; each
+    sample is folded into per-minute and per-hour buckets holding
+    count/sum/min/max, so a day at minute resolution is at most 1440 rows
+    per series and reading any range is an index scan. WAL lets the
+    dashboard and `tunnelflare history` read while the supervisor writes.
+    """
+
+    def __init__(self, path: Path, readonly: bool = False):
+        self.path = Path(path)
+        if readonly:
+            self.db = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True,
+                                      timeout=BUSY_TIMEOUT_MS / 1000, check_same_thread=False)
+        else:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self.db = sqlite3.connect(str(self.path), timeout=BUSY_TIMEOUT_MS / 1000,
+                                      check_same_thread=False)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")
+            self.db.executescript(_SCHEMA)
+        self._series: Dict[str, int] = {}
+        self._last_prune = 0.0
+
+    @classmethod
+    def open_readonly(cls, path: Path) -> Optional["HistoryStore"]:
+        """The store at `path` for reading, or None if nothing has been recorded."""
+        if not Path(path).exists():
+            return None
+        try:
+            return cls(path, readonly=True)
+        except sqlite3.Error:
+            return None
+
+    def _series_id(self, name: str) -> int:
+        series_id = self._series.get(name)
+        if series_id is None:
+            self.db.execute("INSERT OR IGNORE INTO series (name) VALUES (?)", (name,))
+            series_id = self.db.execute("SELECT id FROM series WHERE name = ?", (name,)).fetchone()[0]
+            self._series[name] = series_id
+        return series_id
+
+    def record(self, samples: Dict[str, Optional[float]], now: Optional[float] = None):
+        """Add one sample per series, in a single transaction; None values are skipped."""
+        now = time.time() if now is None else now
+        rows = []
+        with self.db:
+            for name, value in samples.items():
+                if value is None or math.isnan(value):
+                    continue
+                series_id = self._series_id(name)
+                for seconds, _ in RESOLUTIONS:
+                    rows.append((seconds, series_id, int(now // seconds * seconds), value, value, value))
+            self.db.executemany(_UPSERT, rows)
+        if now - self._last_prune >= PRUNE_INTERVAL:
+            self.prune(now)
+
+    def prune(self, now: Optional[float] = None):
+        """Drop buckets older than their resolution's retention."""
+        now = time.time() if now is None else now
+        with self.db:
+            for seconds, keep in RESOLUTIONS:
+                self.db.execute("DELETE FROM points WHERE resolution = ? AND bucket < ?",
+                                (seconds, int(now - keep)))
+        self._last_prune = now
+
+    def series(self) -> List[str]:
+        return [row[0] for row in self.db.execute("SELECT name FROM series ORDER BY name")]
+
+    def query(self, name: str, start: float, end: Optional[float] = None,
+              resolution: Optional[int] = None) -> List[Point]:
+        """Buckets of series `name` between `start` and `end`, oldest first."""
+        end = time.time() if end is None else end
+        resolution = resolution or pick_resolution(start, end)
+        rows = self.db.execute(
+            "SELECT p.bucket, p.count, p.sum, p.min, p.max FROM points p JOIN series s ON s.id = p.series_id"
+            " WHERE s.name = ? AND p.resolution = ? AND p.bucket >= ? AND p.bucket <= ?"
+            " ORDER BY p.bucket",
+            (name, resolution, int(start // resolution * resolution), int(end)))
+        return [Point(*row) for row in rows]
+
+    def summary(self, start: float, end: Optional[float] = None,
+                names: Optional[Iterable[str]] = None) -> Dict[str, Tuple[int, float, float, float]]:
+        """Per series: (samples, min, average, max) over start..end."""
+        end = time.time() if end is None else end
+        resolution = pick_resolution(start, end)
+        rows = self.db.execute(
+            "SELECT s.name, SUM(p.count), MIN(p.min), SUM(p.sum), MAX(p.max)"
+            " FROM points p JOIN series s ON s.id = p.series_id"
+            " WHERE p.resolution = ? AND p.bucket >= ? AND p.bucket <= ? GROUP BY s.name ORDER BY s.name",
+            (resolution, int(start // resolution * resolution), int(end)))
+        wanted = set(names) if names is not None else None
+        return {name: (count, low, total / count, high) for name, count, low, total, high in rows
+                if wanted is None or name in wanted}
+
+    def close(self):
+        self.db.close()
+
+
+def downsample(points: List[Point], start: float, end: float, width: int) -> List[float]:
+    """
+    Averages of `points` in `width` equal slices of start..end, for a
+    sparkline; slices without data are NaN.
+    """
+    if width <= 0 or end <= start:
+        return []
+    sums = [0.0] * width
+    counts = [0] * width
+    step = (end - start) / width
+    for point in points:
+        index = int((point.time - start) / step)
+        if 0 <= index < width:
+            sums[index] += point.sum
+            counts[index] += point.count
+    return [s / c if c else math.nan for s, c in zip(sums, counts)]
+
+
+def format_value(series: str, value: float) -> str:
+    """A series value with its unit, for tables."""
+    if math.isnan(value):
+        return "-"
+    if series.startswith("latency_ms"):
+        return f"{value:.1f} ms" if value < 10 else f"{value:.0f} ms"
+    if series == "rss_bytes":
+        for unit in ("B", "KB", "MB", "GB"):
+            if value < 1024 or unit == "GB":
+                return f"{value:.0f} {unit}" if unit == "B" else f"{value:.1f} {unit}"
+            value /= 1024
+    if series == "cpu_percent":
+        return f"{value:.1f}%"
+    if series == "up" or series.startswith("origin_up"):
+        return f"{value * 100:.0f}%"
+    return f"{value:g}" if value.is_integer() else f"{value:.2f}"
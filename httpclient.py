@@ -0,0 +1,201 @@
+import asyncio
+import ssl
+from collections import deque
+from typing import Deque, Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+DEFAULT_PER_HOST = 32
+MAX_HEADER_BYTES = 64 * 1024
+USER_AGENT = "TunnelFlare"
+
+
+class HTTPError(Exception):
+    """Raised when an origin sends something that isn't valid HTTP/1.x."""
+
+
+class Response:
+    __slots__ = ("status", "reason", "headers", "body")
+
+    def __init__(self, status: int, reason: str, headers: Dict[str, str], body: bytes):
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.body = body
+
+
+class _Connection:
+    __slots__ = ("reader", "writer")
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+
+    def usable(self) -> bool:
+        return not self.writer.is_closing() and not self.reader.at_eof()
+
+    def close(self):
+        self.writer.close()
+
+
+class ConnectionPool:
+    """
+    Tiny asyncio HTTP/1.1 client with per-origin keep-alive pooling.
+
+    Only what TunnelFlare needs to talk to local origins: GET/HEAD (or any
+    body-less method), Content-Length and chunked responses, and at most
+    `per_host` concurrent connections per (scheme, host, port). A pool is
+    bound to the event loop it is first used on.
+
+    With `address`, every connection goes to that (host, port) instead,
+    while requests keep their URL's Host header and TLS server name, like
+    curl's --connect-to; `tunnelflare bench` uses it to go through a relay.
+    """
+
+    def __init__(self, per_host: int = DEFAULT_PER_HOST, address: Optional[Tuple[str, int]] = None):
+        self.per_host = per_host
+        self.address = address
+        self._idle: Dict[Tuple[str, str, int], Deque[_Connection]] = {}
+        self._limits: Dict[Tuple[str, str, int], asyncio.Semaphore] = {}
+        self._insecure_ctx = None
+        self._default_ctx = None
+
+    def _ssl_context(self, verify: bool) -> ssl.SSLContext:
+        if verify:
+            if self._default_ctx is None:
+                self._default_ctx = ssl.create_default_context()
+            return self._default_ctx
+        if self._insecure_ctx is None:
+            ctx = ssl.create_default_context()
+            ctx.check_hostname = False
+            ctx.verify_mode = ssl.CERT_NONE
+            self._insecure_ctx = ctx
+        return self._insecure_ctx
+
+    async def _connect(self, key, verify: bool) -> _Connection:
+        scheme, host, port = key
+        ssl_ctx = self._ssl_context(verify) if scheme == "https" else None
+        reader, writer = await asyncio.open_connection(
+            *(self.address or (host, port)), ssl=ssl_ctx, limit=MAX_HEADER_BYTES,
+            server_hostname=host if ssl_ctx else None,
+        )
+        return _Connection(reader, writer)
+
+    def _take_idle(self, key) -> Optional[_Connection]:
+        idle = self._idle.get(key)
+        while idle:
+            conn = idle.pop()
+            if conn.usable():
+                return conn
+            conn.close()
+        return None
+
+    def _release(self, key, conn: _Connection):
+        self._idle.setdefault(key, deque()).append(conn)
+
+    async def request(self, method: str, url: str, headers: Optional[Dict[str, str]] = None,
+                      verify: bool = True) -> Response:
+        """
+        Send one request and return the full response.
+
+        Callers are expected to wrap this in `asyncio.wait_for` if they need
+        a deadline; a cancelled request never returns its connection to the
+        pool.
+        """
+        parts = urlsplit(url)
+        scheme = parts.scheme.lower()
+        if scheme not in ("http", "https"):
+            raise HTTPError(f"Unsupported scheme: {scheme}")
+        host = parts.hostname or "localhost"
+        port = parts.port or (443 if scheme == "https" else 80)
+        key = (scheme, host, port)
+        target = parts.path or "/"
+        if parts.query:
+            target += "?" + parts.query
+
+        host_header = host if parts.port is None else f"{host}:{port}"
+        lines = [f"{method} {target} HTTP/1.1", f"Host: {host_header}",
+                 f"User-Agent: {USER_AGENT}", "Accept: */*", "Connection: keep-alive"]
+        for name, value in (headers or {}).items():
+            lines.append(f"{name}: {value}")
+        payload = ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+        limit = self._limits.get(key)
+        if limit is None:
+            limit = self._limits[key] = asyncio.Semaphore(self.per_host)
+
+        async with limit:
+            conn = self._take_idle(key)
+            reused = conn is not None
+            if conn is None:
+                conn = await self._connect(key, verify)
+            try:
+                try:
+                    response, keep_alive = await self._exchange(conn, method, payload)
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    if not reused:
+                        raise
+                    # The origin closed an idle keep-alive connection; retry fresh.
+                    conn.close()
+                    conn = await self._connect(key, verify)
+                    response, keep_alive = await self._exchange(conn, method, payload)
+            except BaseException:
+                conn.close()
+                raise
+            if keep_alive:
+                self._release(key, conn)
+            else:
+                conn.close()
+            return response
+
+    async def _exchange(self, conn: _Connection, method: str, payload: bytes):
+        conn.writer.write(payload)
+        await conn.writer.drain()
+        reader = conn.reader
+
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except asyncio.LimitOverrunError:
+            raise HTTPError("Response headers too large")
+        header_lines = head.decode("latin-1").split("\r\n")
+        status_line = header_lines[0].split(" ", 2)
+        if len(status_line) < 2 or not status_line[0].startswith("HTTP/1."):
+            raise HTTPError(f"Malformed status line: {header_lines[0]!r}")
+        status = int(status_line[1])
+        reason = status_line[2] if len(status_line) > 2 else ""
+        headers = {}
+        for line in header_lines[1:]:
+            if not line:
+                continue
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        keep_alive = headers.get("connection", "").lower() != "close" and status_line[0] != "HTTP/1.0"
+        if method == "HEAD" or status < 200 or status in (204, 304):
+            body = b""
+        elif "chunked" in headers.get("transfer-encoding", "").lower():
+            body = await self._read_chunked(reader)
+        elif "content-length" in headers:
+            body = await reader.readexactly(int(headers["content-length"]))
+        else:
+            body = await reader.read()
+            keep_alive = False
+        return Response(status, reason, headers, body), keep_alive
+
+    async def _read_chunked(self, reader: asyncio.StreamReader) -> bytes:
+        chunks = []
+        while True:
+            size_line = await reader.readuntil(b"\r\n")
+            size = int(size_line.split(b";", 1)[0].strip() or b"0", 16)
+            if size == 0:
+                # Skip optional trailers up to the terminating blank line.
+                while (await reader.readuntil(b"\r\n")) != b"\r\n":
+                    pass
+                return b"".join(chunks)
+            chunks.append(await reader.readexactly(size))
+            await reader.readexactly(2)
+
+    def close(self):
+        for idle in self._idle.values():
+            while idle:
+                idle.pop().close()
+        self._idle.clear()
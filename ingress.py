@@ -0,0 +1,213 @@
+import re
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Pattern, Tuple
+from urllib.parse import urlsplit
+
+from config import IngressRule
+
+
+class _Node:
+    """One label of the hostname trie, keyed from the TLD inwards."""
+    __slots__ = ("children", "exact", "wildcard")
+
+    def __init__(self):
+        self.children: Dict[str, "_Node"] = {}
+        self.exact: List[int] = [] # Positions of rules for exactly this hostname
+        self.wildcard: List[int] = [] # Positions of `*.<this hostname>` rules
+
+
+def _host(rule: IngressRule) -> str:
+    return str(rule.hostname or "").strip().lower()
+
+
+def _any_host(host: str) -> bool:
+    return host in ("", "*")
+
+
+def _labels(host: str) -> List[str]:
+    return host.split(".")[::-1]
+
+
+@dataclass
+class LintIssue:
+    rule: IngressRule
+    level: str # "error" or "warning"
+    kind: str # invalid, no-catch-all, duplicate, unreachable or overlap
+    message: str
+    other: Optional[IngressRule] = None # The earlier rule responsible, if any
+
+
+class IngressIndex:
+    """
+    The ingress list compiled for lookups, with cloudflared's first-match
+    semantics: a request goes to the first rule whose hostname (exact,
+    `*.` wildcard for any depth of subdomain, or none) and path regex
+    (searched, not anchored) both match.
+
+    Hostnames live in a trie of reversed labels, so a lookup walks the
+    request's labels once and collects every rule whose hostname could
+    match; only those few candidates are tried in order against their
+    precompiled path regexes.
+    """
+
+    def __init__(self, rules: List[IngressRule]):
+        self.rules: List[IngressRule] = []
+        self.paths: List[Optional[Pattern]] = []
+        self.invalid: Dict[int, str] = {} # Position -> why cloudflared would reject the rule
+        self._root = _Node()
+        self._any: List[int] = []
+        for rule in rules:
+            self.add(rule)
+
+    def add(self, rule: IngressRule):
+        """Index one more rule, after all the others."""
+        position = len(self.rules)
+        self.rules.append(rule)
+        pattern = None
+        if rule.path:
+            try:
+                pattern = re.compile(str(rule.path))
+            except re.error as e:
+                self.invalid[position] = f"invalid path regex {rule.path!r}: {e}"
+        self.paths.append(pattern)
+
+        host = _host(rule)
+        if _any_host(host):
+            self._any.append(position)
+            return
+        wildcard = host.startswith("*.")
+        if "*" in (host[2:] if wildcard else host):
+            self.invalid[position] = "a wildcard can only be the first label, e.g. *.example.com"
+            return
+        node = self._node(host[2:] if wildcard else host, create=True)
+        (node.wildcard if wildcard else node.exact).append(position)
+
+    def _node(self, host: str, create: bool = False) -> Optional[_Node]:
+        node = self._root
+        for label in _labels(host):
+            child = node.children.get(label)
+            if child is None:
+                if not create:
+                    return None
+                child = node.children[label] = _Node()
+            node = child
+        return node
+
+    def host_candidates(self, host: str) -> List[int]:
+        """Positions of the rules whose hostname matches `host`, in rule order."""
+        found = list(self._any)
+        node = self._root
+        labels = _labels(host.lower())
+        for depth, label in enumerate(labels):
+            node = node.children.get(label)
+            if node is None:
+                break
+            if depth < len(labels) - 1:
+                found += node.wildcard # *.suffix matches any name below it, not the suffix itself
+            else:
+                found += node.exact
+        found.sort()
+        return found
+
+    def match(self, host: str, path: str = "/") -> Optional[IngressRule]:
+        """The rule that serves a request for `host` and `path`, if any."""
+        for position in self.host_candidates(host):
+            pattern = self.paths[position]
+            if position not in self.invalid and (pattern is None or pattern.search(path)):
+                return self.rules[position]
+        return None
+
+    def match_url(self, url: str) -> Tuple[str, str, Optional[IngressRule]]:
+        """(host, path, rule) for a URL; the scheme may be left out."""
+        parts = urlsplit(url if "://" in url else f"https://{url}")
+        host = (parts.hostname or "").lower()
+        path = parts.path or "/"
+        return host, path, self.match(host, path)
+
+    def covering(self, position: int) -> List[int]:
+        """
+        Positions of the earlier rules whose hostname matches every hostname
+        rule `position` matches, in rule order.
+        """
+        host = _host(self.rules[position])
+        found = [p for p in self._any if p < position]
+        if _any_host(host):
+            return found
+        wildcard = host.startswith("*.")
+        labels = _labels(host[2:] if wildcard else host)
+        node = self._root
+        for depth, label in enumerate(labels):
+            node = node.children.get(label)
+            if node is None:
+                break
+            # A wildcard covers names strictly below its suffix; a wildcard
+            # for the same or a longer suffix is covered as a whole.
+            if wildcard or depth < len(labels) - 1:
+                found += [p for p in node.wildcard if p < position]
+            if depth == len(labels) - 1 and not wildcard:
+                found += [p for p in node.exact if p < position]
+        found.sort()
+        return found
+
+    def shadows(self, hostname: str, path: Optional[str] = None) -> List[IngressRule]:
+        """
+        The rules that would catch every request of a new rule for
+        `hostname` and `path` appended to the list, in rule order.
+        """
+        found = []
+        for position in self.host_candidates(hostname):
+            rule = self.rules[position]
+            if position not in self.invalid and (not rule.path or rule.path == path):
+                found.append(rule)
+        return found
+
+    def shadowing(self, hostname: str, path: Optional[str] = None) -> Optional[IngressRule]:
+        """The first of `shadows()`, if any. New rules go in front of it to be reachable."""
+        found = self.shadows(hostname, path)
+        return found[0] if found else None
+
+
+def _describe(rule: IngressRule) -> str:
+    return f"rule {rule.id} (#{rule.index + 1})"
+
+
+def lint(rules: List[IngressRule], index: Optional[IngressIndex] = None) -> List[LintIssue]:
+    """
+    Problems cloudflared won't point out: rules it rejects, a missing
+    catch-all, duplicates, rules an earlier one always wins over, and
+    exact hostnames partly captured by an earlier wildcard.
+    """
+    index = index or IngressIndex(rules)
+    issues = []
+    for position, rule in enumerate(rules):
+        if position in index.invalid:
+            issues.append(LintIssue(rule, "error", "invalid", index.invalid[position]))
+            continue
+        partial = None
+        for earlier in index.covering(position):
+            other = rules[earlier]
+            if earlier in index.invalid:
+                continue
+            if not other.path or other.path == rule.path:
+                if _host(other) == _host(rule) and other.path == rule.path:
+                    issues.append(LintIssue(rule, "warning", "duplicate",
+                                            f"duplicate of {_describe(other)}; it is never used", other))
+                else:
+                    issues.append(LintIssue(rule, "warning", "unreachable",
+                                            f"never used: {_describe(other)} matches all of its requests first", other))
+                partial = None
+                break
+            if partial is None and _host(other).startswith("*.") and _host(other) != _host(rule):
+                partial = other
+        if partial is not None:
+            issues.append(LintIssue(rule, "warning", "overlap",
+                                    f"requests whose path matches {partial.path!r} go to wildcard "
+                                    f"{_describe(partial)} first", partial))
+
+    if rules:
+        last = rules[-1]
+        if not (_any_host(_host(last)) and not last.path):
+            issues.append(LintIssue(last, "error", "no-catch-all",
+                                    "the last rule must match every request (no hostname or path); "
+                                    "cloudflared won't start without one"))
+    return issues
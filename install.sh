@@ -25,6 +25,10 @@ if [ -d "$INSTALL_DIR" ]; then
     if [ -f "$INSTALL_DIR/tunnel.pid" ]; then
         cp "$INSTALL_DIR/tunnel.pid" /tmp/tunnelflare_pid_backup
     fi
+    if [ -d "$INSTALL_DIR/tunnels" ]; then
+        rm -rf /tmp/tunnelflare_tunnels_backup
+        cp -r "$INSTALL_DIR/tunnels" /tmp/tunnelflare_tunnels_backup
+    fi
     
     # Remove code files but keep venv if possible? 
     # Actually, safer to wipe and restore config to ensure clean code update.
@@ -46,6 +50,9 @@ fi
 if [ -f /tmp/tunnelflare_pid_backup ]; then
     mv /tmp/tunnelflare_pid_backup "$INSTALL_DIR/tunnel.pid"
 fi
+if [ -d /tmp/tunnelflare_tunnels_backup ]; then
+    mv /tmp/tunnelflare_tunnels_backup "$INSTALL_DIR/tunnels"
+fi
 
 # Check if running as root via sudo
 if [ "$EUID" -eq 0 ] && [ -n "$SUDO_USER" ]; then
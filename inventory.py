@@ -0,0 +1,228 @@
+import json
+import os
+import re
+import subprocess
+import threading
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from config import TUNNEL_DIR
+
+CACHE_FILE = TUNNEL_DIR / "inventory.json"
+DEFAULT_TTL = 300.0 # Seconds before the cached list is refetched
+CLOUDFLARED_DIR = Path.home() / ".cloudflared"
+CERT_FILE = CLOUDFLARED_DIR / "cert.pem"
+
+# "Created tunnel my-tunnel with id 6ff42ae2-765d-4adf-8112-31c55c1551ef"
+_CREATED_RE = re.compile(r"Created tunnel (\S+) with id ([0-9a-fA-F-]{36})")
+
+
+class InventoryError(Exception):
+    """Raised when the tunnel list can't be fetched from cloudflared."""
+
+
+@dataclass
+class Tunnel:
+    id: str
+    name: str
+    created_at: Optional[str] = None
+    connections: int = 0
+
+
+def parse_created(output: Optional[str]) -> Optional[Tunnel]:
+    """The tunnel announced by `cloudflared tunnel create`, if any."""
+    match = _CREATED_RE.search(output or "")
+    if not match:
+        return None
+    return Tunnel(match.group(2), match.group(1))
+
+
+def credentials_file(tunnel_id: str) -> Path:
+    """Where `cloudflared tunnel create` writes a tunnel's credentials."""
+    return CLOUDFLARED_DIR / f"{tunnel_id}.json"
+
+
+def _deleted(record: dict) -> bool:
+    # Live tunnels carry Go's zero time in deleted_at.
+    deleted_at = record.get("deleted_at")
+    return bool(deleted_at) and not str(deleted_at).startswith("0001-01-01")
+
+
+def _account_key() -> Optional[list]:
+    # A new login (cert.pem) may mean a different account, so it voids the cache.
+    try:
+        st = CERT_FILE.stat()
+    except OSError:
+        return None
+    return [str(CERT_FILE), st.st_mtime_ns]
+
+
+class Inventory:
+    """
+    The account's tunnels, indexed by exact name and by ID.
+
+    The list comes from `cloudflared tunnel list --output json` and is
+    cached on disk for `ttl` seconds, so repeated lookups (and other
+    tunnelflare processes) don't pay for a cloudflared start and an API
+    round-trip. Anything that creates or deletes tunnels should call
+    `invalidate()`.
+    """
+
+    def __init__(self, path: Path = CACHE_FILE, ttl: float = DEFAULT_TTL):
+        self.path = path
+        self.ttl = ttl
+        self._fetched_at = 0.0
+        self._account = None
+        self._by_name: Dict[str, Tunnel] = {}
+        self._by_id: Dict[str, Tunnel] = {}
+        self._signature = None
+        self._lock = threading.Lock()
+
+    def _index(self, tunnels: List[Tunnel], fetched_at: float, account):
+        self._by_name = {t.name: t for t in tunnels}
+        self._by_id = {t.id: t for t in tunnels}
+        self._fetched_at = fetched_at
+        self._account = account
+
+    def _load_disk(self):
+        """Pick up the on-disk cache if another process rewrote it."""
+        try:
+            st = self.path.stat()
+        except OSError:
+            return
+        signature = (st.st_mtime_ns, st.st_size, st.st_ino)
+        if signature == self._signature:
+            return
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+            tunnels = [Tunnel(**t) for t in data["tunnels"]]
+            self._index(tunnels, float(data["fetched_at"]), data.get("account"))
+        except (OSError, ValueError, KeyError, TypeError):
+            self._index([], 0.0, None)
+        self._signature = signature
+
+    def _save_disk(self):
+        data = {
+            "fetched_at": self._fetched_at,
+            "account": self._account,
+            "tunnels": [asdict(t) for t in self._by_id.values()],
+        }
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.path.with_suffix(".tmp")
+            with open(tmp, "w") as f:
+                json.dump(data, f)
+            os.replace(tmp, self.path)
+            st = self.path.stat()
+            self._signature = (st.st_mtime_ns, st.st_size, st.st_ino)
+        except OSError:
+            pass # The in-memory index still works without a disk cache
+
+    def fresh(self) -> bool:
+        return (self._fetched_at > 0 and time.time() - self._fetched_at < self.ttl
+                and self._account == _account_key())
+
+    def fetch(self) -> List[Tunnel]:
+        """Fetch the tunnel list from cloudflared and rewrite the cache."""
+        try:
+            result = subprocess.run(["cloudflared", "tunnel", "list", "--output", "json"],
+                                    stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        except OSError as e:
+            raise InventoryError(str(e))
+        if result.returncode != 0:
+            lines = result.stderr.strip().splitlines()
+            raise InventoryError(lines[-1] if lines else f"exit code {result.returncode}")
+        try:
+            records = json.loads(result.stdout or "[]") or []
+        except ValueError as e:
+            raise InventoryError(f"unexpected output from cloudflared: {e}")
+
+        tunnels = []
+        for record in records:
+            if not isinstance(record, dict) or not record.get("id") or _deleted(record):
+                continue
+            tunnels.append(Tunnel(str(record["id"]), str(record.get("name", "")),
+                                  record.get("created_at"), len(record.get("connections") or [])))
+        with self._lock:
+            self._index(tunnels, time.time(), _account_key())
+            self._save_disk()
+        return tunnels
+
+    def _ensure(self, refresh: bool, fetch: bool):
+        with self._lock:
+            self._load_disk()
+            stale = refresh or not self.fresh()
+        if stale and fetch:
+            self.fetch()
+
+    def tunnels(self, refresh: bool = False, fetch: bool = True) -> List[Tunnel]:
+        self._ensure(refresh, fetch)
+        return list(self._by_id.values())
+
+    def by_name(self, name: str, fetch: bool = True) -> Optional[Tunnel]:
+        """
+        Look up a tunnel by its exact name.
+
+        A miss in a fresh cache refetches once, since the tunnel may have
+        been created since. With `fetch=False` only the cache is consulted.
+        """
+        self._ensure(False, fetch)
+        tunnel = self._by_name.get(name)
+        if tunnel is None and fetch and self._fetched_at and time.time() - self._fetched_at > 1:
+            self.fetch()
+            tunnel = self._by_name.get(name)
+        return tunnel
+
+    def by_id(self, tunnel_id: str, fetch: bool = True) -> Optional[Tunnel]:
+        self._ensure(False, fetch)
+        return self._by_id.get(tunnel_id)
+
+    def create(self, name: str) -> Optional[Tunnel]:
+        """Create a tunnel; None if cloudflared refused (e.g. the name is taken)."""
+        try:
+            result = subprocess.run(["cloudflared", "tunnel", "create", name],
+                                    stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        except OSError as e:
+            raise InventoryError(str(e))
+        tunnel = parse_created(result.stdout + result.stderr)
+        if tunnel:
+            self.remember(tunnel)
+            return tunnel
+        if result.returncode == 0:
+            # Created, but the ID wasn't in the output; it is in the list now.
+            self.invalidate()
+            return self.by_name(name)
+        return None
+
+    def remember(self, tunnel: Tunnel):
+        """Add a tunnel we just created without refetching the whole list."""
+        with self._lock:
+            self._load_disk()
+            if not self.fresh():
+                return
+            self._by_name[tunnel.name] = tunnel
+            self._by_id[tunnel.id] = tunnel
+            self._save_disk()
+
+    def invalidate(self):
+        with self._lock:
+            self._index([], 0.0, None)
+            self._signature = None
+            try:
+                self.path.unlink()
+            except OSError:
+                pass
+
+
+_inventory: Optional[Inventory] = None
+
+
+def get_inventory() -> Inventory:
+    """The process-wide inventory backed by ~/.tunnelflare/inventory.json."""
+    global _inventory
+    if _inventory is None:
+        _inventory = Inventory()
+    return _inventory
@@ -0,0 +1,147 @@
+import math
+import time
+from array import array
+from bisect import bisect_left
+from typing import List, Optional, Sequence
+
+# Log-spaced bucket upper bounds from 0.1 ms to ~10 s, 25% apart, so a
+# percentile read from a bucket is within about 12% of the true value.
+_GROWTH = 1.25
+BUCKET_BOUNDS = tuple(0.0001 * _GROWTH ** i for i in range(53))
+SLOTS = 12 # Window of SLOTS * SLOT_SECONDS (10 minutes by default)
+SLOT_SECONDS = 50
+SPARKLINE_POINTS = 24
+SPARK_CHARS = "▁▂▃▄▅▆▇█"
+FAILED_MARK = "×"
+
+
+class LatencyHistogram:
+    """
+    Probe latency and success rate for one ingress rule over a sliding
+    window, in fixed memory.
+
+    Counts live in flat arrays: one row of buckets per time slot, reused
+    round-robin as the window slides, so nothing is allocated per sample
+    and memory is the same after a minute or a month. The last
+    `points` latencies are kept in a ring for a sparkline.
+    """
+
+    def __init__(self, slots: int = SLOTS, slot_seconds: float = SLOT_SECONDS,
+                 points: int = SPARKLINE_POINTS):
+        self.slots = slots
+        self.slot_seconds = slot_seconds
+        width = len(BUCKET_BOUNDS)
+        self._width = width
+        self._counts = array("I", [0]) * (slots * width)
+        self._zero = array("I", [0]) * width
+        self._ok = array("I", [0]) * slots
+        self._total = array("I", [0]) * slots
+        self._slot_ids = array("q", [-1]) * slots
+        self._recent = array("d", [math.nan]) * points # NaN marks a failed probe
+        self._recent_next = 0
+        self._recent_len = 0
+        self.last_ok: Optional[bool] = None
+        self.last_error: Optional[str] = None
+        self.version = 0 # Bumped by every record(), so views can cache what they derive
+
+    def _slot(self, now: float) -> int:
+        slot_id = int(now // self.slot_seconds)
+        index = slot_id % self.slots
+        if self._slot_ids[index] != slot_id:
+            start = index * self._width
+            self._counts[start:start + self._width] = self._zero
+            self._ok[index] = self._total[index] = 0
+            self._slot_ids[index] = slot_id
+        return index
+
+    def _live_slots(self, now: float) -> List[int]:
+        current = int(now // self.slot_seconds)
+        return [i for i in range(self.slots) if current - self.slots < self._slot_ids[i] <= current]
+
+    def record(self, latency: Optional[float], ok: bool, error: Optional[str] = None,
+               now: Optional[float] = None):
+        """Add one probe result; only successful probes count towards latency."""
+        index = self._slot(time.time() if now is None else now)
+        self._total[index] += 1
+        if ok:
+            self._ok[index] += 1
+            if latency is not None:
+                bucket = min(bisect_left(BUCKET_BOUNDS, latency), self._width - 1)
+                self._counts[index * self._width + bucket] += 1
+        self._recent[self._recent_next] = latency if ok and latency is not None else math.nan
+        self._recent_next = (self._recent_next + 1) % len(self._recent)
+        self._recent_len = min(self._recent_len + 1, len(self._recent))
+        self.last_ok = ok
+        self.last_error = error
+        self.version += 1
+
+    def window_id(self, now: Optional[float] = None) -> int:
+        """Changes whenever the window slides, i.e. when old probes may drop out of it."""
+        return int((time.time() if now is None else now) // self.slot_seconds)
+
+    def percentile(self, q: float, now: Optional[float] = None) -> Optional[float]:
+        """Latency below which a fraction `q` of the window's successful probes fell."""
+        return self.percentiles((q,), now)[0]
+
+    def percentiles(self, qs: Sequence[float], now: Optional[float] = None) -> List[Optional[float]]:
+        """`percentile` for each of `qs` (ascending), from one pass over the window."""
+        slots = self._live_slots(time.time() if now is None else now)
+        totals = [0] * self._width
+        for index in slots:
+            start = index * self._width
+            for bucket, count in enumerate(self._counts[start:start + self._width]):
+                if count:
+                    totals[bucket] += count
+        seen = sum(totals)
+        if not seen:
+            return [None] * len(qs)
+        results = []
+        running = 0
+        bucket = 0
+        for q in qs:
+            rank = q * seen
+            while bucket < len(totals) and running + totals[bucket] < rank:
+                running += totals[bucket]
+                bucket += 1
+            if bucket == len(totals):
+                results.append(BUCKET_BOUNDS[-1])
+            else:
+                upper = BUCKET_BOUNDS[bucket]
+                results.append(upper / math.sqrt(_GROWTH) if bucket else upper)
+        return results
+
+    def success_rate(self, now: Optional[float] = None) -> Optional[float]:
+        slots = self._live_slots(time.time() if now is None else now)
+        total = sum(self._total[i] for i in slots)
+        return sum(self._ok[i] for i in slots) / total if total else None
+
+    def recent(self) -> List[float]:
+        """The last latencies, oldest first; NaN for failed probes."""
+        size = len(self._recent)
+        start = (self._recent_next - self._recent_len) % size
+        return [self._recent[(start + i) % size] for i in range(self._recent_len)]
+
+
+def sparkline(values: List[float], missing: str = FAILED_MARK) -> str:
+    """Block-character sparkline; failed probes (NaN) show as `missing`."""
+    finite = [v for v in values if not math.isnan(v)]
+    if not finite:
+        return missing * len(values)
+    low, high = min(finite), max(finite)
+    span = high - low
+    chars = []
+    for value in values:
+        if math.isnan(value):
+            chars.append(missing)
+        elif span <= 0:
+            chars.append(SPARK_CHARS[0])
+        else:
+            chars.append(SPARK_CHARS[min(int((value - low) / span * len(SPARK_CHARS)), len(SPARK_CHARS) - 1)])
+    return "".join(chars)
+
+
+def format_ms(seconds: Optional[float]) -> str:
+    if seconds is None:
+        return "-"
+    ms = seconds * 1000
+    return f"{ms:.1f} ms" if ms < 10 else f"{ms:.0f} ms"
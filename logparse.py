@@ -0,0 +1,252 @@
+import json
+import re
+import time
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+# cloudflared's console writer abbreviates levels; JSON output spells them out.
+LEVELS = {
+    "DBG": "debug", "INF": "info", "WRN": "warn", "ERR": "error", "FTL": "fatal", "PNC": "panic",
+    "debug": "debug", "info": "info", "warn": "warn", "warning": "warn",
+    "error": "error", "fatal": "fatal", "panic": "panic",
+}
+ERROR_LEVELS = ("error", "fatal", "panic")
+
+# (message prefix, event kind), checked in order.
+EVENT_KINDS = (
+    ("Registered tunnel connection", "connected"),
+    ("Unregistered tunnel connection", "disconnected"),
+    ("Connection terminated", "disconnected"),
+    ("Lost connection", "disconnected"),
+    ("Serve tunnel error", "disconnected"),
+    ("Retrying connection", "retry"),
+    ("Retrying in", "retry"),
+    ("Initiating graceful shutdown", "shutdown"),
+    ("Tunnel server stopped", "shutdown"),
+    ("Starting tunnel", "start"),
+    ("Starting metrics server", "metrics"),
+    ("Request failed", "origin_error"),
+    ("Unable to reach the origin service", "origin_error"),
+)
+
+_FIELD_RE = re.compile(r'(?:(?<= )|^)(\w+)=("(?:[^"\\]|\\.)*"|\S*)')
+_ANSI_RE = re.compile(r"\x1b\[[0-9;]*m")
+_METRICS_ADDR_RE = re.compile(r"on (\S+?)(?:/metrics)?$")
+
+WINDOW_MINUTES = 60
+
+
+class LogEvent:
+    __slots__ = ("timestamp", "level", "message", "kind", "conn_index", "location", "fields")
+
+    def __init__(self, timestamp: float, level: str, message: str, kind: str,
+                 conn_index: Optional[int], location: Optional[str], fields: Dict[str, str]):
+        self.timestamp = timestamp
+        self.level = level
+        self.message = message
+        self.kind = kind
+        self.conn_index = conn_index
+        self.location = location
+        self.fields = fields
+
+
+def _classify(message: str) -> str:
+    for prefix, kind in EVENT_KINDS:
+        if message.startswith(prefix):
+            return kind
+    return "message"
+
+
+class LogParser:
+    """Turns cloudflared log lines (console or JSON format) into LogEvents."""
+
+    def __init__(self):
+        self._last_stamp = None
+        self._last_epoch = 0.0
+
+    def _epoch(self, stamp: Optional[str]) -> float:
+        if not stamp:
+            return time.time()
+        # Consecutive lines usually share a timestamp; don't reparse it.
+        if stamp == self._last_stamp:
+            return self._last_epoch
+        try:
+            epoch = datetime.fromisoformat(stamp.replace("Z", "+00:00")).timestamp()
+        except ValueError:
+            epoch = time.time()
+        self._last_stamp = stamp
+        self._last_epoch = epoch
+        return epoch
+
+    def parse(self, line: str) -> Optional[LogEvent]:
+        line = line.strip()
+        if not line:
+            return None
+        if line[0] == "{":
+            return self._parse_json(line)
+        if "\x1b" in line:
+            line = _ANSI_RE.sub("", line)
+        return self._parse_text(line)
+
+    def _parse_json(self, line: str) -> Optional[LogEvent]:
+        try:
+            record = json.loads(line)
+        except ValueError:
+            return self._parse_text(line)
+        if not isinstance(record, dict):
+            return None
+        message = str(record.pop("message", record.pop("msg", "")))
+        level = LEVELS.get(str(record.pop("level", "info")).lower(), "info")
+        stamp = record.pop("time", None)
+        fields = {k: str(v) for k, v in record.items()}
+        return self._event(self._epoch(stamp if isinstance(stamp, str) else None),
+                           level, message, fields)
+
+    def _parse_text(self, line: str) -> LogEvent:
+        # <timestamp> <LVL> <message> key=value key="quoted value" ...
+        parts = line.split(" ", 2)
+        if len(parts) == 3 and parts[1] in LEVELS:
+            stamp, level, rest = parts[0], LEVELS[parts[1]], parts[2]
+        else:
+            stamp, level, rest = None, "info", line
+        match = _FIELD_RE.search(rest)
+        fields = {}
+        if match:
+            message = rest[:match.start()].rstrip()
+            for key, value in _FIELD_RE.findall(rest, match.start()):
+                if value.startswith('"'):
+                    value = value[1:-1].replace('\\"', '"')
+                fields[key] = value
+        else:
+            message = rest
+        return self._event(self._epoch(stamp), level, message, fields)
+
+    def _event(self, timestamp: float, level: str, message: str, fields: Dict[str, str]) -> LogEvent:
+        conn_index = fields.get("connIndex")
+        try:
+            conn_index = int(conn_index) if conn_index is not None else None
+        except ValueError:
+            conn_index = None
+        return LogEvent(timestamp, level, message, _classify(message),
+                        conn_index, fields.get("location"), fields)
+
+
+class RollingCounter:
+    """
+    Per-minute counters over a fixed window, stored in a ring of buckets.
+
+    Counting is O(1) and memory is bounded by the window, however many
+    events arrive.
+    """
+
+    def __init__(self, minutes: int = WINDOW_MINUTES):
+        self.minutes = minutes
+        self._minute = [-1] * minutes
+        self._counts: List[Dict[str, int]] = [{} for _ in range(minutes)]
+
+    def add(self, key: str, timestamp: float, amount: int = 1):
+        minute = int(timestamp // 60)
+        slot = minute % self.minutes
+        if self._minute[slot] != minute:
+            if minute < self._minute[slot]:
+                return # Older than the window
+            self._minute[slot] = minute
+            self._counts[slot] = {}
+        counts = self._counts[slot]
+        counts[key] = counts.get(key, 0) + amount
+
+    def total(self, key: str, minutes: int = 1, now: Optional[float] = None) -> int:
+        """Sum of `key` over the last `minutes` minutes (current minute included)."""
+        current = int((now if now is not None else time.time()) // 60)
+        total = 0
+        for minute in range(current - min(minutes, self.minutes) + 1, current + 1):
+            slot = minute % self.minutes
+            if self._minute[slot] == minute:
+                total += self._counts[slot].get(key, 0)
+        return total
+
+    def series(self, key: str, minutes: int = WINDOW_MINUTES, now: Optional[float] = None) -> List[int]:
+        """Per-minute values of `key`, oldest first."""
+        current = int((now if now is not None else time.time()) // 60)
+        values = []
+        for minute in range(current - min(minutes, self.minutes) + 1, current + 1):
+            slot = minute % self.minutes
+            values.append(self._counts[slot].get(key, 0) if self._minute[slot] == minute else 0)
+        return values
+
+
+class LogMonitor:
+    """
+    Incremental health signals from a stream of cloudflared log lines.
+
+    Feed it lines as they arrive (e.g. from a LogTailer); it keeps rolling
+    per-minute counts by level and event kind, plus the set of currently
+    registered edge connections.
+    """
+
+    def __init__(self, minutes: int = WINDOW_MINUTES):
+        self.parser = LogParser()
+        self.counters = RollingCounter(minutes)
+        self.connections: Dict[int, Optional[str]] = {} # connIndex -> edge location
+        self.last_error: Optional[LogEvent] = None
+        self.last_event: Optional[LogEvent] = None
+        self.metrics_address: Optional[str] = None # host:port cloudflared serves metrics on
+        self._last_seen: Dict[str, float] = {} # Level or event kind -> timestamp of its latest event
+
+    def feed(self, lines: Iterable[str]) -> List[LogEvent]:
+        events = []
+        for line in lines:
+            event = self.parser.parse(line)
+            if event is None:
+                continue
+            self.counters.add(event.level, event.timestamp)
+            self._seen(event.level, event.timestamp)
+            if event.kind != "message":
+                self.counters.add(event.kind, event.timestamp)
+                self._seen(event.kind, event.timestamp)
+            if event.kind == "connected" and event.conn_index is not None:
+                self.connections[event.conn_index] = event.location
+            elif event.kind == "disconnected" and event.conn_index is not None:
+                self.connections.pop(event.conn_index, None)
+            elif event.kind in ("shutdown", "start"):
+                self.connections.clear()
+            elif event.kind == "metrics":
+                match = _METRICS_ADDR_RE.search(event.fields.get("addr") or event.message)
+                if match:
+                    self.metrics_address = match.group(1)
+            if event.level in ERROR_LEVELS:
+                self.last_error = event
+            self.last_event = event
+            events.append(event)
+        return events
+
+    def reset(self):
+        """Forget everything seen so far, e.g. for a new cloudflared process."""
+        self.counters = RollingCounter(self.counters.minutes)
+        self.connections.clear()
+        self.last_error = None
+        self.last_event = None
+        self.metrics_address = None
+        self._last_seen.clear()
+
+    def error_count(self, minutes: int = 1) -> int:
+        return sum(self.counters.total(level, minutes) for level in ERROR_LEVELS)
+
+    def _seen(self, key: str, timestamp: float):
+        if timestamp > self._last_seen.get(key, 0):
+            self._last_seen[key] = timestamp
+
+    def status(self, minutes: int = 1, now: Optional[float] = None) -> str:
+        """
+        ok / warning / error, based on the events of the last `minutes`.
+
+        A sliding window: an error keeps the status red for a full minute
+        whenever it happened, not just until the current minute ends.
+        """
+        since = (now if now is not None else time.time()) - minutes * 60
+        seen = self._last_seen
+        if any(seen.get(key, 0) >= since for key in ERROR_LEVELS + ("disconnected",)):
+            return "error"
+        if seen.get("warn", 0) >= since or seen.get("retry", 0) >= since:
+            return "warning"
+        return "ok"
@@ -0,0 +1,264 @@
+import gzip
+import os
+import queue
+import re
+import shutil
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import List, Optional
+
+# zstd is optional; without it archives fall back to gzip.
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+DEFAULT_MAX_SIZE = 10 * 1024 * 1024
+DEFAULT_MAX_AGE = 24 * 3600.0
+DEFAULT_RETENTION = 100 * 1024 * 1024 # Total bytes of archives to keep
+DEFAULT_COMPRESSION = "gzip"
+READ_SIZE = 64 * 1024
+
+_SIZE_UNITS = {"": 1, "b": 1, "k": 1024, "kb": 1024, "kib": 1024, "m": 1024 ** 2, "mb": 1024 ** 2,
+               "mib": 1024 ** 2, "g": 1024 ** 3, "gb": 1024 ** 3, "gib": 1024 ** 3}
+_AGE_UNITS = {"": 1, "s": 1, "m": 60, "h": 3600, "d": 86400}
+_QUANTITY_RE = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*([a-zA-Z]*)\s*$")
+
+
+def _quantity(value, units: dict, what: str) -> float:
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = _QUANTITY_RE.match(str(value))
+    if not match or match.group(2).lower() not in units:
+        raise ValueError(f"invalid {what}: {value!r}")
+    return float(match.group(1)) * units[match.group(2).lower()]
+
+
+def parse_size(value, what: str = "size") -> int:
+    """Bytes from a number or a string like "10MB"."""
+    return int(_quantity(value, _SIZE_UNITS, what))
+
+
+def parse_duration(value, what: str = "duration") -> float:
+    """Seconds from a number or a string like "90s", "5m" or "24h"."""
+    return _quantity(value, _AGE_UNITS, what)
+
+
+@dataclass
+class LogSettings:
+    max_size: int = DEFAULT_MAX_SIZE # Rotate once the live log reaches this size...
+    max_age: float = DEFAULT_MAX_AGE # ...or has been written to for this long
+    retention: int = DEFAULT_RETENTION # Oldest archives are deleted beyond this total
+    compression: str = DEFAULT_COMPRESSION # gzip, zstd or none
+
+    @classmethod
+    def from_config(cls, config: Optional[dict]) -> "LogSettings":
+        """
+        Read the optional `log-rotation` block of a tunnel config:
+
+            log-rotation:
+              max-size: 10MB
+              max-age: 24h
+              retention: 100MB
+              compression: zstd
+        """
+        block = (config or {}).get("log-rotation") if isinstance(config, dict) else None
+        if not isinstance(block, dict):
+            return cls()
+        compression = str(block.get("compression", DEFAULT_COMPRESSION)).lower()
+        if compression not in ("gzip", "zstd", "none"):
+            raise ValueError(f"invalid compression: {compression!r}")
+        return cls(
+            max_size=parse_size(block.get("max-size", DEFAULT_MAX_SIZE), "max-size"),
+            max_age=parse_duration(block.get("max-age", DEFAULT_MAX_AGE), "max-age"),
+            retention=parse_size(block.get("retention", DEFAULT_RETENTION), "retention"),
+            compression=compression,
+        )
+
+    @property
+    def suffix(self) -> str:
+        if self.compression == "zstd" and zstandard is not None:
+            return ".zst"
+        return ".gz" if self.compression != "none" else ""
+
+
+PENDING_SUFFIX = ".pending" # Rotated out but not yet compressed; not counted as an archive
+
+
+def archives(path: Path) -> List[Path]:
+    """Archived segments of `path`, oldest first."""
+    pattern = re.compile(re.escape(path.name) + r"\.(\d{8}-\d{6})(?:-(\d+))?(?:\.gz|\.zst)?$")
+    found = []
+    for p in path.parent.glob(path.name + ".*"):
+        match = pattern.match(p.name)
+        if match:
+            found.append(((match.group(1), int(match.group(2) or 0)), p))
+    return [p for _, p in sorted(found)]
+
+
+def _archive_name(path: Path) -> Path:
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    candidate = path.with_name(f"{path.name}.{stamp}")
+    n = 1
+    while any(candidate.with_name(candidate.name + s).exists() for s in ("", ".gz", ".zst", PENDING_SUFFIX)):
+        candidate = path.with_name(f"{path.name}.{stamp}-{n}")
+        n += 1
+    return candidate
+
+
+def compress(source: Path, settings: LogSettings) -> Path:
+    """Compress a pending segment into its archive (source is removed)."""
+    final = source.with_name(source.name[:-len(PENDING_SUFFIX)]) if source.name.endswith(PENDING_SUFFIX) else source
+    suffix = settings.suffix
+    if not suffix:
+        if final != source:
+            os.replace(source, final)
+        return final
+    target = final.with_name(final.name + suffix)
+    tmp = target.with_name(target.name + ".tmp")
+    with open(source, "rb") as src, open(tmp, "wb") as raw:
+        if suffix == ".zst":
+            with zstandard.ZstdCompressor(level=3).stream_writer(raw, closefd=False) as dst:
+                shutil.copyfileobj(src, dst, READ_SIZE)
+        else:
+            # Level 6 is gzip's default speed/ratio balance; logs compress ~10x either way.
+            with gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=6) as dst:
+                shutil.copyfileobj(src, dst, READ_SIZE)
+    os.replace(tmp, target)
+    os.unlink(source)
+    return target
+
+
+def enforce_retention(path: Path, retention: int):
+    """Delete the oldest archives until they fit in `retention` bytes."""
+    sizes = []
+    for archive in archives(path):
+        try:
+            sizes.append((archive, archive.stat().st_size))
+        except OSError:
+            pass
+    total = sum(size for _, size in sizes)
+    for archive, size in sizes:
+        if total <= retention:
+            break
+        try:
+            archive.unlink()
+        except OSError:
+            continue
+        total -= size
+
+
+class RotatingLogWriter:
+    """
+    Appends to a log file, rotating it by size and age.
+
+    Writes go straight to an O_APPEND descriptor (so readers like the
+    dashboard see lines immediately) and the size is tracked in memory,
+    so an append costs one write() and no stat(). Rotation renames the
+    live file and hands it to a background thread for compression and
+    retention, so a burst of logging never waits on gzip.
+
+    If the live file was renamed by someone else (a blue/green restart
+    moves the old process's log aside), this writer keeps appending to
+    its own file and never rotates the path out from under the new owner.
+    """
+
+    def __init__(self, path: Path, settings: Optional[LogSettings] = None):
+        self.path = Path(path)
+        self.settings = settings or LogSettings()
+        self._jobs = queue.Queue()
+        self._worker = threading.Thread(target=self._compress_loop, name="log-archiver", daemon=True)
+        self._worker.start()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # Keep the previous run's log instead of truncating it.
+        try:
+            if self.path.stat().st_size > 0:
+                self._archive_later(self._rename_aside())
+        except OSError:
+            pass
+        self._open()
+
+    def _open(self):
+        self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        st = os.fstat(self._fd)
+        self._identity = (st.st_dev, st.st_ino)
+        self._size = st.st_size
+        self._opened_at = time.monotonic()
+
+    def _rename_aside(self, source: Optional[Path] = None) -> Path:
+        name = _archive_name(self.path)
+        target = name.with_name(name.name + PENDING_SUFFIX)
+        os.replace(source or self.path, target)
+        return target
+
+    def _archive_later(self, path: Path):
+        self._jobs.put(path)
+
+    def _compress_loop(self):
+        while True:
+            path = self._jobs.get()
+            if path is None:
+                return
+            try:
+                compress(path, self.settings)
+                enforce_retention(self.path, self.settings.retention)
+            except OSError:
+                pass
+
+    def owns_path(self) -> bool:
+        """True while the live path still names the file we are writing."""
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return False
+        return (st.st_dev, st.st_ino) == self._identity
+
+    def _due(self, incoming: int) -> bool:
+        return (self._size + incoming > self.settings.max_size
+                or time.monotonic() - self._opened_at > self.settings.max_age)
+
+    def rotate(self):
+        if not self.owns_path():
+            return
+        os.close(self._fd)
+        self._archive_later(self._rename_aside())
+        self._open()
+
+    def write(self, data: bytes):
+        if self._size and self._due(len(data)) and self.owns_path():
+            # Split at the last complete line so no line straddles two files.
+            cut = data.rfind(b"\n") + 1
+            if cut and self._size + cut <= self.settings.max_size:
+                self._write(data[:cut])
+                data = data[cut:]
+            self.rotate()
+        self._write(data)
+
+    def _write(self, data: bytes):
+        view = memoryview(data)
+        while view:
+            written = os.write(self._fd, view)
+            view = view[written:]
+            self._size += written
+
+    def close(self):
+        """Close the file and wait for pending archives to be compressed."""
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+            if not self.owns_path():
+                # Moved aside (blue/green): nobody will read it as the live log again.
+                for name in (self.path.name + ".1", self.path.name + ".failed"):
+                    moved = self.path.with_name(name)
+                    try:
+                        st = os.stat(moved)
+                    except OSError:
+                        continue
+                    if (st.st_dev, st.st_ino) == self._identity:
+                        self._archive_later(self._rename_aside(moved))
+                        break
+        self._jobs.put(None)
+        self._worker.join()
+
@@ -0,0 +1,125 @@
+import os
+from pathlib import Path
+from typing import List, Optional
+
+# How much history to show when we first attach to an existing log,
+# and the most we will ever read in one go when we fall far behind.
+INITIAL_BACKFILL_BYTES = 16 * 1024
+MAX_READ_BYTES = 1024 * 1024
+
+
+class LogTailer:
+    """
+    Follows a log file the way `tail -F` does.
+
+    Remembers the byte offset and the (device, inode) of the file it is
+    reading, so every call to `read_lines()` only reads bytes appended
+    since the last call. Truncation (size shrinks below our offset) restarts
+    from the top, and rotation (path now points at a different inode) drains
+    what is left of the old file before switching to the new one.
+    """
+
+    def __init__(self, path: Path, backfill_bytes: int = INITIAL_BACKFILL_BYTES,
+                 max_read_bytes: int = MAX_READ_BYTES):
+        self.path = Path(path)
+        self.backfill_bytes = backfill_bytes
+        self.max_read_bytes = max_read_bytes
+        self._file = None
+        self._identity = None
+        self._offset = 0
+        self._partial = b""
+        self._attached = False
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+        self._file = None
+        self._identity = None
+        self._offset = 0
+        self._partial = b""
+
+    def _open(self, backfill: bool) -> bool:
+        try:
+            f = open(self.path, "rb")
+        except OSError:
+            return False
+        st = os.fstat(f.fileno())
+        self._attached = True
+        self._file = f
+        self._identity = (st.st_dev, st.st_ino)
+        self._partial = b""
+        self._offset = 0
+        if backfill and st.st_size > self.backfill_bytes:
+            # Start mid-file: drop the (probably partial) first line.
+            self._offset = st.st_size - self.backfill_bytes
+            f.seek(self._offset)
+            skipped = f.readline()
+            self._offset += len(skipped)
+        return True
+
+    def _read_available(self) -> bytes:
+        f = self._file
+        size = os.fstat(f.fileno()).st_size
+        if size < self._offset:
+            # Truncated in place (e.g. log reopened with mode "w").
+            self._offset = 0
+            self._partial = b""
+        pending = size - self._offset
+        if pending <= 0:
+            return b""
+        if pending > self.max_read_bytes:
+            # Too far behind to be worth catching up line by line.
+            self._offset = size - self.max_read_bytes
+            self._partial = b""
+        f.seek(self._offset)
+        data = f.read(size - self._offset)
+        self._offset += len(data)
+        return data
+
+    def read_lines(self) -> List[str]:
+        """Return complete lines appended since the previous call."""
+        chunks = []
+
+        if self._file is None:
+            if not self._open(backfill=not self._attached):
+                return []
+        else:
+            try:
+                st = os.stat(self.path)
+                current = (st.st_dev, st.st_ino)
+            except OSError:
+                current = None
+            if current != self._identity:
+                # Rotated or removed: finish the old file first, and
+                # terminate its last line so it doesn't merge with the new one.
+                chunks.append(self._read_available())
+                if not (self._partial + chunks[-1]).endswith(b"\n"):
+                    chunks.append(b"\n")
+                self._file.close()
+                self._file = None
+                lines = self._split(chunks)
+                if current is not None and self._open(backfill=False):
+                    lines.extend(self._split([self._read_available()]))
+                return lines
+
+        chunks.append(self._read_available())
+        return self._split(chunks)
+
+    def _split(self, chunks: List[bytes]) -> List[str]:
+        data = self._partial + b"".join(chunks)
+        if not data:
+            return []
+        head, sep, tail = data.rpartition(b"\n")
+        if not sep:
+            self._partial = data
+            return []
+        self._partial = tail
+        return head.decode("utf-8", errors="replace").splitlines()
+
+    @property
+    def offset(self) -> int:
+        return self._offset
+
+    @property
+    def identity(self) -> Optional[tuple]:
+        return self._identity
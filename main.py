@@ -1,28 +1,19 @@
 import typer
-import time
-import random
-import subprocess
 import os
 import signal
-import sys
-from rich.console import Console, Group
-from rich.panel import Panel
-from rich.prompt import Prompt, Confirm
-from rich.progress import Progress, SpinnerColumn, TextColumn
-from rich import print as rprint
-from rich.layout import Layout
-from rich.live import Live
-from rich.text import Text
-from rich.align import Align
-from rich.table import Table
-from rich.tree import Tree
+from typing import List, Optional
+from rich.console import Console
 from pathlib import Path
-import yaml
 
-from utils import check_cloudflared_installed, install_cloudflared, run_command
+# Only what every command needs is imported up front; commands import the
+# rest (rich widgets, YAML, the TUI, ...) when they run, which keeps
+# scripted calls like `tunnelflare stop` fast. See benchmarks/startup.py.
+from profiles import DEFAULT_GRACE_PERIOD, DEFAULT_PROFILE, STOP_TIMEOUT, Profile, ProfileError, resolve_profiles, wait_for_exit
+from routing import DEFAULT_RETRIES, DEFAULT_WORKERS
 
 app = typer.Typer()
 console = Console()
+QUIET = False # Set by --quiet; banners are also skipped when stdout isn't a terminal
 
 CLOUDFLARE_ORANGE = "#F38020"
 TUNNEL_FLARE_LOGO = """
@@ -51,15 +42,15 @@ STEPS = [
     "Run Tunnel"
 ]
 
-TUNNEL_DIR = Path.home() / ".tunnelflare"
-PID_FILE = TUNNEL_DIR / "tunnel.pid"
-LOG_FILE = TUNNEL_DIR / "tunnel.log"
-CONFIG_FILE = TUNNEL_DIR / "config.yml"
-
-def get_header(current_step_index: int = -1):
+def get_header(current_step_index: int = -1, logo: bool = True):
     """
     Returns a renderable group containing the Logo and the Step Progress.
     """
+    from rich.align import Align
+    from rich.console import Group
+    from rich.panel import Panel
+    from rich.text import Text
+
     # Logo
     logo_panel = Align.center(Text.from_markup(TUNNEL_FLARE_LOGO_COMPACT))
     
@@ -82,75 +73,96 @@ def get_header(current_step_index: int = -1):
             
     steps_panel = Panel(Align.center(steps_text), title="Setup Progress", border_style=CLOUDFLARE_ORANGE)
     
-    return Group(logo_panel, steps_panel)
+    return Group(logo_panel, steps_panel) if logo else steps_panel
+
+def refresh_interface(current_step_index: int, clear: bool = True):
+    """
+    Clears screen and prints the header.
 
-def refresh_interface(current_step_index: int):
-    """Clears screen and prints the header."""
-    console.clear()
-    console.print(get_header(current_step_index))
+    With `clear=False` only the step progress is printed, below what is
+    already on screen. Does nothing in quiet or non-interactive mode.
+    """
+    if QUIET or not console.is_terminal:
+        return
+    if clear:
+        console.clear()
+    console.print(get_header(current_step_index, logo=clear))
     console.print("\n")
 
-def start_tunnel_background(tunnel_id: str, config_path: Path, cred_path: Path):
+def start_tunnel_background(profile: Profile, tunnel_id: str, cred_path: Path):
     """
     Starts the tunnel in the background and saves the PID.
     """
-    TUNNEL_DIR.mkdir(exist_ok=True)
-    
-    cmd = [
-        "cloudflared", 
-        "tunnel", 
-        "--config", str(config_path), 
-        "--cred-file", str(cred_path),
-        "run", 
-        tunnel_id
-    ]
-    
-    with open(LOG_FILE, "w") as log:
-        process = subprocess.Popen(
-            cmd,
-            stdout=log,
-            stderr=subprocess.STDOUT,
-            start_new_session=True # Detach from terminal
-        )
-    
-    with open(PID_FILE, "w") as f:
-        f.write(str(process.pid))
+    pid = profile.spawn(tunnel_id, cred_path)
         
-    console.print(f"[green]Tunnel '{tunnel_id}' started in background (PID: {process.pid}).[/green]")
-    console.print(f"Logs are being written to {LOG_FILE}")
-    console.print(f"\n[bold]Run [cyan]tunnelflare status[/cyan] to view live status.[/bold]")
+    console.print(f"[green]{_label(profile)}Tunnel '{tunnel_id}' started in background (PID: {pid}).[/green]")
+    console.print(f"{_label(profile)}Logs are being written to {profile.log_file}")
+    console.print(f"\n[bold]Run [cyan]tunnelflare status{_profile_arg(profile)}[/cyan] to view live status.[/bold]")
 
-def is_tunnel_running():
-    """Checks if the tunnel process is running based on the PID file."""
-    if not PID_FILE.exists():
-        return False
-    
+def is_tunnel_running(profile: Optional[Profile] = None):
+    """Checks if the tunnel process (or its supervisor, between restarts) is running."""
+    profile = profile or Profile(DEFAULT_PROFILE)
+    return profile.running_pid() or profile.supervisor_pid() or False
+
+def _label(profile: Profile) -> str:
+    """Message prefix naming the profile, empty for the default one."""
+    return "" if profile.name == DEFAULT_PROFILE else f"[bold]\\[{profile.name}][/bold] "
+
+def _profile_arg(profile: Profile) -> str:
+    return "" if profile.name == DEFAULT_PROFILE else f" {profile.name}"
+
+def _resolve(names: Optional[List[str]], all_profiles: bool) -> List[Profile]:
     try:
-        with open(PID_FILE, "r") as f:
-            pid = int(f.read().strip())
-        
-        # Check if process exists
-        os.kill(pid, 0)
-        return pid
-    except (ValueError, ProcessLookupError, OSError):
-        return False
+        profiles = resolve_profiles(names, all_profiles)
+    except ProfileError as e:
+        console.print(f"[red]{e}[/red]")
+        raise typer.Exit(code=1)
+    if not profiles:
+        console.print("[yellow]No tunnel profiles found. Run 'tunnelflare setup' to create one.[/yellow]")
+        raise typer.Exit(code=1)
+    return profiles
+
+def _for_each(func, profiles: List[Profile]):
+    """Run `func(profile)` for every profile, in parallel when there are several."""
+    if len(profiles) == 1:
+        func(profiles[0])
+        return
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=min(8, len(profiles))) as pool:
+        list(pool.map(func, profiles))
+
+PROFILE_NAMES = typer.Argument(None, help="Tunnel profile names (default: the 'default' profile).")
+ALL_PROFILES = typer.Option(False, "--all", "-a", help="Apply to every configured tunnel profile.")
 
 @app.callback(invoke_without_command=True)
-def main(ctx: typer.Context):
+def main(ctx: typer.Context,
+         quiet: bool = typer.Option(False, "--quiet", "-q", help="Skip banners and screen clearing (implied when output isn't a terminal).")):
     """
     TunnelFlare: Secure Highway to your Private Server.
     """
+    global QUIET
+    QUIET = quiet
     if ctx.invoked_subcommand is None:
+        from rich.align import Align
+        from rich.text import Text
         console.print(Align.center(Text.from_markup(TUNNEL_FLARE_LOGO)))
         console.print(Align.center(Text("By. Senuk Dias", style=f"bold {CLOUDFLARE_ORANGE}")))
         console.print("\n")
         console.print(ctx.get_help())
 
 @app.command()
-def setup():
+def setup(profile_name: str = typer.Option(DEFAULT_PROFILE, "--profile", "-p", help="Tunnel profile to configure.")):
     """
     Interactive setup wizard for Cloudflare Tunnel.
     """
+    from rich.prompt import Confirm, Prompt
+    from utils import check_cloudflared_installed, install_cloudflared, run_command
+    
+    try:
+        profile = Profile(profile_name)
+    except ProfileError as e:
+        console.print(f"[red]{e}[/red]")
+        raise typer.Exit(code=1)
     step_index = 0
     
     # 1. Check Dependencies
@@ -170,11 +182,10 @@ def setup():
     else:
         console.print("[green]cloudflared is already installed.[/green]")
     
-    time.sleep(1)
     step_index += 1
 
     # 2. Login
-    refresh_interface(step_index)
+    refresh_interface(step_index, clear=False)
     cert_path = Path.home() / ".cloudflared" / "cert.pem"
     if not cert_path.exists():
         console.print("You need to login to Cloudflare.")
@@ -191,59 +202,15 @@ def setup():
     else:
         console.print(f"[green]Already logged in.[/green] (Found {cert_path})")
     
-    time.sleep(1)
     step_index += 1
 
     # 3. Create Tunnel
-    refresh_interface(step_index)
-    tunnel_name = Prompt.ask("Enter a name for your tunnel", default="my-tunnel")
+    refresh_interface(step_index, clear=False)
+    default_name = "my-tunnel" if profile.name == DEFAULT_PROFILE else profile.name
+    tunnel_name = Prompt.ask("Enter a name for your tunnel", default=default_name)
     
-    tunnel_id = None
     try:
-        # Attempt to create tunnel
-        create_output = run_command(["cloudflared", "tunnel", "create", tunnel_name], check=False)
-        
-        if create_output and "Tunnel credentials written" in create_output:
-             console.print(f"[green]Tunnel '{tunnel_name}' created successfully![/green]")
-        
-        elif create_output and "already exists" in create_output:
-             console.print(f"[yellow]Tunnel '{tunnel_name}' already exists remotely.[/yellow]")
-             
-             # Get ID to check for local credentials
-             tunnels_list = run_command(["cloudflared", "tunnel", "list"], check=True)
-             for line in tunnels_list.splitlines():
-                if tunnel_name in line:
-                    parts = line.split()
-                    if len(parts) > 0:
-                        tunnel_id = parts[0]
-                        break
-             
-             if tunnel_id:
-                 cred_file = Path.home() / ".cloudflared" / f"{tunnel_id}.json"
-                 if not cred_file.exists():
-                     console.print(f"[red]But local credentials are missing for ID {tunnel_id}.[/red]")
-                     console.print("[cyan]Deleting old remote tunnel to recreate it...[/cyan]")
-                     run_command(["cloudflared", "tunnel", "delete", "-f", tunnel_name], check=False)
-                     
-                     # Try creating again
-                     create_output = run_command(["cloudflared", "tunnel", "create", tunnel_name], check=True)
-                     if "Tunnel credentials written" in create_output:
-                         console.print(f"[green]Tunnel '{tunnel_name}' recreated successfully![/green]")
-                     else:
-                         console.print("[red]Failed to recreate tunnel.[/red]")
-                         raise typer.Exit(code=1)
-                 else:
-                     console.print(f"[green]Using existing tunnel '{tunnel_name}' with valid credentials.[/green]")
-        
-        # Get Tunnel ID (if not already fetched)
-        if not tunnel_id:
-            tunnels_list = run_command(["cloudflared", "tunnel", "list"], check=True)
-            for line in tunnels_list.splitlines():
-                if tunnel_name in line:
-                    parts = line.split()
-                    if len(parts) > 0:
-                        tunnel_id = parts[0]
-                        break
+        tunnel_id = _find_or_create_tunnel(tunnel_name)
         
         if not tunnel_id:
             console.print(f"[red]Could not find ID for tunnel '{tunnel_name}'.[/red]")
@@ -256,11 +223,10 @@ def setup():
         console.print("[yellow]Tip: Ensure you are logged in and have permissions to create tunnels.[/yellow]")
         raise typer.Exit(code=1)
 
-    time.sleep(1)
     step_index += 1
 
     # 4. Route DNS
-    refresh_interface(step_index)
+    refresh_interface(step_index, clear=False)
     
     domain = ""
     if Confirm.ask("Do you want to route a DNS hostname now?", default=True):
@@ -276,11 +242,10 @@ def setup():
         domain = Prompt.ask("Enter the hostname you PLAN to use (for config generation)", default="app.example.com")
         console.print("[yellow]Skipping DNS routing. You will need to add a CNAME record manually.[/yellow]")
 
-    time.sleep(1)
     step_index += 1
 
     # 5. Configuration
-    refresh_interface(step_index)
+    refresh_interface(step_index, clear=False)
     local_service = Prompt.ask("Enter your local service URL", default="http://localhost:8000")
     
     config_content = {
@@ -298,135 +263,681 @@ def setup():
     }
     
     # Ensure directory exists
-    TUNNEL_DIR.mkdir(exist_ok=True)
+    profile.dir.mkdir(parents=True, exist_ok=True)
     
-    with open(CONFIG_FILE, "w") as f:
-        yaml.dump(config_content, f, sort_keys=False)
+    profile.store.save(config_content)
         
     # Set permissions to 600 (Read/Write for owner only)
-    os.chmod(CONFIG_FILE, 0o600)
+    os.chmod(profile.config_file, 0o600)
     
-    console.print(f"[green]Configuration saved securely to {CONFIG_FILE.absolute()}[/green]")
+    console.print(f"[green]Configuration saved securely to {profile.config_file.absolute()}[/green]")
     
-    time.sleep(1)
     step_index += 1
     
     # 6. Run
-    refresh_interface(step_index)
+    refresh_interface(step_index, clear=False)
     console.print("You can now run the tunnel.")
     
     if Confirm.ask("Do you want to run the tunnel now?"):
         cred_path = Path.home() / ".cloudflared" / f"{tunnel_id}.json"
-        start_tunnel_background(tunnel_id, CONFIG_FILE, cred_path)
+        start_tunnel_background(profile, tunnel_id, cred_path)
 
-def _start():
-    if is_tunnel_running():
-        console.print("[yellow]Tunnel is already running. Use 'tunnelflare stop' to stop it first.[/yellow]")
-        return
+def _create_tunnel(tunnel_name: str) -> Optional[str]:
+    """Run `cloudflared tunnel create` and return the new ID, or None if the name is taken."""
+    from inventory import get_inventory
+    tunnel = get_inventory().create(tunnel_name)
+    return tunnel.id if tunnel else None
+
+def _find_or_create_tunnel(tunnel_name: str) -> Optional[str]:
+    """
+    Resolve `tunnel_name` to a tunnel ID with local credentials, creating
+    (or recreating) the tunnel when needed.
+    """
+    from inventory import credentials_file, get_inventory
+    from utils import run_command
+    
+    inventory = get_inventory()
+    tunnel = inventory.by_name(tunnel_name)
+    if tunnel is None:
+        tunnel_id = _create_tunnel(tunnel_name)
+        if tunnel_id:
+            console.print(f"[green]Tunnel '{tunnel_name}' created successfully![/green]")
+            return tunnel_id
+        # Created elsewhere since the list was cached
+        inventory.invalidate()
+        tunnel = inventory.by_name(tunnel_name)
+        if tunnel is None:
+            return None
 
-    if not CONFIG_FILE.exists():
-        console.print(f"[red]No configuration file found at {CONFIG_FILE}.[/red]")
-        console.print("[yellow]Please run 'tunnelflare setup' to create a new tunnel configuration.[/yellow]")
+    console.print(f"[yellow]Tunnel '{tunnel_name}' already exists remotely.[/yellow]")
+    if credentials_file(tunnel.id).exists():
+        console.print(f"[green]Using existing tunnel '{tunnel_name}' with valid credentials.[/green]")
+        return tunnel.id
+
+    console.print(f"[red]But local credentials are missing for ID {tunnel.id}.[/red]")
+    console.print("[cyan]Deleting old remote tunnel to recreate it...[/cyan]")
+    run_command(["cloudflared", "tunnel", "delete", "-f", tunnel_name], check=False)
+    inventory.invalidate()
+
+    # Try creating again
+    tunnel_id = _create_tunnel(tunnel_name)
+    if tunnel_id:
+        console.print(f"[green]Tunnel '{tunnel_name}' recreated successfully![/green]")
+        return tunnel_id
+    console.print("[red]Failed to recreate tunnel.[/red]")
+    raise typer.Exit(code=1)
+
+def _launch_params(profile: Profile):
+    """
+    Validate a profile's config and return (tunnel_id, cred_path), printing
+    what is wrong and returning None if it can't be launched.
+    """
+    from inventory import get_inventory
+    
+    label = _label(profile)
+    setup_cmd = f"tunnelflare setup{'' if profile.name == DEFAULT_PROFILE else ' -p ' + profile.name}"
+    if not profile.config_file.exists():
+        console.print(f"[red]{label}No configuration file found at {profile.config_file}.[/red]")
+        console.print(f"[yellow]Please run '{setup_cmd}' to create a new tunnel configuration.[/yellow]")
+        return None
+
+    config = profile.store.load()
+    
+    tunnel_id = config.get("tunnel")
+    if not tunnel_id:
+        console.print(f"[red]{label}Invalid configuration: Tunnel ID missing.[/red]")
+        console.print(f"[yellow]Your configuration file seems corrupted. Please run '{setup_cmd}' to reconfigure.[/yellow]")
+        return None
+        
+    # Cache only: starting a tunnel shouldn't wait on the Cloudflare API.
+    tunnel = get_inventory().by_id(tunnel_id, fetch=False)
+    name = f" ({tunnel.name})" if tunnel else ""
+    console.print(f"[green]{label}Found configuration for Tunnel ID: {tunnel_id}{name}[/green]")
+    
+    # Validate Credentials File
+    cred_file = config.get("credentials-file")
+    if cred_file:
+        cred_path = Path(cred_file)
+        if not cred_path.exists():
+            console.print(f"[red]{label}Error: Credentials file not found at {cred_path}[/red]")
+            
+            if str(cred_path).startswith("/root") and os.geteuid() != 0:
+                 console.print("[yellow]Warning: The configuration points to a file in /root, but you are not running as root.[/yellow]")
+                 console.print("[yellow]This usually happens if you ran 'setup' with sudo previously.[/yellow]")
+                 console.print("[bold]Solution:[/bold] Run [cyan]tunnelflare reset[/cyan] and then [cyan]tunnelflare setup[/cyan] (without sudo).")
+            else:
+                 console.print("[yellow]Your tunnel credentials seem to be missing.[/yellow]")
+                 console.print("[bold]Solution:[/bold] Run [cyan]tunnelflare reset[/cyan] and then [cyan]tunnelflare setup[/cyan] to regenerate them.")
+            return None
+    else:
+         console.print(f"[red]{label}Error: Credentials file not defined in configuration.[/red]")
+         return None
+    return tunnel_id, cred_path
+
+def _start(profile: Profile):
+    label = _label(profile)
+    if is_tunnel_running(profile):
+        console.print(f"[yellow]{label}Tunnel is already running. Use 'tunnelflare stop{_profile_arg(profile)}' to stop it first.[/yellow]")
         return
 
     try:
-        with open(CONFIG_FILE, "r") as f:
-            config = yaml.safe_load(f)
-        
-        tunnel_id = config.get("tunnel")
-        if not tunnel_id:
-            console.print("[red]Invalid configuration: Tunnel ID missing.[/red]")
-            console.print("[yellow]Your configuration file seems corrupted. Please run 'tunnelflare setup' to reconfigure.[/yellow]")
+        params = _launch_params(profile)
+        if params is None:
             return
-            
-        console.print(f"[green]Found configuration for Tunnel ID: {tunnel_id}[/green]")
-        
-        # Validate Credentials File
-        cred_file = config.get("credentials-file")
-        if cred_file:
-            cred_path = Path(cred_file)
-            if not cred_path.exists():
-                console.print(f"[red]Error: Credentials file not found at {cred_path}[/red]")
-                
-                if str(cred_path).startswith("/root") and os.geteuid() != 0:
-                     console.print("[yellow]Warning: The configuration points to a file in /root, but you are not running as root.[/yellow]")
-                     console.print("[yellow]This usually happens if you ran 'setup' with sudo previously.[/yellow]")
-                     console.print("[bold]Solution:[/bold] Run [cyan]tunnelflare reset[/cyan] and then [cyan]tunnelflare setup[/cyan] (without sudo).")
-                     return
-                else:
-                     console.print("[yellow]Your tunnel credentials seem to be missing.[/yellow]")
-                     console.print("[bold]Solution:[/bold] Run [cyan]tunnelflare reset[/cyan] and then [cyan]tunnelflare setup[/cyan] to regenerate them.")
-                     return
-        else:
-             console.print("[red]Error: Credentials file not defined in configuration.[/red]")
-             return
-        
-        start_tunnel_background(tunnel_id, CONFIG_FILE, cred_path)
+        start_tunnel_background(profile, *params)
         
     except Exception as e:
-        console.print(f"[red]Failed to start tunnel: {e}[/red]")
+        console.print(f"[red]{label}Failed to start tunnel: {e}[/red]")
         console.print("[yellow]Check the logs for more details.[/yellow]")
 
 @app.command()
-def start():
+def start(names: Optional[List[str]] = PROFILE_NAMES, all_profiles: bool = ALL_PROFILES):
     """
     Start the tunnel using the existing configuration.
     """
+    profiles = _resolve(names, all_profiles)
     refresh_interface(-1)
-    _start()
+    _for_each(_start, profiles)
 
 @app.command()
-def status():
+def status(names: Optional[List[str]] = PROFILE_NAMES, all_profiles: bool = ALL_PROFILES,
+           json_output: bool = typer.Option(False, "--json", help="Print machine-readable status (exit code 3 if any tunnel is down).")):
     """
     Show live interactive status dashboard (Textual TUI).
+
+    With several profiles (or --all), print a summary table instead.
     """
+    profiles = _resolve(names, all_profiles)
+    if json_output:
+        _status_json(profiles)
+        return
+    if len(profiles) > 1:
+        _status_table(profiles)
+        return
     try:
         from tui import TunnelFlareApp
-        app = TunnelFlareApp()
+        app = TunnelFlareApp(profile_name=profiles[0].name)
         app.run()
     except ImportError:
         console.print("[red]Textual is not installed. Please run './install.sh' again.[/red]")
     except Exception as e:
         console.print(f"[red]Error launching dashboard: {e}[/red]")
 
-def _stop():
-    pid = is_tunnel_running()
-    if not pid:
-        console.print("[red]Tunnel is not running. No process to stop.[/red]")
+def _status_json(profiles: List[Profile]):
+    """
+    Print each profile's status as JSON, asked of its supervisor over the
+    control socket. No dashboard, no network: this is meant for scripts.
+    """
+    import json
+    from control import profile_status
+
+    statuses = {profile.name: profile_status(profile) for profile in profiles}
+    print(json.dumps(statuses, indent=2))
+    if any(status["state"] != "running" for status in statuses.values()):
+        raise typer.Exit(code=3) # LSB "program is not running"
+
+def _profile_summary(profile: Profile):
+    pid = profile.running_pid()
+    try:
+        rules = [r for r in profile.store.ingress() if not r.is_catch_all]
+        tunnel_id = profile.store.get("tunnel") or "-"
+    except Exception:
+        rules, tunnel_id = [], "[red]invalid config[/red]"
+    info = profile.read_state()
+    if pid and info.get("supervisor_status") == "backoff":
+        state = f"[yellow]restarting[/yellow] ({info.get('last_exit')})"
+    elif pid:
+        restarts = info.get("restarts") or 0
+        state = f"[green]running[/green] (PID {pid}" + (f", {restarts} restarts)" if restarts else ")")
+    elif info.get("supervisor_status") == "crash-loop":
+        state = f"[red]crash loop[/red] ({info.get('last_exit')})"
+    else:
+        state = "[yellow]stopped[/yellow]"
+    return profile.name, state, tunnel_id, str(len(rules))
+
+def _status_table(profiles: List[Profile]):
+    from concurrent.futures import ThreadPoolExecutor
+    from rich.table import Table
+    
+    with ThreadPoolExecutor(max_workers=min(8, len(profiles))) as pool:
+        rows = list(pool.map(_profile_summary, profiles))
+    table = Table(title="Tunnels", border_style=CLOUDFLARE_ORANGE)
+    table.add_column("Profile", style="bold")
+    table.add_column("State")
+    table.add_column("Tunnel ID")
+    table.add_column("Routes", justify="right")
+    for row in rows:
+        table.add_row(*row)
+    console.print(table)
+
+def _stop(profile: Profile):
+    label = _label(profile)
+    if not is_tunnel_running(profile):
+        console.print(f"[red]{label}Tunnel is not running. No process to stop.[/red]")
         return
     
     try:
-        os.kill(pid, signal.SIGTERM)
-        console.print(f"[green]Stopped tunnel process (PID: {pid}).[/green]")
-        if PID_FILE.exists():
-            PID_FILE.unlink()
+        pid = profile.terminate(signal.SIGTERM)
+        console.print(f"[green]{label}Stopped tunnel process (PID: {pid}).[/green]")
+        return pid
     except Exception as e:
-        console.print(f"[red]Failed to stop tunnel: {e}[/red]")
+        console.print(f"[red]{label}Failed to stop tunnel: {e}[/red]")
 
 @app.command()
-def stop():
+def stop(names: Optional[List[str]] = PROFILE_NAMES, all_profiles: bool = ALL_PROFILES):
     """
     Stop the background tunnel process.
     """
+    profiles = _resolve(names, all_profiles)
     refresh_interface(-1)
-    _stop()
+    _for_each(_stop, profiles)
+
+def _restart(profile: Profile):
+    supervisor = profile.supervisor_pid()
+    pid = _stop(profile)
+    # Wait for the old process to actually exit rather than a fixed delay.
+    if pid is not None and not wait_for_exit(pid, STOP_TIMEOUT):
+        try:
+            os.kill(pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        wait_for_exit(pid, 1)
+    if supervisor is not None and supervisor != pid:
+        wait_for_exit(supervisor, 1) # Let it finish writing the old log
+    _start(profile)
+
+def _blue_green_restart(profile: Profile, grace_period: float) -> bool:
+    from bluegreen import blue_green_restart
+    
+    label = _label(profile)
+    try:
+        params = _launch_params(profile)
+        if params is None:
+            return False
+        console.print(f"[cyan]{label}Starting replacement cloudflared and waiting for edge connections...[/cyan]")
+        report = blue_green_restart(profile, *params, grace_period=grace_period)
+    except Exception as e:
+        console.print(f"[red]{label}Failed to restart tunnel: {e}[/red]")
+        return False
+
+    if report.mode == "rolled-back":
+        console.print(f"[red]{label}Replacement failed ({report.error}); kept PID {report.old_pid} running.[/red]")
+        return False
+    if report.new_pid is None:
+        console.print(f"[red]{label}Tunnel failed to start: {report.error}[/red]")
+        return False
+    console.print(f"[green]{label}Tunnel restarted ({report.mode}): PID {report.old_pid or '-'} → {report.new_pid}, "
+                  f"{report.connections} edge connection(s) after {report.ready_after:.1f}s.[/green]")
+    console.print(f"{label}Downtime: [bold]{report.downtime:.2f}s[/bold], in-flight requests dropped: [bold]{report.dropped}[/bold]")
+    return True
 
 @app.command()
-def restart():
+def restart(names: Optional[List[str]] = PROFILE_NAMES, all_profiles: bool = ALL_PROFILES,
+            blue_green: bool = typer.Option(False, "--blue-green", "-b", help="Start the new process and wait for it to connect before draining the old one."),
+            grace_period: float = typer.Option(DEFAULT_GRACE_PERIOD, "--grace-period", help="Seconds the old process may spend finishing in-flight requests (--blue-green).")):
     """
     Restart the tunnel process.
     """
+    profiles = _resolve(names, all_profiles)
     refresh_interface(-1)
     console.print("[bold cyan]Restarting TunnelFlare...[/bold cyan]")
-    _stop()
-    time.sleep(2)
-    _start()
+    if blue_green:
+        _for_each(lambda profile: _blue_green_restart(profile, grace_period), profiles)
+    else:
+        _for_each(_restart, profiles)
+
+@app.command()
+def route(source: str = typer.Argument(..., help="CSV or YAML file of hostname/service pairs, or '-' to read stdin."),
+          profile_name: str = typer.Option(DEFAULT_PROFILE, "--profile", "-p", help="Tunnel profile to route to."),
+          workers: int = typer.Option(DEFAULT_WORKERS, "--workers", "-w", help="Parallel 'route dns' operations."),
+          retries: int = typer.Option(DEFAULT_RETRIES, "--retries", help="Retries per hostname on transient failures."),
+          overwrite_dns: bool = typer.Option(False, "--overwrite-dns", help="Replace existing DNS records for these hostnames."),
+          skip_dns: bool = typer.Option(False, "--skip-dns", help="Only update the ingress rules; don't touch DNS."),
+          no_restart: bool = typer.Option(False, "--no-restart", help="Don't reload a running tunnel afterwards.")):
+    """
+    Route many hostnames to a tunnel at once.
+    """
+    from rich.progress import BarColumn, MofNCompleteColumn, Progress, SpinnerColumn, TextColumn
+    from routing import RouteFileError, load_routes, merge_ingress, route_all
+
+    profile = _resolve([profile_name], False)[0]
+    label = _label(profile)
+    try:
+        routes = load_routes(source)
+    except RouteFileError as e:
+        console.print(f"[red]Invalid routes file: {e}[/red]")
+        raise typer.Exit(code=1)
+    if not routes:
+        console.print("[yellow]No routes found.[/yellow]")
+        return
+
+    params = _launch_params(profile)
+    if params is None:
+        raise typer.Exit(code=1)
+    tunnel_id, _ = params
+
+    if skip_dns:
+        routed = routes
+    else:
+        hostnames = len({r.hostname for r in routes})
+        with Progress(SpinnerColumn(), TextColumn("[bold]{task.description}"), BarColumn(),
+                      MofNCompleteColumn(), console=console) as progress:
+            task = progress.add_task(f"{label}Routing DNS", total=hostnames)
+            done = set()
+            def advance(result):
+                if result.route.hostname not in done:
+                    done.add(result.route.hostname)
+                    progress.advance(task)
+            results = route_all(tunnel_id, routes, workers=workers, retries=retries,
+                                overwrite=overwrite_dns, on_done=advance)
+        failed = [r for r in results if not r.ok]
+        for result in failed:
+            console.print(f"[red]{label}{result.route.hostname}: {result.error} (after {result.attempts} attempt(s))[/red]")
+        routed = [r.route for r in results if r.ok]
+        console.print(f"[green]{label}Routed {len({r.hostname for r in routed})}/{hostnames} hostname(s).[/green]")
+
+    if not routed:
+        raise typer.Exit(code=1)
+
+    # One config write for the whole batch, merged into the file as it is
+    # now under its lock, so a dashboard commit at the same moment isn't lost...
+    with profile.store.transaction() as config:
+        added, updated = merge_ingress(config, routed)
+    console.print(f"[green]{label}Ingress: {added} rule(s) added, {updated} updated.[/green]")
+
+    # ...and at most one reload.
+    if (added or updated) and not no_restart and is_tunnel_running(profile):
+        _blue_green_restart(profile, DEFAULT_GRACE_PERIOD)
+
+    if not skip_dns and failed:
+        raise typer.Exit(code=1)
+
+@app.command()
+def match(urls: Optional[List[str]] = typer.Argument(None, metavar="[URL]...", help="URLs (or host/path) to look up."),
+          profile_name: str = typer.Option(DEFAULT_PROFILE, "--profile", "-p", help="Tunnel profile whose config to read."),
+          lint_rules: bool = typer.Option(True, "--lint/--no-lint", help="Check the rules for duplicates, unreachable rules and overlaps.")):
+    """
+    Show which ingress rule serves a URL, and check the rules for mistakes.
+    """
+    import time
+    from ingress import lint
+
+    profile = _resolve([profile_name], False)[0]
+    label = _label(profile)
+    if not profile.store.exists():
+        console.print(f"[red]{label}No configuration found at {profile.config_file}.[/red]")
+        raise typer.Exit(code=1)
+    started = time.perf_counter()
+    try:
+        rules = profile.store.ingress()
+        index = profile.store.ingress_index()
+    except Exception as e:
+        console.print(f"[red]{label}Could not read {profile.config_file}: {e}[/red]")
+        raise typer.Exit(code=1)
+
+    failed = False
+    for url in urls or []:
+        host, path, rule = index.match_url(url)
+        if rule is None:
+            console.print(f"[red]{label}{host}{path}: no rule matches; cloudflared answers 404[/red]")
+            failed = True
+            continue
+        how = "any hostname" if not rule.hostname or rule.hostname == "*" else str(rule.hostname)
+        if rule.path:
+            how += f", path {rule.path!r}"
+        console.print(f"{label}{host}{path} → [bold]{rule.service}[/bold] "
+                      f"[dim](rule #{rule.index + 1}: {how})[/dim]")
+
+    if lint_rules:
+        issues = lint(rules, index)
+        elapsed = (time.perf_counter() - started) * 1000
+        for issue in issues:
+            color = "red" if issue.level == "error" else "yellow"
+            console.print(f"[{color}]{label}{issue.level}: rule {issue.rule.id} (#{issue.rule.index + 1}): {issue.message}[/{color}]")
+        if not issues:
+            console.print(f"[green]{label}No problems in {len(rules)} rule(s)[/green] [dim]({elapsed:.1f} ms)[/dim]")
+        else:
+            console.print(f"{label}{len(issues)} problem(s) in {len(rules)} rule(s) [dim]({elapsed:.1f} ms)[/dim]")
+        failed = failed or any(issue.level == "error" for issue in issues)
+    if failed:
+        raise typer.Exit(code=1)
+
+def _plan_table(plans):
+    from rich.table import Table
+    
+    table = Table(title="Planned changes", header_style="bold cyan")
+    table.add_column("Profile")
+    table.add_column("Tunnel")
+    table.add_column("Changes")
+    for item in plans:
+        tunnel = item.spec.tunnel_name or item.tunnel_id or "-"
+        if item.error:
+            changes = f"[red]{item.error}[/red]"
+        elif item.noop:
+            changes = "[dim]up to date[/dim]"
+        else:
+            parts = []
+            if item.create:
+                parts.append("[green]create tunnel[/green]")
+            if item.route:
+                parts.append(f"route {len(item.route)} hostname(s)")
+            for verb, keys in (("+", item.added), ("~", item.changed), ("-", item.removed)):
+                if keys:
+                    parts.append(f"{verb}{len(keys)} rule(s)")
+            if item.config is not None and not (item.added or item.changed or item.removed or item.create):
+                parts.append("update settings")
+            changes = ", ".join(parts)
+        table.add_row(item.profile.name, tunnel, changes)
+    return table
+
+@app.command()
+def apply(path: Path = typer.Argument(..., help="Desired-state YAML file describing tunnels and their ingress rules."),
+          dry_run: bool = typer.Option(False, "--dry-run", "-n", help="Show the plan without changing anything."),
+          workers: int = typer.Option(DEFAULT_WORKERS, "--workers", "-w", help="Parallel cloudflared operations."),
+          retries: int = typer.Option(DEFAULT_RETRIES, "--retries", help="Retries per hostname on transient DNS failures."),
+          overwrite_dns: bool = typer.Option(False, "--overwrite-dns", help="Replace existing DNS records for new hostnames."),
+          grace_period: float = typer.Option(DEFAULT_GRACE_PERIOD, "--grace-period", help="Seconds old processes may spend finishing in-flight requests.")):
+    """
+    Bring tunnels, DNS routes and ingress rules in line with a desired-state file.
+
+    Only creates and updates: profiles and tunnels missing from the file,
+    and DNS records of removed hostnames, are left in place.
+    """
+    from reconcile import DesiredStateError, apply_changes, load_desired, plan_changes
+
+    try:
+        plans = plan_changes(load_desired(path))
+    except DesiredStateError as e:
+        console.print(f"[red]Invalid desired state: {e}[/red]")
+        raise typer.Exit(code=1)
+
+    if all(item.noop for item in plans):
+        console.print("[green]Everything is up to date.[/green]")
+        return
+    console.print(_plan_table(plans))
+    if dry_run:
+        return
+
+    results = apply_changes(plans, restart=lambda profile: _blue_green_restart(profile, grace_period),
+                            workers=workers, retries=retries, overwrite=overwrite_dns)
+    ok = True
+    for result in results:
+        label = f"[bold]\\[{result.plan.profile.name}][/bold] "
+        if result.error:
+            console.print(f"[red]{label}{result.error}[/red]")
+            ok = False
+            continue
+        for hostname, error in result.failed.items():
+            console.print(f"[red]{label}{hostname}: {error}[/red]")
+            ok = False
+        if result.routed:
+            console.print(f"[green]{label}Routed {len(result.routed)} hostname(s).[/green]")
+        if result.written:
+            running = "restarted" if result.restarted else "not running" if not result.plan.profile.running_pid() else "restart failed"
+            console.print(f"[green]{label}Configuration updated ({running}).[/green]")
+    if not ok:
+        raise typer.Exit(code=1)
+
+@app.command()
+def exporter(names: Optional[List[str]] = PROFILE_NAMES, all_profiles: bool = ALL_PROFILES,
+             listen: str = typer.Option("127.0.0.1:9464", "--listen", "-l", help="host:port to serve /metrics on."),
+             interval: float = typer.Option(15.0, "--interval", help="Seconds between health check rounds.")):
+    """
+    Serve TunnelFlare's health signals as Prometheus metrics.
+    """
+    from exporter import Exporter, serve
+
+    profiles = _resolve(names, all_profiles)
+    collector = Exporter(profiles, interval=interval)
+    try:
+        server = serve(collector, listen)
+    except (OSError, ValueError) as e:
+        console.print(f"[red]Cannot listen on {listen}: {e}[/red]")
+        raise typer.Exit(code=1)
+    collector.start()
+    console.print(f"[green]Serving metrics for {', '.join(p.name for p in profiles)} on http://{listen}/metrics[/green]")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        collector.close()
+
+@app.command()
+def history(names: Optional[List[str]] = PROFILE_NAMES, all_profiles: bool = ALL_PROFILES,
+            since: str = typer.Option("24h", "--since", help="Start of the range, as a time ago (e.g. 90m, 24h, 7d)."),
+            until: str = typer.Option("0s", "--until", help="End of the range, as a time ago."),
+            series: str = typer.Option("*", "--series", "-s", help="Only series matching this pattern (e.g. 'latency_ms:*')."),
+            json_output: bool = typer.Option(False, "--json", help="Print every data point as JSON.")):
+    """
+    Show recorded tunnel health: uptime, connections, errors, resources and origin latency.
+    """
+    import json
+    import time
+    from fnmatch import fnmatch
+    from rich.table import Table
+    from history import HistoryStore, downsample, format_value, pick_resolution
+    from latency import sparkline
+    from logrotate import parse_duration
+
+    try:
+        now = time.time()
+        start, end = now - parse_duration(since, "--since"), now - parse_duration(until, "--until")
+    except ValueError as e:
+        console.print(f"[red]{e}[/red]")
+        raise typer.Exit(code=1)
+    if end <= start:
+        console.print("[red]--since must be further back than --until.[/red]")
+        raise typer.Exit(code=1)
+
+    resolution = pick_resolution(start, end)
+    dump = {}
+    for profile in _resolve(names, all_profiles):
+        store = HistoryStore.open_readonly(profile.history_file)
+        if store is None:
+            if not json_output:
+                console.print(f"[yellow]{_label(profile)}No history recorded yet.[/yellow]")
+            dump[profile.name] = {}
+            continue
+        try:
+            wanted = [name for name in store.series() if fnmatch(name, series)]
+            if json_output:
+                dump[profile.name] = {
+                    name: [{"time": p.time, "count": p.count, "avg": p.avg, "min": p.min, "max": p.max}
+                           for p in store.query(name, start, end, resolution)]
+                    for name in wanted
+                }
+                continue
+            table = Table(title=f"{profile.name}: last {since}" + (f" until {until} ago" if until != "0s" else ""),
+                          border_style=CLOUDFLARE_ORANGE)
+            table.add_column("Series", style="bold", overflow="fold")
+            table.add_column("Min", justify="right")
+            table.add_column("Avg", justify="right")
+            table.add_column("Max", justify="right")
+            table.add_column("Trend", no_wrap=True)
+            width = max(1, min(60, console.width - 75, int((end - start) // resolution)))
+            for name, (count, low, avg, high) in store.summary(start, end, wanted).items():
+                trend = sparkline(downsample(store.query(name, start, end, resolution), start, end, width), " ")
+                table.add_row(name, format_value(name, low), format_value(name, avg), format_value(name, high), trend)
+            console.print(table)
+        finally:
+            store.close()
+    if json_output:
+        print(json.dumps({"start": start, "end": end, "resolution": resolution, "profiles": dump}, indent=2))
+
+@app.command()
+def bench(rule_name: Optional[str] = typer.Argument(None, metavar="RULE", help="Ingress rule id or hostname (optional if there is only one HTTP rule)."),
+          profile_name: str = typer.Option(DEFAULT_PROFILE, "--profile", "-p", help="Tunnel profile whose config to read."),
+          connections: int = typer.Option(16, "--connections", "-c", help="Concurrent keep-alive connections."),
+          rate: float = typer.Option(0.0, "--rate", "-r", help="Requests per second (0 = as fast as possible)."),
+          duration: str = typer.Option("10s", "--duration", "-d", help="How long to run each phase (e.g. 30s, 2m)."),
+          hop_delay: float = typer.Option(0.0, "--hop-delay", help="Milliseconds the tunnel stand-in adds each way."),
+          output: Optional[Path] = typer.Option(None, "--output", "-o", help="Where to write the JSON result."),
+          compare: Optional[Path] = typer.Option(None, "--compare", help="A previous result to compare against.")):
+    """
+    Load-test an origin directly and through a local stand-in for the tunnel hop.
+    """
+    import asyncio
+    import json
+    import time
+    from rich.table import Table
+    from bench import BenchError, BenchSettings, bench as run_bench, load_result, pick_rule
+    from logrotate import parse_duration
+
+    profile = _resolve([profile_name], False)[0]
+    label = _label(profile)
+    try:
+        rule = pick_rule(profile.store.ingress(), rule_name)
+        settings = BenchSettings(connections=max(1, connections), rate=max(0.0, rate),
+                                 duration=parse_duration(duration, "--duration"), hop_delay=max(0.0, hop_delay) / 1000)
+        previous = load_result(compare) if compare else None
+    except (BenchError, ValueError, OSError) as e:
+        console.print(f"[red]{label}{e}[/red]")
+        raise typer.Exit(code=1)
+
+    pace = f"{settings.rate:g} req/s" if settings.rate else "unthrottled"
+    console.print(f"{label}Benchmarking [bold]{rule.id}[/bold] ({rule.service}): {settings.connections} connections, "
+                  f"{pace}, {duration} per phase...")
+    try:
+        result = asyncio.run(run_bench(rule, settings))
+    except BenchError as e:
+        console.print(f"[red]{label}{e}[/red]")
+        raise typer.Exit(code=1)
+
+    table = Table(title=f"{rule.id}: latency in ms", border_style=CLOUDFLARE_ORANGE)
+    table.add_column("Path", style="bold", no_wrap=True)
+    for column in ("req/s", "p50", "p90", "p99", "p99.9", "max", "errors"):
+        table.add_column(column, justify="right", no_wrap=True)
+    rows = [("Direct", result["direct"]), ("Tunnel", result["tunnel"])]
+    if previous:
+        rows += [("Direct (before)", previous["direct"]), ("Tunnel (before)", previous["tunnel"])]
+    for name, run in rows:
+        latency = run["latency_ms"] or {}
+        errors = sum(run["errors"].values())
+        table.add_row(name, f"{run['throughput_rps']:.0f}",
+                      *(f"{latency[k]:.2f}" if k in latency else "-" for k in ("p50", "p90", "p99", "p99.9", "max")),
+                      f"[red]{errors}[/red]" if errors else "0")
+    console.print(table)
+    added = result["overhead"]
+    if "p50_ms" in added:
+        console.print(f"Tunnel hop adds [bold]{added['p50_ms']:+.2f} ms[/bold] at p50, {added['p99_ms']:+.2f} ms at p99"
+                      + (f", {added['throughput_ratio'] * 100:.0f}% of direct throughput." if "throughput_ratio" in added else "."))
+
+    path = output or Path(f"tunnelflare-bench-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    try:
+        path.write_text(json.dumps(result, indent=2) + "\n")
+    except OSError as e:
+        console.print(f"[red]Could not write {path}: {e}[/red]")
+        raise typer.Exit(code=1)
+    console.print(f"[green]Results written to {path}[/green]")
+    if not result["direct"]["ok"]:
+        raise typer.Exit(code=1)
+
+@app.command(hidden=True)
+def supervise(profile_name: str = typer.Argument(...),
+              tunnel_id: str = typer.Argument(...),
+              cred_path: Path = typer.Argument(...),
+              grace_period: Optional[float] = typer.Option(None, "--grace-period")):
+    """
+    Run cloudflared for a profile and keep it running (started by 'start').
+    """
+    from logrotate import LogSettings, RotatingLogWriter
+    from supervisor import Supervisor, SupervisorPolicy
+
+    profile = Profile(profile_name)
+    try:
+        config = profile.store.load()
+        settings, policy = LogSettings.from_config(config), SupervisorPolicy.from_config(config)
+    except Exception:
+        settings, policy = LogSettings(), SupervisorPolicy() # A bad block must never stop the tunnel
+    supervisor = Supervisor(profile, tunnel_id, cred_path, grace_period, policy,
+                            RotatingLogWriter(profile.log_file, settings))
+    supervisor.install_signal_handlers()
+    try:
+        pid = supervisor.start_child()
+    except OSError as e:
+        print(f"error {e}", flush=True)
+        supervisor.writer.close()
+        raise typer.Exit(code=1)
+    try:
+        supervisor.open_control()
+    except OSError as e:
+        supervisor.log("WRN", f"control socket unavailable: {e}")
+    # Report the PID to `Profile.spawn`, then let go of its pipe.
+    print(pid, flush=True)
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, 1)
+    os.close(devnull)
+    raise typer.Exit(code=supervisor.run())
 
 @app.command()
 def install():
     """
     Install cloudflared on the system.
     """
+    from utils import check_cloudflared_installed, install_cloudflared
+    
     refresh_interface(-1)
     if check_cloudflared_installed():
         console.print("[green]cloudflared is already installed.[/green]")
@@ -437,18 +948,22 @@ def install():
             console.print("[red]Failed to install cloudflared.[/red]")
 
 @app.command()
-def reset():
+def reset(profile_name: str = typer.Option(DEFAULT_PROFILE, "--profile", "-p", help="Tunnel profile to reset.")):
     """
     Reset TunnelFlare settings and configurations.
     """
+    from rich.prompt import Confirm
+    from inventory import get_inventory
+    
+    profile = _resolve([profile_name], False)[0]
     refresh_interface(-1)
     console.print(f"[{CLOUDFLARE_ORANGE}]Resetting TunnelFlare...[/{CLOUDFLARE_ORANGE}]")
     
     # 1. Remove config.yml
-    if CONFIG_FILE.exists():
-        if Confirm.ask(f"Remove local configuration file ({CONFIG_FILE.absolute()})?"):
+    if profile.config_file.exists():
+        if Confirm.ask(f"Remove local configuration file ({profile.config_file.absolute()})?"):
             try:
-                CONFIG_FILE.unlink()
+                profile.config_file.unlink()
                 console.print("[green]Configuration file removed.[/green]")
             except Exception as e:
                 console.print(f"[red]Failed to remove config file: {e}[/red]")
@@ -463,6 +978,7 @@ def reset():
             try:
                 import shutil
                 shutil.rmtree(cloudflared_dir)
+                get_inventory().invalidate()
                 console.print("[green].cloudflared directory removed.[/green]")
             except Exception as e:
                 console.print(f"[red]Failed to remove .cloudflared directory: {e}[/red]")
@@ -0,0 +1,160 @@
+import re
+import socket
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Tuple
+
+METRICS_HOST = "127.0.0.1"
+METRICS_PATH = "/metrics"
+HISTORY = 60 # Samples kept for sparklines
+
+# Metric families the dashboard shows; everything else is skipped unparsed.
+TOTAL_REQUESTS = "cloudflared_tunnel_total_requests"
+REQUEST_ERRORS = "cloudflared_tunnel_request_errors"
+ACTIVE_STREAMS = "cloudflared_tunnel_concurrent_requests_per_tunnel"
+RESPONSES_BY_CODE = "cloudflared_tunnel_response_by_code"
+HA_CONNECTIONS = "cloudflared_tunnel_ha_connections"
+EDGE_RTT = "quic_client_smoothed_rtt"
+DASHBOARD_METRICS = (TOTAL_REQUESTS, REQUEST_ERRORS, ACTIVE_STREAMS, RESPONSES_BY_CODE,
+                     HA_CONNECTIONS, EDGE_RTT)
+
+_LABEL_RE = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+Sample = Tuple[Dict[str, str], float] # (labels, value)
+
+
+def allocate_port(host: str = METRICS_HOST) -> int:
+    """A currently free local TCP port for a cloudflared metrics server."""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind((host, 0))
+        return s.getsockname()[1]
+
+
+class MetricsParser:
+    """
+    Incremental parser for the Prometheus text exposition format.
+
+    Text can be fed in arbitrary chunks as it arrives. Only the families in
+    `wanted` are parsed (cloudflared exports hundreds of Go runtime series
+    the dashboard never shows); other lines are dropped after a prefix check.
+    """
+
+    def __init__(self, wanted: Optional[Iterable[str]] = None):
+        self.wanted = frozenset(wanted) if wanted else None
+        self._prefixes = tuple(self.wanted) if self.wanted else ("",)
+        self._partial = ""
+        self.samples: Dict[str, List[Sample]] = {}
+
+    def feed(self, chunk: str):
+        lines = (self._partial + chunk).split("\n")
+        self._partial = lines.pop()
+        for line in lines:
+            self._parse_line(line)
+
+    def close(self) -> Dict[str, List[Sample]]:
+        if self._partial:
+            self._parse_line(self._partial)
+            self._partial = ""
+        return self.samples
+
+    def _parse_line(self, line: str):
+        if not line or line[0] == "#" or not line.startswith(self._prefixes):
+            return
+        brace = line.find("{")
+        if brace != -1:
+            end = line.rfind("}")
+            if end < brace:
+                return
+            name = line[:brace]
+            labels = {k: v.replace('\\"', '"').replace("\\\\", "\\")
+                      for k, v in _LABEL_RE.findall(line, brace, end)}
+            rest = line[end + 1:].split()
+        else:
+            name, _, rest = line.partition(" ")
+            labels = {}
+            rest = rest.split()
+        if not rest or (self.wanted is not None and name not in self.wanted):
+            return
+        try:
+            value = float(rest[0])
+        except ValueError:
+            return
+        self.samples.setdefault(name, []).append((labels, value))
+
+
+def parse_metrics(text: str, wanted: Optional[Iterable[str]] = None) -> Dict[str, List[Sample]]:
+    parser = MetricsParser(wanted)
+    parser.feed(text)
+    return parser.close()
+
+
+def _total(samples: Dict[str, List[Sample]], name: str) -> Optional[float]:
+    values = samples.get(name)
+    if not values:
+        return None
+    return sum(value for _, value in values)
+
+
+class TrafficStats:
+    """
+    Rates and gauges derived from successive metrics scrapes.
+
+    Counters are turned into per-second rates between scrapes (a counter
+    going backwards means cloudflared restarted, so its value is the
+    delta). Each series keeps the last `history` points for sparklines.
+    """
+
+    def __init__(self, history: int = HISTORY):
+        self.requests = deque(maxlen=history) # Requests/s
+        self.errors = deque(maxlen=history) # Failed requests/s
+        self.streams = deque(maxlen=history) # Active streams
+        self.connections = deque(maxlen=history) # HA connections
+        self.rtt = deque(maxlen=history) # Mean edge RTT, ms
+        self.codes = deque(maxlen=history) # Per-scrape {status class: count}
+        self.updated_at: Optional[float] = None
+        self._previous: Optional[Tuple[float, Dict[str, float]]] = None
+
+    def reset(self):
+        for series in (self.requests, self.errors, self.streams, self.connections, self.rtt, self.codes):
+            series.clear()
+        self.updated_at = None
+        self._previous = None
+
+    def update(self, samples: Dict[str, List[Sample]], now: float):
+        counters = {
+            TOTAL_REQUESTS: _total(samples, TOTAL_REQUESTS) or 0.0,
+            REQUEST_ERRORS: _total(samples, REQUEST_ERRORS) or 0.0,
+        }
+        for labels, value in samples.get(RESPONSES_BY_CODE, ()):
+            code = labels.get("status_code", "")
+            key = "code:" + (code[0] + "xx" if code[:1].isdigit() else "other")
+            counters[key] = counters.get(key, 0.0) + value
+
+        if self._previous is not None:
+            then, before = self._previous
+            elapsed = max(now - then, 1e-6)
+            deltas = {}
+            for key, value in counters.items():
+                old = before.get(key, 0.0)
+                deltas[key] = value - old if value >= old else value
+            self.requests.append(deltas[TOTAL_REQUESTS] / elapsed)
+            self.errors.append(deltas[REQUEST_ERRORS] / elapsed)
+            self.codes.append({k[5:]: v for k, v in deltas.items() if k.startswith("code:") and v})
+        self._previous = (now, counters)
+
+        self.streams.append(_total(samples, ACTIVE_STREAMS) or 0.0)
+        self.connections.append(_total(samples, HA_CONNECTIONS) or 0.0)
+        rtts = [value for _, value in samples.get(EDGE_RTT, ())]
+        self.rtt.append(sum(rtts) / len(rtts) if rtts else 0.0)
+        self.updated_at = now
+
+    def code_mix(self) -> Dict[str, float]:
+        """Responses per status class over the kept history."""
+        mix: Dict[str, float] = {}
+        for codes in self.codes:
+            for key, count in codes.items():
+                mix[key] = mix.get(key, 0.0) + count
+        return dict(sorted(mix.items()))
+
+    @staticmethod
+    def latest(series) -> float:
+        return series[-1] if series else 0.0
@@ -0,0 +1,217 @@
+import asyncio
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, FrozenSet, Iterable, List, Optional
+from urllib.parse import urlsplit
+
+from config import IngressRule
+from httpclient import ConnectionPool
+
+DEFAULT_TIMEOUT = 1.0
+DEFAULT_CONCURRENCY = 256
+TCP_SCHEMES = ("tcp", "ssh", "rdp", "smb")
+# Ports cloudflared's TCP services listen on when the URL has none; a bare
+# tcp:// service has no default, so it can't be probed.
+TCP_DEFAULT_PORTS = {"ssh": 22, "rdp": 3389, "smb": 445}
+
+
+@dataclass(frozen=True)
+class ProbeSpec:
+    """What to check for one ingress rule."""
+    rule_id: str
+    url: str
+    method: str = "GET"
+    expect: Optional[FrozenSet[int]] = None
+    verify: bool = True
+
+    @property
+    def target(self):
+        # Rules pointing at the same origin with the same check share a probe.
+        return (self.url, self.method, self.expect, self.verify)
+
+
+@dataclass
+class ProbeResult:
+    rule_id: str
+    url: str
+    ok: bool
+    status: Optional[int]
+    latency: Optional[float]
+    error: Optional[str]
+    checked_at: float
+
+
+def parse_expect(value) -> Optional[FrozenSet[int]]:
+    """
+    Parse a rule's `health.expect` value.
+
+    Accepts a status code, a list of codes, or class patterns like "2xx".
+    None means any HTTP response counts as healthy.
+    """
+    if value is None:
+        return None
+    if not isinstance(value, (list, tuple)):
+        value = [value]
+    codes = set()
+    for item in value:
+        text = str(item).strip().lower()
+        if len(text) == 3 and text.endswith("xx") and text[0].isdigit():
+            base = int(text[0]) * 100
+            codes.update(range(base, base + 100))
+        else:
+            codes.add(int(text))
+    return frozenset(codes)
+
+
+def build_specs(rules: Iterable[IngressRule]) -> List[ProbeSpec]:
+    """
+    Build probe specs for every rule with a probeable origin.
+
+    HTTP(S) services are requested directly; tcp/ssh/rdp/smb services get a
+    plain TCP connect, to the scheme's default port if none is given (tcp://
+    needs one). An optional `health` mapping on the rule can set
+    `path`, `method` (e.g. HEAD) and `expect` status codes.
+    """
+    specs = []
+    for rule in rules:
+        service = rule.service
+        scheme = service.split(":", 1)[0].lower()
+        if scheme not in ("http", "https") + TCP_SCHEMES:
+            continue
+        if scheme in TCP_SCHEMES:
+            try:
+                port = urlsplit(service).port
+            except ValueError:
+                continue # Not a valid port
+            if port is None and scheme not in TCP_DEFAULT_PORTS:
+                continue
+        health = rule.raw.get("health") or {}
+        if not isinstance(health, dict):
+            health = {}
+        url = service
+        method = "CONNECT" if scheme in TCP_SCHEMES else str(health.get("method", "GET")).upper()
+        if scheme in ("http", "https") and health.get("path"):
+            url = service.rstrip("/") + "/" + str(health["path"]).lstrip("/")
+        origin_request = rule.raw.get("originRequest") or {}
+        verify = not (isinstance(origin_request, dict) and origin_request.get("noTLSVerify"))
+        try:
+            expect = parse_expect(health.get("expect"))
+        except ValueError:
+            expect = None
+        specs.append(ProbeSpec(rule.id, url, method, expect, verify))
+    return specs
+
+
+class ProbeEngine:
+    """
+    Checks every ingress origin concurrently.
+
+    A sweep fires all probes at once (bounded by `concurrency`) over pooled
+    keep-alive connections, so it takes about one `timeout` however many
+    rules there are. The engine can be driven from asyncio code with
+    `sweep()`, or from threads with `run()`, which uses a private event loop
+    so the connection pool survives between sweeps.
+    """
+
+    def __init__(self, timeout: float = DEFAULT_TIMEOUT, concurrency: int = DEFAULT_CONCURRENCY):
+        self.timeout = timeout
+        self.concurrency = concurrency
+        self.results: Dict[str, ProbeResult] = {}
+        self._pool = None
+        self._loop = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    async def _check(self, spec: ProbeSpec, limit: asyncio.Semaphore) -> ProbeResult:
+        async with limit:
+            started = time.monotonic()
+            status = None
+            error = None
+            try:
+                if spec.method == "CONNECT":
+                    parts = urlsplit(spec.url)
+                    _, writer = await asyncio.wait_for(
+                        asyncio.open_connection(parts.hostname or "localhost", parts.port or TCP_DEFAULT_PORTS[parts.scheme.lower()]),
+                        self.timeout)
+                    writer.close()
+                    ok = True
+                else:
+                    response = await asyncio.wait_for(
+                        self._pool.request(spec.method, spec.url, verify=spec.verify), self.timeout)
+                    status = response.status
+                    ok = spec.expect is None or status in spec.expect
+                    if not ok:
+                        error = f"unexpected status {status}"
+            except asyncio.TimeoutError:
+                ok, error = False, "timeout"
+            except Exception as e:
+                ok, error = False, str(e) or type(e).__name__
+            latency = time.monotonic() - started
+            return ProbeResult(spec.rule_id, spec.url, ok, status, latency, error, time.time())
+
+    async def sweep(self, specs: List[ProbeSpec]) -> Dict[str, ProbeResult]:
+        """Probe all specs at once and return results keyed by rule id."""
+        if self._pool is None:
+            self._pool = ConnectionPool()
+        limit = asyncio.Semaphore(self.concurrency)
+
+        unique = {}
+        for spec in specs:
+            unique.setdefault(spec.target, spec)
+        targets = list(unique.values())
+        checked = await asyncio.gather(*(self._check(spec, limit) for spec in targets))
+        by_target = {spec.target: result for spec, result in zip(targets, checked)}
+
+        results = {}
+        for spec in specs:
+            shared = by_target[spec.target]
+            results[spec.rule_id] = ProbeResult(spec.rule_id, spec.url, shared.ok, shared.status,
+                                                shared.latency, shared.error, shared.checked_at)
+        self.results = results
+        return results
+
+    @staticmethod
+    def _serve(loop: asyncio.AbstractEventLoop):
+        try:
+            loop.run_forever()
+        finally:
+            loop.close() # Here, once it has stopped: close() can't close a running loop
+
+    def _ensure_loop(self):
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self._serve, args=(self._loop,),
+                                                name="tunnelflare-probe", daemon=True)
+                self._thread.start()
+            return self._loop
+
+    def run(self, specs: List[ProbeSpec]) -> Dict[str, ProbeResult]:
+        """Blocking sweep for callers running in a worker thread."""
+        loop = self._ensure_loop()
+        future = asyncio.run_coroutine_threadsafe(self.sweep(specs), loop)
+        return future.result()
+
+    def close(self):
+        with self._lock:
+            loop, thread = self._loop, self._thread
+            self._loop = self._thread = None
+        if loop is not None:
+            if self._pool is not None:
+                loop.call_soon_threadsafe(self._pool.close)
+            # The loop thread closes the loop once it stops. If a sweep is
+            # still stuck past the timeout, it is left to finish on its own.
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join(timeout=1)
+        self._pool = None
+
+
+def summarize(results: Dict[str, ProbeResult]) -> str:
+    """Collapse per-rule results into the dashboard's ok/warning/error status."""
+    if not results:
+        return "ok"
+    healthy = sum(1 for r in results.values() if r.ok)
+    if healthy == len(results):
+        return "ok"
+    return "warning" if healthy else "error"
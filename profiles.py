@@ -0,0 +1,415 @@
+import fcntl
+import json
+import os
+import re
+import select
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+from config import TUNNEL_DIR, PID_FILE, LOG_FILE, CONFIG_FILE, ConfigStore, get_store
+from metrics import METRICS_HOST, allocate_port
+
+DEFAULT_PROFILE = "default"
+PROFILES_DIR = TUNNEL_DIR / "tunnels"
+STATE_FILE = TUNNEL_DIR / "state.json"
+STOP_TIMEOUT = 5 # Seconds to wait for a graceful stop before SIGKILL
+DEFAULT_GRACE_PERIOD = 30.0 # Seconds a replaced cloudflared may spend on in-flight requests (bluegreen.py)
+
+_CLK_TCK = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+_NAME_RE = re.compile(r"^[A-Za-z0-9][A-Za-z0-9._-]*$")
+
+
+class ProfileError(Exception):
+    """Raised for unknown or invalid tunnel profile names."""
+
+
+def self_command() -> List[str]:
+    """Command line that runs this TunnelFlare CLI (packaged binary or main.py)."""
+    if getattr(sys, "frozen", False):
+        return [sys.executable]
+    return [sys.executable, str(Path(__file__).resolve().with_name("main.py"))]
+
+
+def proc_stat(pid: int) -> Optional[List[bytes]]:
+    """Fields of /proc/<pid>/stat after the command name (state first), None without /proc."""
+    try:
+        with open(f"/proc/{pid}/stat", "rb") as f:
+            # The command name is parenthesised and may itself contain spaces.
+            return f.read().rpartition(b")")[2].split()
+    except OSError:
+        return None
+
+
+def process_start_time(pid: int) -> Optional[int]:
+    """
+    When `pid` started, in clock ticks since boot. Recorded next to a PID
+    so a later, unrelated process that reuses the number isn't mistaken
+    for ours.
+    """
+    fields = proc_stat(pid)
+    try:
+        return int(fields[19])
+    except (TypeError, IndexError, ValueError):
+        return None
+
+
+def _boot_time() -> Optional[float]:
+    try:
+        with open("/proc/stat", "r") as f:
+            for line in f:
+                if line.startswith("btime "):
+                    return float(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def process_resources(pid: int) -> Optional[Dict[str, float]]:
+    """CPU, memory, thread and file descriptor usage of `pid`, from /proc."""
+    fields = proc_stat(pid)
+    if not fields or len(fields) < 22:
+        return None
+    resources = {
+        "cpu_seconds_total": (int(fields[11]) + int(fields[12])) / _CLK_TCK,
+        "threads": float(fields[17]),
+        "resident_memory_bytes": float(int(fields[21]) * _PAGE_SIZE),
+    }
+    boot = _boot_time()
+    if boot is not None:
+        resources["start_time_seconds"] = boot + int(fields[19]) / _CLK_TCK
+    try:
+        resources["open_fds"] = float(len(os.listdir(f"/proc/{pid}/fd")))
+    except OSError:
+        pass # Someone else's process
+    return resources
+
+
+def pid_alive(pid: int, start_time: Optional[int] = None) -> bool:
+    """True if `pid` is a live (non-zombie) process, started at `start_time` if given."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    if not os.path.isdir("/proc"):
+        return True # No /proc; trust kill()
+    fields = proc_stat(pid)
+    if not fields or fields[0] == b"Z":
+        return False
+    if start_time is not None and len(fields) > 19 and fields[19] != str(start_time).encode():
+        return False # The PID was reused
+    return True
+
+
+def reap(pid: int):
+    """Collect the exit status if `pid` is our child, so it doesn't linger as a zombie."""
+    try:
+        os.waitpid(pid, os.WNOHANG)
+    except ChildProcessError:
+        pass
+
+
+def wait_for_exit(pid: int, timeout: float) -> bool:
+    """
+    Block until `pid` exits or `timeout` seconds pass; True if it exited.
+
+    Uses a pidfd where the kernel supports it, so we sleep until the exit
+    instead of polling; otherwise falls back to a short polling loop.
+    """
+    deadline = time.monotonic() + timeout
+    try:
+        fd = os.pidfd_open(pid)
+    except (AttributeError, OSError):
+        fd = None
+    if fd is not None:
+        try:
+            poller = select.poll()
+            poller.register(fd, select.POLLIN)
+            exited = bool(poller.poll(max(0.0, timeout) * 1000))
+        finally:
+            os.close(fd)
+        if exited:
+            reap(pid)
+        return exited
+    while pid_alive(pid):
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(0.05)
+    reap(pid)
+    return True
+
+
+async def wait_for_exit_async(pid: int, timeout: float) -> bool:
+    """
+    Asyncio version of `wait_for_exit` that never blocks the event loop.
+
+    The pidfd is registered with the loop's selector, so the coroutine is
+    woken by the kernel when the process exits.
+    """
+    import asyncio
+
+    loop = asyncio.get_running_loop()
+    try:
+        fd = os.pidfd_open(pid)
+    except (AttributeError, OSError):
+        fd = None
+    if fd is None:
+        deadline = loop.time() + timeout
+        while pid_alive(pid):
+            if loop.time() >= deadline:
+                return False
+            await asyncio.sleep(0.05)
+        reap(pid)
+        return True
+
+    exited = loop.create_future()
+    loop.add_reader(fd, lambda: exited.done() or exited.set_result(True))
+    try:
+        await asyncio.wait_for(exited, timeout)
+    except asyncio.TimeoutError:
+        return False
+    finally:
+        loop.remove_reader(fd)
+        os.close(fd)
+    reap(pid)
+    return True
+
+
+class Profile:
+    """
+    A named tunnel with its own config, PID, log and state files.
+
+    The "default" profile uses the original single-tunnel paths directly
+    under ~/.tunnelflare so existing installs keep working; every other
+    profile lives in ~/.tunnelflare/tunnels/<name>/.
+    """
+
+    def __init__(self, name: str):
+        if not _NAME_RE.match(name):
+            raise ProfileError(f"Invalid tunnel profile name: {name!r}")
+        self.name = name
+        if name == DEFAULT_PROFILE:
+            self.dir = TUNNEL_DIR
+            self.config_file = CONFIG_FILE
+            self.pid_file = PID_FILE
+            self.log_file = LOG_FILE
+            self.state_file = STATE_FILE
+            self.socket_file = TUNNEL_DIR / "control.sock"
+            self.history_file = TUNNEL_DIR / "history.db"
+            self.restart_lock_file = TUNNEL_DIR / "restart.lock"
+        else:
+            self.dir = PROFILES_DIR / name
+            self.config_file = self.dir / "config.yml"
+            self.pid_file = self.dir / "tunnel.pid"
+            self.log_file = self.dir / "tunnel.log"
+            self.state_file = self.dir / "state.json"
+            self.socket_file = self.dir / "control.sock"
+            self.history_file = self.dir / "history.db"
+            self.restart_lock_file = self.dir / "restart.lock"
+
+    def __repr__(self):
+        return f"Profile({self.name!r})"
+
+    def __eq__(self, other):
+        return isinstance(other, Profile) and other.name == self.name
+
+    def __hash__(self):
+        return hash(self.name)
+
+    @property
+    def store(self) -> ConfigStore:
+        return get_store(self.config_file)
+
+    def exists(self) -> bool:
+        return self.config_file.exists()
+
+    def read_pid(self) -> Optional[int]:
+        try:
+            return int(self.pid_file.read_text().strip())
+        except (OSError, ValueError):
+            return None
+
+    def running_pid(self) -> Optional[int]:
+        """PID of the tunnel process if it is alive, else None."""
+        pid = self.read_pid()
+        if pid is None:
+            return None
+        state = self.read_state()
+        start_time = state.get("pid_start") if state.get("pid") == pid else None
+        if not pid_alive(pid, start_time):
+            return None
+        return pid
+
+    def read_state(self) -> dict:
+        try:
+            with open(self.state_file, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def write_state(self, **updates) -> dict:
+        """
+        Merge `updates` into the state file. The supervisor, the CLI and the
+        dashboard all write it, so the read-modify-write holds an flock on a
+        `.lock` file next to it and replaces the file atomically.
+        """
+        self.state_file.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.state_file.with_name(self.state_file.name + ".lock"), "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            state = self.read_state()
+            state.update(updates)
+            fd, tmp = tempfile.mkstemp(dir=self.state_file.parent, prefix=f".{self.state_file.name}.")
+            try:
+                with os.fdopen(fd, "w") as f:
+                    json.dump(state, f)
+                os.replace(tmp, self.state_file)
+            except BaseException:
+                try:
+                    os.unlink(tmp)
+                except OSError:
+                    pass
+                raise
+        return state
+
+    def launch(self, tunnel_id: str, cred_path: Path, grace_period: Optional[float] = None) -> subprocess.Popen:
+        """
+        Start cloudflared with its output on a pipe and record it as this
+        profile's tunnel. Used by the supervisor; everything else calls `spawn`.
+        """
+        self.dir.mkdir(parents=True, exist_ok=True)
+
+        # Each process gets a fresh port so blue/green replicas don't collide.
+        metrics_address = f"{METRICS_HOST}:{allocate_port()}"
+        cmd = [
+            "cloudflared",
+            "tunnel",
+            "--config", str(self.config_file),
+            "--cred-file", str(cred_path),
+            "--metrics", metrics_address,
+        ]
+        if grace_period is not None:
+            # How long cloudflared waits for in-flight requests on SIGINT/SIGTERM
+            cmd += ["--grace-period", f"{int(grace_period)}s"]
+        cmd += ["run", tunnel_id]
+
+        process = subprocess.Popen(
+            cmd,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+        )
+        with open(self.pid_file, "w") as f:
+            f.write(str(process.pid))
+        self.write_state(pid=process.pid, pid_start=process_start_time(process.pid), tunnel_id=tunnel_id,
+                         started_at=time.time(), stopped_at=None, metrics=metrics_address)
+        return process
+
+    def spawn(self, tunnel_id: str, cred_path: Path, grace_period: Optional[float] = None) -> int:
+        """
+        Start cloudflared for this profile in the background, under a
+        detached `tunnelflare supervise` process, and return its PID.
+
+        The supervisor owns cloudflared's output (see logrotate.py) and
+        restarts it if it dies or hangs (see supervisor.py).
+        """
+        cmd = self_command() + ["supervise", self.name, tunnel_id, str(cred_path)]
+        if grace_period is not None:
+            cmd += ["--grace-period", str(grace_period)]
+        process = subprocess.Popen(
+            cmd,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True, # Detach from terminal
+            text=True
+        )
+        # The supervisor reports cloudflared's PID (or why it couldn't start it) on one line.
+        with process.stdout:
+            reply = process.stdout.readline().strip()
+        if not reply.isdigit():
+            process.wait()
+            raise ProfileError(reply.partition(" ")[2] or f"supervisor exited with code {process.returncode}")
+        return int(reply)
+
+    def adopt(self, pid: int, state: Optional[dict] = None):
+        """
+        Record an already running process as this profile's tunnel. With
+        `state` (a `read_state()` snapshot taken while it was the tunnel),
+        its metrics address, supervisor and the rest are put back too.
+        """
+        with open(self.pid_file, "w") as f:
+            f.write(str(pid))
+        updates = {}
+        if state is not None:
+            updates = {key: None for key in self.read_state() if key not in state}
+            updates.update(state)
+        updates.update(pid=pid, pid_start=process_start_time(pid))
+        self.write_state(**updates)
+
+    def supervisor_pid(self) -> Optional[int]:
+        """PID of the profile's supervisor if it is alive, else None."""
+        state = self.read_state()
+        pid = state.get("supervisor")
+        if not isinstance(pid, int) or not pid_alive(pid, state.get("supervisor_start")):
+            return None
+        return pid
+
+    def release(self):
+        """
+        Forget the tunnel's PID. Call this before stopping the process on
+        purpose: the supervisor restarts a tunnel that exits while the PID
+        file still names it.
+        """
+        try:
+            self.pid_file.unlink()
+        except FileNotFoundError:
+            pass
+        self.write_state(pid=None, stopped_at=time.time())
+
+    def terminate(self, sig: int = signal.SIGTERM) -> Optional[int]:
+        """Signal the running tunnel process and forget its PID."""
+        pid = self.running_pid()
+        if pid is None:
+            return None
+        self.release()
+        os.kill(pid, sig)
+        return pid
+
+
+def list_profiles() -> List[Profile]:
+    """All configured profiles, the default one first."""
+    profiles = []
+    if CONFIG_FILE.exists() or PID_FILE.exists():
+        profiles.append(Profile(DEFAULT_PROFILE))
+    if PROFILES_DIR.is_dir():
+        for entry in sorted(PROFILES_DIR.iterdir()):
+            if entry.is_dir() and _NAME_RE.match(entry.name) and entry.name != DEFAULT_PROFILE:
+                profiles.append(Profile(entry.name))
+    return profiles
+
+
+def resolve_profiles(names: Optional[Iterable[str]], all_profiles: bool = False) -> List[Profile]:
+    """
+    Turn CLI arguments into profiles.
+
+    No names means the default profile; `all_profiles` means every
+    configured one.
+    """
+    if all_profiles:
+        return list_profiles()
+    names = list(names or [])
+    if not names:
+        return [Profile(DEFAULT_PROFILE)]
+    profiles = []
+    for name in names:
+        profile = Profile(name)
+        if profile not in profiles:
+            profiles.append(profile)
+    return profiles
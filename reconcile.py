@@ -0,0 +1,264 @@
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+import yaml
+
+from config import CATCH_ALL_SERVICE, SafeLoader
+from inventory import InventoryError, credentials_file, get_inventory
+from profiles import DEFAULT_PROFILE, Profile, ProfileError
+from routing import DEFAULT_RETRIES, DEFAULT_WORKERS, route_dns
+
+# Keys of a desired tunnel that are ours rather than cloudflared config.
+_SPEC_KEYS = ("tunnel", "ingress")
+
+
+class DesiredStateError(Exception):
+    """Raised when a desired-state file is malformed."""
+
+
+@dataclass
+class TunnelSpec:
+    """Desired state of one tunnel profile."""
+    profile: str
+    tunnel_name: Optional[str] # None: keep whatever tunnel the profile already uses
+    ingress: List[dict]
+    extra: Dict = field(default_factory=dict) # Other cloudflared settings, passed through
+
+
+@dataclass
+class ProfilePlan:
+    profile: Profile
+    spec: TunnelSpec
+    tunnel_id: Optional[str] # None until the tunnel has been created
+    create: bool = False
+    route: List[str] = field(default_factory=list) # Hostnames needing a DNS record
+    added: List[str] = field(default_factory=list) # Ingress rule keys
+    removed: List[str] = field(default_factory=list)
+    changed: List[str] = field(default_factory=list)
+    config: Optional[dict] = None # Config to write, None if unchanged
+    error: Optional[str] = None
+
+    @property
+    def noop(self) -> bool:
+        return not (self.create or self.route or self.config is not None or self.error)
+
+
+@dataclass
+class ProfileResult:
+    plan: ProfilePlan
+    tunnel_id: Optional[str] = None
+    routed: List[str] = field(default_factory=list)
+    failed: Dict[str, str] = field(default_factory=dict) # hostname -> error
+    written: bool = False
+    restarted: bool = False
+    error: Optional[str] = None
+
+
+def _rule_key(rule: dict) -> str:
+    key = rule.get("hostname") or "*"
+    if rule.get("path"):
+        key += rule["path"]
+    return key
+
+
+def _with_catch_all(ingress: List[dict]) -> List[dict]:
+    if ingress and not ingress[-1].get("hostname") and not ingress[-1].get("path"):
+        return ingress
+    return ingress + [{"service": CATCH_ALL_SERVICE}]
+
+
+def parse_desired(data) -> List[TunnelSpec]:
+    """
+    Parse a desired-state document.
+
+    The document has a `tunnels` mapping of profile name to tunnel, each
+    with an optional `tunnel` (the tunnel's name in the account, defaulting
+    to the profile name) and an `ingress` list. Any other keys are copied
+    into the profile's config as-is. A document with a top-level `ingress`
+    instead describes just the default profile.
+    """
+    if not isinstance(data, dict):
+        raise DesiredStateError("expected a mapping with 'tunnels' or 'ingress'")
+    if "tunnels" in data:
+        tunnels = data["tunnels"]
+        if not isinstance(tunnels, dict):
+            raise DesiredStateError("'tunnels' must map profile names to tunnels")
+    else:
+        tunnels = {DEFAULT_PROFILE: data}
+
+    specs = []
+    for name, body in tunnels.items():
+        name = str(name)
+        body = body or {}
+        if not isinstance(body, dict):
+            raise DesiredStateError(f"{name}: expected a mapping")
+        ingress = body.get("ingress") or []
+        if not isinstance(ingress, list):
+            raise DesiredStateError(f"{name}: 'ingress' must be a list")
+        rules = []
+        for number, rule in enumerate(ingress, 1):
+            if not isinstance(rule, dict) or not rule.get("service"):
+                raise DesiredStateError(f"{name}: ingress rule {number} needs a service")
+            rules.append(dict(rule))
+        tunnel_name = body.get("tunnel")
+        if tunnel_name is None and name != DEFAULT_PROFILE:
+            tunnel_name = name
+        extra = {k: v for k, v in body.items() if k not in _SPEC_KEYS}
+        specs.append(TunnelSpec(name, str(tunnel_name) if tunnel_name else None,
+                                _with_catch_all(rules), extra))
+    return specs
+
+
+def load_desired(path: Path) -> List[TunnelSpec]:
+    try:
+        with open(path, "r") as f:
+            data = yaml.load(f, Loader=SafeLoader)
+    except OSError as e:
+        raise DesiredStateError(f"cannot read {path}: {e.strerror}")
+    except yaml.YAMLError as e:
+        raise DesiredStateError(f"invalid YAML: {e}")
+    return parse_desired(data)
+
+
+def _resolve_tunnel(spec: TunnelSpec, current_id: Optional[str]) -> Tuple[Optional[str], bool]:
+    """(tunnel_id, needs_create), touching cloudflared only if the cache can't answer."""
+    inventory = get_inventory()
+    if spec.tunnel_name is None:
+        if not current_id:
+            raise DesiredStateError(f"{spec.profile}: no tunnel configured; set 'tunnel' to a tunnel name")
+        return current_id, False
+    if current_id:
+        # The profile's tunnel rarely changes name, so even a stale cache will do.
+        known = inventory.by_id(current_id, fetch=False)
+        if known is not None and known.name == spec.tunnel_name:
+            return current_id, False
+    tunnel = inventory.by_name(spec.tunnel_name)
+    if tunnel is None:
+        return None, True
+    return tunnel.id, False
+
+
+def _desired_config(spec: TunnelSpec, tunnel_id: str, current: dict) -> dict:
+    config = dict(spec.extra)
+    config["tunnel"] = tunnel_id
+    cred_file = current.get("credentials-file") if current.get("tunnel") == tunnel_id else None
+    config["credentials-file"] = cred_file or str(credentials_file(tunnel_id))
+    config["ingress"] = spec.ingress
+    return config
+
+
+def plan_changes(specs: List[TunnelSpec]) -> List[ProfilePlan]:
+    """
+    Diff every desired tunnel against its profile's current config.
+
+    Current state comes from the cached config files and tunnel inventory,
+    so planning an unchanged fleet costs a few stat() calls.
+    """
+    plans = []
+    for spec in specs:
+        try:
+            profile = Profile(spec.profile)
+        except ProfileError as e:
+            raise DesiredStateError(str(e))
+        current = profile.store.load() if profile.exists() else {}
+        current_id = current.get("tunnel")
+        item = ProfilePlan(profile, spec, None)
+        plans.append(item)
+        try:
+            item.tunnel_id, item.create = _resolve_tunnel(spec, current_id)
+        except (DesiredStateError, InventoryError) as e:
+            item.error = str(e)
+            continue
+        if item.tunnel_id and not item.create and not credentials_file(item.tunnel_id).exists() \
+                and not (current_id == item.tunnel_id and current.get("credentials-file")):
+            item.error = (f"credentials for tunnel '{spec.tunnel_name}' are missing; "
+                          f"run 'tunnelflare setup -p {spec.profile}' to recreate it")
+            continue
+
+        same_tunnel = not item.create and item.tunnel_id == current_id
+        old_rules = {_rule_key(r): r for r in (current.get("ingress") or []) if isinstance(r, dict)} if same_tunnel else {}
+        new_rules = {_rule_key(r): r for r in spec.ingress}
+        item.added = [k for k in new_rules if k not in old_rules]
+        item.removed = [k for k in old_rules if k not in new_rules]
+        item.changed = [k for k in new_rules if k in old_rules and old_rules[k] != new_rules[k]]
+
+        # Hostnames already served by this tunnel have their DNS record.
+        routed = {r.get("hostname") for r in old_rules.values()}
+        routed.update(h for h, t in (profile.read_state().get("dns_routes") or {}).items() if t == item.tunnel_id)
+        item.route = sorted({r["hostname"] for r in spec.ingress if r.get("hostname")} - routed)
+
+        if item.tunnel_id:
+            desired = _desired_config(spec, item.tunnel_id, current)
+            if desired != current:
+                item.config = desired
+        else:
+            item.config = {} # Built once the tunnel exists
+    return plans
+
+
+def apply_changes(plans: List[ProfilePlan], restart: Callable[[Profile], bool],
+          workers: int = DEFAULT_WORKERS, retries: int = DEFAULT_RETRIES,
+          overwrite: bool = False) -> List[ProfileResult]:
+    """
+    Carry out `plans`: create missing tunnels, then route every new
+    hostname, in parallel, then write each changed config once and call
+    `restart(profile)` for running tunnels whose config changed. Rules
+    whose hostname failed to route are left out of the written config.
+    """
+    results = [ProfileResult(p, p.tunnel_id, error=p.error) for p in plans]
+    pending = [r for r in results if r.error is None and not r.plan.noop]
+    if not pending:
+        return results
+    inventory = get_inventory()
+
+    def create(result: ProfileResult):
+        try:
+            tunnel = inventory.create(result.plan.spec.tunnel_name)
+        except InventoryError as e:
+            tunnel, result.error = None, str(e)
+        if tunnel is None:
+            result.error = result.error or f"could not create tunnel '{result.plan.spec.tunnel_name}'"
+        else:
+            result.tunnel_id = tunnel.id
+
+    to_create = [r for r in pending if r.plan.create]
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(pending)))) as pool:
+        list(pool.map(create, to_create))
+        pending = [r for r in pending if r.error is None]
+
+        def route(job):
+            result, hostname = job
+            ok, _, error = route_dns(result.tunnel_id, hostname, retries, overwrite)
+            if ok:
+                result.routed.append(hostname)
+            else:
+                result.failed[hostname] = error
+        jobs = [(r, hostname) for r in pending for hostname in r.plan.route]
+        list(pool.map(route, jobs))
+
+    for result in pending:
+        profile, spec = result.plan.profile, result.plan.spec
+        if result.routed:
+            dns_routes = profile.read_state().get("dns_routes") or {}
+            dns_routes.update({hostname: result.tunnel_id for hostname in result.routed})
+            profile.write_state(dns_routes=dns_routes)
+
+        if result.plan.config is None and not result.failed:
+            continue
+        ingress = [r for r in spec.ingress if r.get("hostname") not in result.failed]
+        with profile.store.transaction() as current:
+            config = _desired_config(TunnelSpec(spec.profile, spec.tunnel_name, ingress, spec.extra),
+                                     result.tunnel_id, current)
+            if config != current:
+                current.clear()
+                current.update(config)
+                result.written = True
+
+    to_restart = [r for r in pending if r.written and r.plan.profile.running_pid()]
+    if to_restart:
+        with ThreadPoolExecutor(max_workers=min(8, len(to_restart))) as pool:
+            for result, restarted in zip(to_restart, pool.map(lambda r: restart(r.plan.profile), to_restart)):
+                result.restarted = bool(restarted)
+    return results
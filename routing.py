@@ -0,0 +1,218 @@
+import csv
+import io
+import random
+import subprocess
+import sys
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from config import CATCH_ALL_SERVICE, IngressRule, build_ingress
+from ingress import IngressIndex
+
+DEFAULT_WORKERS = 8
+DEFAULT_RETRIES = 3
+BACKOFF_BASE = 0.5 # Seconds; doubled on every retry, plus jitter
+BACKOFF_MAX = 8.0
+
+# cloudflared errors that retrying won't fix.
+PERMANENT_ERRORS = ("already exists", "not found", "Unauthorized", "invalid")
+
+
+class RouteFileError(Exception):
+    """Raised when a routes file can't be parsed."""
+
+
+@dataclass
+class Route:
+    hostname: str
+    service: str
+    path: Optional[str] = None
+
+
+@dataclass
+class RouteResult:
+    route: Route
+    ok: bool
+    attempts: int
+    error: Optional[str] = None
+
+
+def _route_from(item, where: str) -> Route:
+    if not isinstance(item, dict):
+        raise RouteFileError(f"{where}: expected a mapping with hostname and service")
+    hostname = str(item.get("hostname") or "").strip()
+    service = str(item.get("service") or "").strip()
+    if not hostname or not service:
+        raise RouteFileError(f"{where}: both hostname and service are required")
+    path = item.get("path")
+    return Route(hostname, service, str(path) if path else None)
+
+
+def parse_routes(text: str, fmt: Optional[str] = None) -> List[Route]:
+    """
+    Parse hostname -> service pairs from CSV or YAML text.
+
+    CSV rows are `hostname,service[,path]` with an optional header row.
+    YAML may be a list of {hostname, service, path} mappings, an object with
+    such a list under `routes` or `ingress`, or a plain {hostname: service}
+    mapping. Without an explicit `fmt`, CSV is assumed when the first line
+    has a comma and doesn't look like YAML.
+    """
+    if fmt is None:
+        first = next((line for line in text.splitlines() if line.strip() and not line.startswith("#")), "")
+        looks_yaml = first.lstrip().startswith("-") or first.rstrip().endswith(":") or ": " in first
+        fmt = "csv" if "," in first and not looks_yaml else "yaml"
+
+    routes = []
+    if fmt == "csv":
+        for number, row in enumerate(csv.reader(io.StringIO(text)), 1):
+            row = [cell.strip() for cell in row]
+            if not row or not row[0] or row[0].startswith("#"):
+                continue
+            if number == 1 and row[0].lower() == "hostname":
+                continue # Header
+            if len(row) < 2:
+                raise RouteFileError(f"line {number}: expected hostname,service")
+            routes.append(_route_from({"hostname": row[0], "service": row[1],
+                                       "path": row[2] if len(row) > 2 else None}, f"line {number}"))
+        return routes
+
+    import yaml
+    from config import SafeLoader
+    try:
+        data = yaml.load(text, Loader=SafeLoader)
+    except yaml.YAMLError as e:
+        raise RouteFileError(f"invalid YAML: {e}")
+    if isinstance(data, dict) and isinstance(data.get("routes", data.get("ingress")), list):
+        data = data.get("routes", data.get("ingress"))
+    if isinstance(data, dict):
+        return [_route_from({"hostname": k, "service": v}, str(k)) for k, v in data.items()]
+    if not isinstance(data, list):
+        raise RouteFileError("expected a list of routes or a hostname: service mapping")
+    for number, item in enumerate(data, 1):
+        if isinstance(item, dict) and not item.get("hostname"):
+            continue # e.g. the catch-all rule of a pasted ingress list
+        routes.append(_route_from(item, f"entry {number}"))
+    return routes
+
+
+def load_routes(source: str, stdin=None) -> List[Route]:
+    """Read routes from a file path, or from stdin when `source` is "-"."""
+    if source == "-":
+        return parse_routes((stdin or sys.stdin).read())
+    path = Path(source)
+    fmt = {".csv": "csv", ".yml": "yaml", ".yaml": "yaml"}.get(path.suffix.lower())
+    try:
+        text = path.read_text()
+    except OSError as e:
+        raise RouteFileError(f"cannot read {path}: {e.strerror}")
+    return parse_routes(text, fmt)
+
+
+def route_dns(tunnel_id: str, hostname: str, retries: int = DEFAULT_RETRIES,
+              overwrite: bool = False) -> Tuple[bool, int, Optional[str]]:
+    """
+    Run `cloudflared tunnel route dns` for one hostname.
+
+    Transient failures are retried with exponential backoff and jitter;
+    errors that can't succeed on retry (e.g. a conflicting record) fail
+    immediately. Returns (ok, attempts, error).
+    """
+    cmd = ["cloudflared", "tunnel", "route", "dns"]
+    if overwrite:
+        cmd.append("--overwrite-dns")
+    cmd += [tunnel_id, hostname]
+
+    error = None
+    for attempt in range(1, retries + 2):
+        try:
+            result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        except OSError as e:
+            return False, attempt, str(e)
+        if result.returncode == 0:
+            return True, attempt, None
+        error = (result.stderr or result.stdout).strip().splitlines()
+        error = error[-1] if error else f"exit code {result.returncode}"
+        if any(marker in error for marker in PERMANENT_ERRORS) or attempt > retries:
+            return False, attempt, error
+        delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (attempt - 1))
+        time.sleep(delay * random.uniform(0.5, 1.5))
+    return False, retries + 1, error
+
+
+def route_all(tunnel_id: str, routes: List[Route], workers: int = DEFAULT_WORKERS,
+              retries: int = DEFAULT_RETRIES, overwrite: bool = False,
+              on_done: Optional[Callable[[RouteResult], None]] = None) -> List[RouteResult]:
+    """Route every hostname on a bounded worker pool; results keep input order."""
+    from concurrent.futures import ThreadPoolExecutor
+
+    def run(route: Route) -> RouteResult:
+        ok, attempts, error = route_dns(tunnel_id, route.hostname, retries, overwrite)
+        result = RouteResult(route, ok, attempts, error)
+        if on_done is not None:
+            on_done(result)
+        return result
+
+    # The same hostname only needs one DNS record, whatever its paths.
+    unique: Dict[str, Route] = {}
+    for route in routes:
+        unique.setdefault(route.hostname, route)
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        by_host = {r.route.hostname: r for r in pool.map(run, unique.values())}
+    return [RouteResult(route, by_host[route.hostname].ok, by_host[route.hostname].attempts,
+                        by_host[route.hostname].error) for route in routes]
+
+
+def merge_ingress(config: dict, routes: List[Route]) -> Tuple[int, int]:
+    """
+    Add or update ingress rules for `routes` in place, keeping the
+    catch-all rule last. Returns (added, updated).
+
+    New rules are appended, unless an existing rule (say a wildcard for
+    the same domain) would catch all of their requests first; then they
+    go just in front of it. That includes rules added earlier in the same
+    batch, so `*.example.com` and `app.example.com` can come in any order.
+    """
+    ingress = config.get("ingress")
+    if not isinstance(ingress, list):
+        ingress = config["ingress"] = []
+    catch_all = None
+    if ingress and isinstance(ingress[-1], dict) and not ingress[-1].get("hostname") and not ingress[-1].get("path"):
+        catch_all = ingress.pop()
+
+    index = {(r.get("hostname"), r.get("path")): r for r in ingress if isinstance(r, dict)}
+    existing = IngressIndex(build_ingress(config))
+    batch = IngressIndex([]) # Rules added by this call, in the order they were added
+    added = updated = 0
+    for route in routes:
+        rule = index.get((route.hostname, route.path))
+        if rule is not None:
+            if rule.get("service") != route.service:
+                rule["service"] = route.service
+                updated += 1
+            continue
+        rule = {"hostname": route.hostname}
+        if route.path:
+            rule["path"] = route.path
+        rule["service"] = route.service
+        # Inserts keep the old rules in order, but a batch rule may sit in
+        # front of any of them: look for the first shadow of either kind.
+        shadows = batch.shadows(route.hostname, route.path)
+        shadow = existing.shadowing(route.hostname, route.path)
+        if shadow is not None:
+            shadows.append(shadow)
+        shadow_ids = {id(s.raw) for s in shadows}
+        position = next((i for i, r in enumerate(ingress) if id(r) in shadow_ids), None) if shadows else None
+        if position is None:
+            ingress.append(rule)
+        else:
+            ingress.insert(position, rule)
+        batch.add(IngressRule(f"{route.hostname}{route.path or ''}", len(batch.rules),
+                              route.hostname, route.path, route.service, rule))
+        index[(route.hostname, route.path)] = rule
+        added += 1
+
+    ingress.append(catch_all if catch_all is not None else {"service": CATCH_ALL_SERVICE})
+    return added, updated
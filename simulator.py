@@ -0,0 +1,496 @@
+#!/usr/bin/env python3
+"""
+A stand-in for `cloudflared` that needs no network or Cloudflare account.
+
+It answers the commands TunnelFlare runs (`tunnel login/create/list/
+route dns/delete/run`) against a local state file, so tunnels and DNS
+routes stay consistent across calls, and `tunnel run` logs edge
+connections in cloudflared's console format and serves a fake metrics
+endpoint. A scenario makes it misbehave on purpose: slow commands,
+injected failures, crashes, hangs, reconnect storms and log floods.
+
+    python simulator.py --install-shim ~/bin      # ~/bin/cloudflared runs the simulator
+    TUNNELFLARE_SIM=storm.yml tunnelflare start  # With a scenario
+
+TUNNELFLARE_SIM names a YAML or JSON scenario file (or holds inline
+JSON); see DEFAULT_SCENARIO for the keys. TUNNELFLARE_SIM_STATE moves
+the state file, which defaults to ~/.cloudflared/simulator.json.
+"""
+import fcntl
+import json
+import os
+import random
+import signal
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from logrotate import parse_duration
+
+VERSION = "cloudflared version 2024.1.0 (simulator)"
+CLOUDFLARED_DIR = Path.home() / ".cloudflared"
+CERT_FILE = CLOUDFLARED_DIR / "cert.pem"
+ZERO_TIME = "0001-01-01T00:00:00Z"
+TICK = 0.05 # Seconds between passes of the `tunnel run` loop
+
+DEFAULT_SCENARIO = {
+    "require-login": True, # Account commands fail without cert.pem, like cloudflared
+    # Seconds (or "2s", "1m") each command takes before answering
+    "latency": {"login": 0, "list": 0, "create": 0, "route": 0, "delete": 0},
+    # Per command: an error message to fail with, or {error, rate} to fail
+    # that fraction of calls (e.g. transient API errors for retries)
+    "fail": {},
+    "run": {
+        "mode": "normal", # normal, crash, hang or flap
+        "connections": 4,
+        "connect-delay": 0.2, # Between successive connections registering
+        "crash-after": 5, # crash: exit this long after starting...
+        "exit-code": 1, # ...with this code
+        "flap-interval": 2, # flap: one connection drops and reconnects this often
+        "reconnect-delay": 1, # flap: how long a dropped connection stays down
+        "ignore-sigterm": False, # Needs SIGKILL to stop, like a wedged cloudflared
+        "drain": 0, # Seconds spent draining on SIGTERM, capped by --grace-period
+        "log-rate": 0, # Extra log lines per second
+        "log-mix": {"INF": 0.8, "WRN": 0.15, "ERR": 0.05},
+        "request-rate": 10, # Simulated requests per second, for the metrics counters
+        "error-ratio": 0.01, # Fraction of those that fail
+    },
+}
+
+
+class SimulatorError(Exception):
+    """A command failure, reported on stderr with exit code 1."""
+
+
+def _merge(base: dict, override: dict) -> dict:
+    merged = dict(base)
+    for key, value in override.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = _merge(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+
+def load_scenario(source: Optional[str] = None) -> dict:
+    """The default scenario overlaid with TUNNELFLARE_SIM (a file path or inline JSON)."""
+    source = os.environ.get("TUNNELFLARE_SIM", "") if source is None else source
+    if not source.strip():
+        return DEFAULT_SCENARIO
+    if source.lstrip().startswith("{"):
+        override = json.loads(source)
+    else:
+        text = Path(source).read_text()
+        if source.endswith(".json"):
+            override = json.loads(text)
+        else:
+            from config import _yaml
+            yaml, Loader, _ = _yaml()
+            override = yaml.load(text, Loader=Loader) or {}
+    if not isinstance(override, dict):
+        raise SimulatorError(f"scenario {source} is not a mapping")
+    return _merge(DEFAULT_SCENARIO, override)
+
+
+def state_file() -> Path:
+    return Path(os.environ.get("TUNNELFLARE_SIM_STATE") or CLOUDFLARED_DIR / "simulator.json")
+
+
+@contextmanager
+def account(write: bool = False):
+    """
+    The simulated account: {"tunnels": [...], "routes": {hostname: id},
+    "runs": {id: [pid, connections]}}. Calls are serialized with a lock
+    file, since TunnelFlare routes hostnames in parallel.
+    """
+    path = state_file()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path.with_suffix(".lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX if write else fcntl.LOCK_SH)
+        try:
+            state = json.loads(path.read_text())
+        except (OSError, ValueError):
+            state = {}
+        state.setdefault("tunnels", [])
+        state.setdefault("routes", {})
+        state.setdefault("runs", {})
+        yield state
+        if write:
+            tmp = path.with_suffix(".tmp")
+            tmp.write_text(json.dumps(state, indent=2))
+            os.replace(tmp, path)
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _find(state: dict, ref: str) -> Optional[dict]:
+    for tunnel in state["tunnels"]:
+        if tunnel["deleted_at"] == ZERO_TIME and ref in (tunnel["id"], tunnel["name"]):
+            return tunnel
+    return None
+
+
+def _now() -> str:
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+
+
+def _connections(state: dict, tunnel_id: str) -> List[dict]:
+    pid, count = state["runs"].get(tunnel_id, (0, 0))
+    if not pid or not _alive(pid):
+        return []
+    return [{"colo_name": f"sim0{i}", "id": str(uuid.UUID(int=pid * 16 + i)),
+             "is_pending_reconnect": False, "origin_ip": "127.0.0.1"} for i in range(count)]
+
+
+def simulate_command(scenario: dict, command: str):
+    """Apply the scenario's latency and injected failure for one command."""
+    delay = parse_duration(scenario["latency"].get(command, 0), f"{command} latency")
+    if delay:
+        time.sleep(delay)
+    failure = scenario["fail"].get(command)
+    if isinstance(failure, dict):
+        if random.random() < float(failure.get("rate", 1)):
+            raise SimulatorError(str(failure.get("error", f"{command} failed (simulated)")))
+    elif failure:
+        raise SimulatorError(str(failure))
+    if scenario["require-login"] and command != "login" and not CERT_FILE.exists():
+        raise SimulatorError(f"Cannot determine default origin certificate path. No file cert.pem in "
+                             f"[{CLOUDFLARED_DIR}]. You need to specify the origin certificate path "
+                             f"by specifying the origincert option in the configuration file, or set "
+                             f"TUNNEL_ORIGIN_CERT environment variable")
+
+
+def cmd_login(scenario: dict, args: List[str]):
+    simulate_command(scenario, "login")
+    CERT_FILE.parent.mkdir(parents=True, exist_ok=True)
+    CERT_FILE.write_text("-----BEGIN ARGO TUNNEL TOKEN-----\nsimulator\n-----END ARGO TUNNEL TOKEN-----\n")
+    print(f"You have successfully logged in.\nIf you wish to copy your credentials to a server, "
+          f"they have been saved to:\n{CERT_FILE}")
+
+
+def cmd_list(scenario: dict, args: List[str]):
+    simulate_command(scenario, "list")
+    with account() as state:
+        records = [dict(t, connections=_connections(state, t["id"]))
+                   for t in state["tunnels"] if t["deleted_at"] == ZERO_TIME]
+    if "json" in args:
+        print(json.dumps(records))
+        return
+    print("ID                                   NAME CREATED CONNECTIONS")
+    for record in records:
+        print(record["id"], record["name"], record["created_at"], len(record["connections"]))
+
+
+def cmd_create(scenario: dict, args: List[str]):
+    if not args:
+        raise SimulatorError('"cloudflared tunnel create" requires exactly 1 argument, the name of tunnel to create.')
+    name = args[-1]
+    simulate_command(scenario, "create")
+    with account(write=True) as state:
+        if _find(state, name):
+            raise SimulatorError("failed to create tunnel: Create Tunnel API call failed: "
+                                 "tunnel with name already exists")
+        tunnel = {"id": str(uuid.uuid4()), "name": name, "created_at": _now(), "deleted_at": ZERO_TIME}
+        state["tunnels"].append(tunnel)
+    credentials = CLOUDFLARED_DIR / f"{tunnel['id']}.json"
+    credentials.write_text(json.dumps({"AccountTag": "simulator", "TunnelSecret": uuid.uuid4().hex,
+                                       "TunnelID": tunnel["id"]}))
+    print(f"Tunnel credentials written to {credentials}. cloudflared chose this file based on where "
+          f"your origin certificate was found. Keep this file secret.")
+    print(f"\nCreated tunnel {name} with id {tunnel['id']}")
+
+
+def cmd_route(scenario: dict, args: List[str]):
+    overwrite = "--overwrite-dns" in args or "-f" in args
+    positional = [a for a in args if not a.startswith("-")]
+    if len(positional) != 3 or positional[0] != "dns":
+        raise SimulatorError("usage: cloudflared tunnel route dns [--overwrite-dns] TUNNEL HOSTNAME")
+    _, ref, hostname = positional
+    simulate_command(scenario, "route")
+    with account(write=True) as state:
+        tunnel = _find(state, ref)
+        if tunnel is None:
+            raise SimulatorError(f"{ref} is neither the ID nor the name of any of your tunnels: not found")
+        current = state["routes"].get(hostname)
+        if current and current != tunnel["id"] and not overwrite:
+            raise SimulatorError(f"Failed to add route: code: 1003, reason: Failed to create record "
+                                 f"{hostname} with err An A, AAAA, or CNAME record with that host already exists.")
+        state["routes"][hostname] = tunnel["id"]
+    print(f"{_now()} INF Added CNAME {hostname} which will route to this tunnel tunnelID={tunnel['id']}")
+
+
+def cmd_delete(scenario: dict, args: List[str]):
+    force = "-f" in args or "--force" in args
+    names = [a for a in args if not a.startswith("-")]
+    if not names:
+        raise SimulatorError('"cloudflared tunnel delete" requires at least 1 argument, the ID or name of the tunnel to delete.')
+    simulate_command(scenario, "delete")
+    with account(write=True) as state:
+        for ref in names:
+            tunnel = _find(state, ref)
+            if tunnel is None:
+                raise SimulatorError(f"{ref} is neither the ID nor the name of any of your tunnels: not found")
+            if _connections(state, tunnel["id"]) and not force:
+                raise SimulatorError(f"Tunnel {tunnel['id']} has active connections")
+            tunnel["deleted_at"] = _now()
+            state["routes"] = {h: i for h, i in state["routes"].items() if i != tunnel["id"]}
+            state["runs"].pop(tunnel["id"], None)
+            (CLOUDFLARED_DIR / f"{tunnel['id']}.json").unlink(missing_ok=True)
+
+
+class Run:
+    """One `tunnel run`: connections, log output and metrics, driven by a tick loop."""
+
+    def __init__(self, scenario: dict, tunnel_id: str, grace_period: float):
+        self.settings = scenario["run"]
+        self.tunnel_id = tunnel_id
+        self.grace_period = grace_period
+        self.started = time.monotonic()
+        self.connected: Dict[int, bool] = {}
+        self.down_until: Dict[int, float] = {}
+        self.requests = 0.0
+        self.errors = 0.0
+        self.lines = 0
+        self.stopping = False
+        self.out = sys.stdout
+
+    def log(self, level: str, message: str):
+        self.out.write(f"{_now()} {level} {message}\n")
+
+    def _publish(self):
+        # `tunnel list` shows this run's connections while it is up.
+        try:
+            with account(write=True) as state:
+                state["runs"][self.tunnel_id] = [os.getpid(), sum(self.connected.values())]
+        except OSError:
+            pass
+
+    def register(self, index: int):
+        self.connected[index] = True
+        self.log("INF", f"Registered tunnel connection connIndex={index} connection={uuid.uuid4()} "
+                        f"event=0 ip=198.41.200.{10 + index} location=sim0{index} protocol=quic")
+
+    def drop(self, index: int, now: float):
+        self.connected[index] = False
+        self.down_until[index] = now + float(parse_duration(self.settings["reconnect-delay"]))
+        self.log("WRN", f'Serve tunnel error error="timeout: no recent network activity" '
+                        f"connIndex={index} event=0 ip=198.41.200.{10 + index}")
+        self.log("INF", f"Retrying connection in up to 1s connIndex={index} event=0 ip=198.41.200.{10 + index}")
+
+    def noise(self, count: int):
+        mix = self.settings["log-mix"]
+        levels = random.choices(list(mix), weights=list(mix.values()), k=count)
+        for level in levels:
+            self.lines += 1
+            index = self.lines % max(1, len(self.connected) or 1)
+            if level == "ERR":
+                self.log(level, f'Request failed error="dial tcp 127.0.0.1:8000: connect: connection refused" '
+                                f"connIndex={index} dest=https://app.example.com/{self.lines} type=http")
+            elif level == "WRN":
+                self.log(level, f'Failed to refresh DNS local resolver error="lookup region1.v2.argotunnel.com: '
+                                f'i/o timeout" connIndex={index}')
+            else:
+                self.log(level, f'"GET https://app.example.com/items/{self.lines} HTTP/1.1" 200 '
+                                f"connIndex={index} originService=http://127.0.0.1:8000")
+
+    def metrics(self) -> bytes:
+        up = sum(self.connected.values())
+        lines = [
+            f"cloudflared_tunnel_ha_connections {up}",
+            f"cloudflared_tunnel_total_requests {int(self.requests)}",
+            f"cloudflared_tunnel_request_errors {int(self.errors)}",
+            f"cloudflared_tunnel_concurrent_requests_per_tunnel {random.randint(0, 3) if up else 0}",
+            f'cloudflared_tunnel_response_by_code{{status_code="200"}} {int(self.requests - self.errors)}',
+            f'cloudflared_tunnel_response_by_code{{status_code="502"}} {int(self.errors)}',
+        ]
+        for index, on in self.connected.items():
+            if on:
+                lines.append(f'quic_client_smoothed_rtt{{conn_index="{index}"}} {20 + 5 * index + random.random() * 4:.3f}')
+        return ("\n".join(lines) + "\n").encode()
+
+    def serve_metrics(self, address: str):
+        host, _, port = address.rpartition(":")
+        run = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.split("?", 1)[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = run.metrics()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        server = ThreadingHTTPServer((host or "127.0.0.1", int(port)), Handler)
+        threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+        self.log("INF", f"Starting metrics server on {host}:{port}/metrics")
+
+    def stop(self, signum, frame):
+        if self.settings["ignore-sigterm"] and signum == signal.SIGTERM:
+            self.log("INF", "Ignoring SIGTERM (simulated)")
+            return
+        self.stopping = True
+
+    def loop(self) -> int:
+        s = self.settings
+        mode = s["mode"]
+        if mode not in ("normal", "crash", "hang", "flap"):
+            raise SimulatorError(f"unknown run mode {mode!r}")
+        count = int(s["connections"])
+        connect_delay = parse_duration(s["connect-delay"], "connect-delay")
+        flap_interval = parse_duration(s["flap-interval"], "flap-interval")
+        crash_after = parse_duration(s["crash-after"], "crash-after")
+        log_rate = float(s["log-rate"])
+        request_rate = float(s["request-rate"])
+        error_ratio = float(s["error-ratio"])
+        last = self.started
+        next_flap = self.started + flap_interval
+        published = -1
+
+        while True:
+            now = time.monotonic()
+            elapsed = now - self.started
+            if self.stopping:
+                return self.shutdown()
+            if mode == "crash" and elapsed >= crash_after:
+                self.log("ERR", 'Serve tunnel error error="simulated crash" connIndex=0')
+                self.out.flush()
+                return int(s["exit-code"])
+            if mode != "hang":
+                # Connections come up one after another, like cloudflared's HA connections.
+                while len(self.connected) < count and elapsed >= connect_delay * (len(self.connected) + 1):
+                    self.register(len(self.connected))
+                for index, until in list(self.down_until.items()):
+                    if now >= until:
+                        del self.down_until[index]
+                        self.register(index)
+                if mode == "flap" and now >= next_flap and self.connected:
+                    up = [i for i, on in self.connected.items() if on]
+                    if up:
+                        self.drop(random.choice(up), now)
+                    next_flap = now + flap_interval
+            if log_rate:
+                due = int(elapsed * log_rate) - self.lines
+                if due > 0:
+                    self.noise(due)
+            up = sum(self.connected.values())
+            if up:
+                self.requests += request_rate * (now - last)
+                self.errors += request_rate * error_ratio * (now - last)
+            last = now
+            if up != published:
+                self._publish()
+                published = up
+            self.out.flush()
+            time.sleep(TICK)
+
+    def shutdown(self) -> int:
+        self.log("INF", "Initiating graceful shutdown due to signal terminated ...")
+        self.out.flush()
+        time.sleep(min(parse_duration(self.settings["drain"], "drain"), self.grace_period))
+        for index, on in self.connected.items():
+            if on:
+                self.log("INF", f"Unregistered tunnel connection connIndex={index} event=0 ip=198.41.200.{10 + index}")
+        self.log("INF", "Tunnel server stopped")
+        self.out.flush()
+        with account(write=True) as state:
+            state["runs"].pop(self.tunnel_id, None)
+        return 0
+
+
+def cmd_run(scenario: dict, options: Dict[str, str], args: List[str]):
+    tunnel_id = args[-1] if args else ""
+    credentials = options.get("--cred-file")
+    if credentials and not Path(credentials).exists():
+        raise SimulatorError(f"Tunnel credentials file '{credentials}' doesn't exist or is not a file")
+    if not tunnel_id and credentials:
+        try:
+            tunnel_id = json.loads(Path(credentials).read_text()).get("TunnelID", "")
+        except (OSError, ValueError, AttributeError):
+            pass
+    if not tunnel_id:
+        raise SimulatorError('"cloudflared tunnel run" requires the ID or name of the tunnel to run')
+    run = Run(scenario, tunnel_id, parse_duration(options.get("--grace-period", "30s"), "grace period"))
+    signal.signal(signal.SIGTERM, run.stop)
+    signal.signal(signal.SIGINT, run.stop)
+    run.log("INF", f"Starting tunnel tunnelID={tunnel_id}")
+    run.log("INF", f"Version {VERSION.split()[2]}")
+    if "--metrics" in options:
+        run.serve_metrics(options["--metrics"])
+    return run.loop()
+
+
+# `tunnel` flags that take a value; they may come before the subcommand.
+_VALUE_FLAGS = ("--config", "--cred-file", "--credentials-file", "--metrics", "--grace-period",
+                "--loglevel", "--origincert", "--output", "-o")
+
+
+def main(argv: List[str]) -> int:
+    if argv[:1] == ["--install-shim"] and len(argv) == 2:
+        return install_shim(Path(argv[1]))
+    if argv[:1] in (["version"], ["--version"], ["-v"]):
+        print(VERSION)
+        return 0
+    if argv[:1] != ["tunnel"]:
+        print(f"simulator: unsupported command {' '.join(argv)!r}", file=sys.stderr)
+        return 1
+
+    options: Dict[str, str] = {}
+    rest: List[str] = []
+    args = iter(argv[1:])
+    for arg in args:
+        flag, eq, value = arg.partition("=")
+        if flag in _VALUE_FLAGS:
+            options[flag] = value if eq else next(args, "")
+            if flag in ("--output", "-o"):
+                rest.append(options[flag]) # `list --output json`
+        else:
+            rest.append(arg)
+    if "--credentials-file" in options:
+        options.setdefault("--cred-file", options["--credentials-file"])
+    commands = {"login": cmd_login, "list": cmd_list, "create": cmd_create, "route": cmd_route,
+                "delete": cmd_delete}
+    try:
+        scenario = load_scenario()
+        if rest[:1] == ["run"]:
+            return cmd_run(scenario, options, rest[1:])
+        if not rest or rest[0] not in commands:
+            raise SimulatorError(f"unsupported tunnel command {' '.join(rest)!r}")
+        commands[rest[0]](scenario, rest[1:])
+    except (SimulatorError, ValueError, OSError) as e:
+        print(f"{_now()} ERR {e}" if rest[:1] == ["run"] else str(e), file=sys.stderr, flush=True)
+        return 1
+    return 0
+
+
+def install_shim(directory: Path) -> int:
+    """Write an executable `cloudflared` into `directory` that runs this simulator."""
+    directory.mkdir(parents=True, exist_ok=True)
+    shim = directory / "cloudflared"
+    shim.write_text(f"#!/bin/sh\nexec {sys.executable} {Path(__file__).resolve()} \"$@\"\n")
+    shim.chmod(0o755)
+    print(f"Installed {shim}; put {directory} first on PATH to use it")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
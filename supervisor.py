@@ -0,0 +1,446 @@
+import os
+import selectors
+import signal
+import subprocess
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Optional
+
+from control import ControlServer
+from history import HistoryStore
+from logparse import LogMonitor
+from logrotate import LogSettings, RotatingLogWriter, parse_duration
+from profiles import STOP_TIMEOUT, Profile, process_resources, process_start_time
+
+DEFAULT_HANG_TIMEOUT = 120.0
+DEFAULT_MAX_RESTARTS = 5
+DEFAULT_RESTART_WINDOW = 300.0
+DEFAULT_MAX_BACKOFF = 60.0
+INITIAL_BACKOFF = 1.0
+STABLE_AFTER = 60.0 # A run lasting this long resets the backoff
+POLL_INTERVAL = 1.0 # Exit checks without a pidfd, control socket checks
+PROBE_INTERVAL = 15.0 # Origin health checks, for `status --json`
+READ_SIZE = 64 * 1024
+
+# Values of the "supervisor_status" state field.
+RUNNING = "running"
+BACKOFF = "backoff"
+CRASH_LOOP = "crash-loop"
+
+
+@dataclass
+class SupervisorPolicy:
+    hang_timeout: float = DEFAULT_HANG_TIMEOUT # Recycle after this long with no edge connection (0: never)
+    max_restarts: int = DEFAULT_MAX_RESTARTS # Give up after this many failures...
+    restart_window: float = DEFAULT_RESTART_WINDOW # ...within this many seconds
+    max_backoff: float = DEFAULT_MAX_BACKOFF
+
+    @classmethod
+    def from_config(cls, config: Optional[dict]) -> "SupervisorPolicy":
+        """
+        Read the optional `supervisor` block of a tunnel config:
+
+            supervisor:
+              hang-timeout: 2m
+              max-restarts: 5
+              restart-window: 5m
+              max-backoff: 60s
+        """
+        block = (config or {}).get("supervisor") if isinstance(config, dict) else None
+        if not isinstance(block, dict):
+            return cls()
+        return cls(
+            hang_timeout=parse_duration(block.get("hang-timeout", DEFAULT_HANG_TIMEOUT), "hang-timeout"),
+            max_restarts=int(block.get("max-restarts", DEFAULT_MAX_RESTARTS)),
+            restart_window=parse_duration(block.get("restart-window", DEFAULT_RESTART_WINDOW), "restart-window"),
+            max_backoff=parse_duration(block.get("max-backoff", DEFAULT_MAX_BACKOFF), "max-backoff"),
+        )
+
+
+class Supervisor:
+    """
+    Keeps one profile's cloudflared running.
+
+    The supervisor is cloudflared's parent: it sleeps in select() on the
+    child's output pipe and a pidfd, so it wakes the moment the process
+    exits instead of polling for it. Output goes to the rotating log and
+    through a LogMonitor, which tracks registered edge connections; a live
+    process with none for `hang_timeout` seconds is treated as hung and
+    recycled.
+
+    An exit is only a failure while the profile's PID file still names
+    the child. `stop`, the dashboard and blue/green restarts release or
+    replace the PID before signalling, and the supervisor then exits
+    with its child. Failures are restarted after an exponential backoff;
+    `max_restarts` of them within `restart_window` seconds is a crash
+    loop, and the supervisor gives up.
+
+    With `open_control()` it also answers status queries on the profile's
+    control socket (see control.py) from what it already tracks, plus
+    origin health checks run in a background thread.
+    """
+
+    def __init__(self, profile: Profile, tunnel_id: str, cred_path: Path,
+                 grace_period: Optional[float] = None,
+                 policy: Optional[SupervisorPolicy] = None,
+                 writer: Optional[RotatingLogWriter] = None):
+        self.profile = profile
+        self.tunnel_id = tunnel_id
+        self.cred_path = cred_path
+        self.grace_period = grace_period
+        self.policy = policy or SupervisorPolicy()
+        self.writer = writer or RotatingLogWriter(profile.log_file, LogSettings())
+        self.child: Optional[subprocess.Popen] = None
+        self.monitor = LogMonitor()
+        self.status = RUNNING
+        self.started_at: Optional[float] = None
+        self.last_exit: Optional[str] = None
+        self.restarts = 0
+        self.server: Optional[ControlServer] = None
+        self.probe_results = {} # rule id -> ProbeResult
+        self._probe_stop = threading.Event()
+        self._probe_thread: Optional[threading.Thread] = None
+        self._last_cpu = None # (pid, monotonic time, cpu seconds) for cpu_percent
+        self._failures = deque()
+        self._backoff = INITIAL_BACKOFF
+        self._stop_signal: Optional[int] = None
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        os.set_blocking(self._wakeup_w, False)
+
+    # Signals only set a flag; the wakeup pipe interrupts select().
+    def _on_signal(self, signum, frame):
+        self._stop_signal = signum
+
+    def install_signal_handlers(self):
+        signal.set_wakeup_fd(self._wakeup_w)
+        signal.signal(signal.SIGTERM, self._on_signal)
+        signal.signal(signal.SIGINT, self._on_signal)
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+
+    def log(self, level: str, message: str):
+        """Write a line to the tunnel log in cloudflared's console format."""
+        stamp = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+        self.log_bytes(f"{stamp} {level} supervisor: {message}\n".encode())
+
+    def log_bytes(self, data: bytes):
+        try:
+            self.writer.write(data)
+        except OSError:
+            pass # Disk full or similar: keep draining so cloudflared never blocks
+
+    def owns_profile(self) -> bool:
+        """True while the PID file names our child (or us, between restarts)."""
+        pid = self.profile.read_pid()
+        return pid is not None and pid in (os.getpid(), self.child.pid if self.child else None)
+
+    def start_child(self) -> int:
+        self.child = self.profile.launch(self.tunnel_id, self.cred_path, self.grace_period)
+        self.started_at = time.time()
+        self.status = RUNNING
+        self.monitor.connections.clear()
+        self.profile.write_state(supervisor=os.getpid(), supervisor_start=process_start_time(os.getpid()),
+                                 supervisor_status=RUNNING, restarts=self.restarts)
+        return self.child.pid
+
+    def open_control(self):
+        """Serve the control socket and start checking origins."""
+        self.server = ControlServer(self.profile.socket_file, self.handle_command)
+        self._probe_thread = threading.Thread(target=self._probe_loop, name="origin-probes", daemon=True)
+        self._probe_thread.start()
+
+    def _probe_loop(self):
+        from probe import ProbeEngine, build_specs
+
+        engine = ProbeEngine()
+        history = self._open_history()
+        try:
+            interval = 0.0
+            while not self._probe_stop.wait(interval):
+                interval = PROBE_INTERVAL
+                try:
+                    self.probe_results = engine.run(build_specs(self.profile.store.ingress()))
+                except Exception:
+                    self.probe_results = {}
+                if history is not None:
+                    try:
+                        history.record(self.history_sample())
+                    except Exception as e:
+                        self.log("WRN", f"could not record history: {e}")
+        finally:
+            engine.close()
+            if history is not None:
+                history.close()
+
+    def _open_history(self) -> Optional[HistoryStore]:
+        try:
+            return HistoryStore(self.profile.history_file)
+        except Exception as e:
+            self.log("WRN", f"health history disabled: {e}")
+            return None
+
+    def history_sample(self) -> dict:
+        """One round of series for the health history (see history.py)."""
+        running = self.status == RUNNING and self.child is not None and self.child.poll() is None
+        sample = {
+            "up": float(running),
+            "connections": float(len(self.monitor.connections)),
+            "errors_per_minute": float(self.monitor.error_count(1)),
+        }
+        resources = process_resources(self.child.pid) if running else None
+        if resources:
+            now = time.monotonic()
+            cpu = resources["cpu_seconds_total"]
+            last = self._last_cpu
+            if last is not None and last[0] == self.child.pid and now > last[1]:
+                sample["cpu_percent"] = max(0.0, (cpu - last[2]) / (now - last[1]) * 100)
+            self._last_cpu = (self.child.pid, now, cpu)
+            sample["rss_bytes"] = resources["resident_memory_bytes"]
+        for result in self.probe_results.values():
+            sample[f"origin_up:{result.rule_id}"] = float(result.ok)
+            if result.ok and result.latency is not None:
+                sample[f"latency_ms:{result.rule_id}"] = result.latency * 1000
+        return sample
+
+    def handle_command(self, command: str) -> dict:
+        if command == "status":
+            return self.status_report()
+        return {"error": f"unknown command: {command}"}
+
+    def status_report(self) -> dict:
+        """Everything `tunnelflare status --json` shows, from memory."""
+        running = self.status == RUNNING and self.child is not None and self.child.poll() is None
+        monitor = self.monitor
+        last_error = monitor.last_error
+        state = self.profile.read_state()
+        return {
+            "profile": self.profile.name,
+            "state": RUNNING if running else self.status,
+            "pid": self.child.pid if running else None,
+            "supervisor_pid": os.getpid(),
+            "tunnel_id": self.tunnel_id,
+            "started_at": self.started_at if running else None,
+            "uptime": round(time.time() - self.started_at, 3) if running else None,
+            "restarts": self.restarts,
+            "last_exit": self.last_exit,
+            "connections": len(monitor.connections),
+            "locations": sorted({loc for loc in monitor.connections.values() if loc}),
+            "last_error": {"message": last_error.message, "time": last_error.timestamp} if last_error else None,
+            "errors_last_minute": monitor.error_count(1),
+            "metrics": state.get("metrics") if running else None,
+            "ingress": [
+                {"rule": r.rule_id, "url": r.url, "ok": r.ok, "status": r.status,
+                 "latency_ms": round(r.latency * 1000, 1) if r.latency is not None else None,
+                 "error": r.error, "checked_at": r.checked_at}
+                for r in self.probe_results.values()
+            ],
+        }
+
+    def _check_control(self, timeout: Optional[float]) -> Optional[float]:
+        """
+        Housekeeping for the control socket before each select(): drop
+        stalled clients, take the socket back if a rolled-back replica left
+        it gone. Returns `timeout` shortened to the next client deadline.
+        """
+        if self.server is None:
+            return timeout
+        self.server.expire()
+        if self.server.stale():
+            self.server.reclaim()
+        deadline = self.server.next_deadline()
+        if deadline is not None:
+            wait = max(0.0, deadline - time.monotonic())
+            timeout = wait if timeout is None else min(timeout, wait)
+        return timeout
+
+    def _pump(self, fd: int, partial: bytearray) -> bool:
+        """Move available output to the log; False at EOF."""
+        try:
+            data = os.read(fd, READ_SIZE)
+        except InterruptedError:
+            return True
+        if not data:
+            return False
+        self.log_bytes(data)
+        partial.extend(data)
+        end = partial.rfind(b"\n")
+        if end != -1:
+            self.monitor.feed(partial[:end].decode("utf-8", errors="replace").split("\n"))
+            del partial[:end + 1]
+        return True
+
+    def watch(self) -> str:
+        """
+        Pump the child's output until it exits. Returns "exited", "hung"
+        (we killed it for having no edge connections) or "stopped" (we
+        were signalled and passed the signal on).
+        """
+        child = self.child
+        fd = child.stdout.fileno()
+        monitor = self.monitor
+        partial = bytearray()
+        try:
+            pidfd = os.pidfd_open(child.pid)
+        except (AttributeError, OSError):
+            pidfd = None
+
+        selector = selectors.DefaultSelector()
+        selector.register(fd, selectors.EVENT_READ, "output")
+        selector.register(self._wakeup_r, selectors.EVENT_READ, "signal")
+        if pidfd is not None:
+            selector.register(pidfd, selectors.EVENT_READ, "exit")
+        if self.server is not None:
+            self.server.attach(selector)
+
+        outcome = "exited"
+        connected_at = time.monotonic() # Last moment with at least one edge connection
+        kill_at = None
+        open_output = True
+        try:
+            while child.poll() is None:
+                now = time.monotonic()
+                if self._stop_signal is not None and outcome != "stopped":
+                    outcome = "stopped"
+                    child.send_signal(self._stop_signal)
+                if monitor.connections:
+                    connected_at = now
+                elif (self.policy.hang_timeout and kill_at is None and outcome == "exited"
+                        and now - connected_at > self.policy.hang_timeout):
+                    outcome = "hung"
+                    self.log("WRN", f"no edge connection for {self.policy.hang_timeout:.0f}s; "
+                                    f"recycling cloudflared (PID {child.pid})")
+                    child.terminate()
+                    kill_at = now + STOP_TIMEOUT
+                if kill_at is not None and now >= kill_at:
+                    child.kill()
+                    kill_at = float("inf")
+
+                if kill_at is not None:
+                    timeout = max(0.0, min(kill_at, now + POLL_INTERVAL) - now)
+                elif self.policy.hang_timeout and not monitor.connections:
+                    timeout = max(0.0, connected_at + self.policy.hang_timeout - now) + 0.01
+                else:
+                    timeout = None
+                if pidfd is None or self.server is not None:
+                    timeout = POLL_INTERVAL if timeout is None else min(timeout, POLL_INTERVAL)
+
+                timeout = self._check_control(timeout)
+                for key, _ in selector.select(timeout):
+                    if key.data == "output" and not self._pump(fd, partial):
+                        selector.unregister(fd)
+                        open_output = False
+                    elif key.data == "signal":
+                        try:
+                            os.read(self._wakeup_r, 64)
+                        except BlockingIOError:
+                            pass
+                    elif key.data == "exit":
+                        child.wait()
+                    elif key.data is self.server:
+                        self.server.handle(key)
+            # Collect whatever the child wrote before exiting.
+            while open_output and self._pump(fd, partial):
+                pass
+        finally:
+            if self.server is not None:
+                self.server.detach()
+            selector.close()
+            if pidfd is not None:
+                os.close(pidfd)
+            child.stdout.close()
+        if partial:
+            self.log_bytes(b"\n") # Terminate a final unfinished line
+        return outcome
+
+    def _record_failure(self, now: float) -> bool:
+        """Count a failure; True if it makes a crash loop."""
+        self._failures.append(now)
+        while self._failures and now - self._failures[0] > self.policy.restart_window:
+            self._failures.popleft()
+        return len(self._failures) >= self.policy.max_restarts
+
+    def _sleep(self, seconds: float):
+        """Wait out a backoff, returning early if we are signalled."""
+        deadline = time.monotonic() + seconds
+        selector = selectors.DefaultSelector()
+        selector.register(self._wakeup_r, selectors.EVENT_READ, "signal")
+        if self.server is not None:
+            self.server.attach(selector)
+        try:
+            while self._stop_signal is None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return
+                for key, _ in selector.select(self._check_control(min(remaining, POLL_INTERVAL))):
+                    if key.data is self.server:
+                        self.server.handle(key)
+                        continue
+                    try:
+                        os.read(self._wakeup_r, 64)
+                    except BlockingIOError:
+                        pass
+        finally:
+            if self.server is not None:
+                self.server.detach()
+            selector.close()
+
+    def run(self) -> int:
+        """Supervise until stopped, replaced or crash-looping; returns an exit code."""
+        try:
+            while True:
+                started = time.monotonic()
+                outcome = self.watch()
+                code = self.child.returncode
+                if not self.owns_profile():
+                    return 0 # Stopped or replaced on purpose
+                if outcome == "stopped":
+                    self.profile.release()
+                    return 0
+
+                now = time.monotonic()
+                if now - started >= STABLE_AFTER and outcome == "exited":
+                    self._backoff = INITIAL_BACKOFF
+                    self._failures.clear()
+                if outcome == "hung":
+                    reason = "hung"
+                elif code < 0:
+                    reason = f"was killed by {signal.Signals(-code).name}"
+                else:
+                    reason = f"exited with status {code}"
+                if self._record_failure(now):
+                    self.log("ERR", f"cloudflared {reason}; {len(self._failures)} failures in "
+                                    f"{self.policy.restart_window:.0f}s, giving up (crash loop)")
+                    self.profile.release()
+                    self.profile.write_state(supervisor_status=CRASH_LOOP, last_exit=reason)
+                    return 1
+
+                delay = self._backoff
+                self._backoff = min(self._backoff * 2, self.policy.max_backoff)
+                self.log("WRN", f"cloudflared {reason}; restarting in {delay:.0f}s")
+                # Between runs the PID file names us, so `stop` still finds something to signal.
+                self.profile.adopt(os.getpid())
+                self.status, self.last_exit = BACKOFF, reason
+                self.profile.write_state(supervisor_status=BACKOFF, last_exit=reason)
+                self._sleep(delay)
+                if self._stop_signal is not None or not self.owns_profile():
+                    if self.owns_profile():
+                        self.profile.release()
+                    return 0
+                self.restarts += 1
+                try:
+                    pid = self.start_child()
+                except OSError as e:
+                    self.log("ERR", f"could not start cloudflared: {e}")
+                    self.profile.release()
+                    return 1
+                self.log("INF", f"restarted cloudflared (PID {pid}), restart {self.restarts}")
+        finally:
+            if self.server is not None:
+                self.server.close()
+            self._probe_stop.set()
+            if self.profile.read_state().get("supervisor") == os.getpid():
+                self.profile.write_state(supervisor=None)
+            self.writer.close()
@@ -0,0 +1,65 @@
+import subprocess
+from pathlib import Path
+
+import pytest
+
+import bluegreen
+from profiles import Profile, process_start_time
+
+
+def profile_at(path):
+    profile = Profile("test")
+    profile.dir = path
+    profile.pid_file = path / "tunnel.pid"
+    profile.log_file = path / "tunnel.log"
+    profile.state_file = path / "state.json"
+    profile.restart_lock_file = path / "restart.lock"
+    return profile
+
+
+@pytest.fixture
+def processes():
+    started = []
+
+    def start():
+        process = subprocess.Popen(["sleep", "30"])
+        started.append(process)
+        return process
+
+    yield start
+    for process in started:
+        process.kill()
+        process.wait()
+
+
+def test_rollback_restores_the_old_replicas_state(tmp_path, processes, monkeypatch):
+    profile = profile_at(tmp_path)
+    old = processes()
+    profile.adopt(old.pid)
+    profile.write_state(metrics="127.0.0.1:1111", supervisor=old.pid, supervisor_start=process_start_time(old.pid),
+                        supervisor_status="running", tunnel_id="abc")
+    profile.log_file.write_text("old log\n")
+    before = profile.read_state()
+
+    def spawn(tunnel_id, cred_path, grace_period=None):
+        # What the new replica's supervisor records about itself
+        new = processes()
+        profile.pid_file.write_text(str(new.pid))
+        profile.write_state(pid=new.pid, pid_start=process_start_time(new.pid), metrics="127.0.0.1:2222",
+                            supervisor=new.pid, supervisor_start=process_start_time(new.pid), restarts=0)
+        profile.log_file.write_text("new log\n")
+        return new.pid
+
+    monkeypatch.setattr(profile, "spawn", spawn)
+    monkeypatch.setattr(bluegreen, "_wait_ready", lambda *args: (False, 0, "never connected"))
+
+    report = bluegreen.blue_green_restart(profile, "abc", Path("/dev/null"), ready_timeout=0)
+
+    assert report.mode == "rolled-back"
+    assert report.old_pid == old.pid and report.error == "never connected"
+    state = profile.read_state()
+    assert state.pop("restarts") is None # Recorded by the new replica only
+    assert state == before
+    assert profile.running_pid() == old.pid
+    assert profile.log_file.read_text() == "old log\n"
+    assert (tmp_path / "tunnel.log.failed").read_text() == "new log\n"
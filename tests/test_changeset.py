@@ -0,0 +1,115 @@
+import pytest
+
+from changeset import Changeset
+from config import CATCH_ALL_SERVICE, ConfigStore
+from routing import Route
+
+
+@pytest.fixture
+def store(tmp_path):
+    path = tmp_path / "config.yml"
+    path.write_text("tunnel: abc\ningress:\n"
+                    "- hostname: a.example.com\n  service: http://localhost:1\n"
+                    "- hostname: b.example.com\n  service: http://localhost:2\n"
+                    "- service: http_status:404\n")
+    return ConfigStore(path)
+
+
+def rule(store, hostname):
+    return next(r for r in store.ingress() if r.hostname == hostname)
+
+
+def hosts(store):
+    return [(r.hostname, r.service) for r in ConfigStore(store.path).ingress()]
+
+
+def test_staging():
+    changes = Changeset()
+    changes.add(Route("c.example.com", "http://localhost:3"))
+    changes.add(Route("c.example.com", "http://localhost:4")) # Replaces the first
+    assert len(changes) == 1
+    assert changes.adds[("c.example.com", None)].service == "http://localhost:4"
+    assert changes.unstage(("c.example.com", None)).service == "http://localhost:4"
+    assert changes.unstage(("c.example.com", None)) is None
+    assert len(changes) == 0
+
+
+def test_pending_and_keep(store):
+    changes = Changeset()
+    a, b = rule(store, "a.example.com"), rule(store, "b.example.com")
+    changes.add(Route("a.example.com", "http://localhost:9"))
+    changes.remove(b)
+    assert changes.pending(a) == "update"
+    assert changes.pending(b) == "remove"
+    assert changes.keep(b)
+    assert not changes.keep(b)
+    assert changes.pending(b) is None
+    changes.add(Route("a.example.com", "http://localhost:1")) # Same service as on disk
+    assert changes.pending(a) is None
+
+
+def test_commit_writes_everything_at_once(store):
+    changes = Changeset()
+    changes.add(Route("c.example.com", "http://localhost:3"))
+    changes.add(Route("a.example.com", "http://localhost:9"))
+    changes.remove(rule(store, "b.example.com"))
+    result = changes.commit(store)
+    assert (result.added, result.updated, result.removed, result.skipped) == (1, 1, 1, [])
+    assert hosts(store) == [("a.example.com", "http://localhost:9"), ("c.example.com", "http://localhost:3"),
+                            (None, CATCH_ALL_SERVICE)]
+    assert len(changes) == 0
+
+
+def test_specific_add_goes_before_a_staged_wildcard(store):
+    changes = Changeset()
+    changes.add(Route("*.example.com", "http://localhost:3"))
+    changes.add(Route("app.example.com", "http://localhost:4"))
+    changes.commit(store)
+    assert [host for host, _ in hosts(store)] == ["a.example.com", "b.example.com", "app.example.com",
+                                                  "*.example.com", None]
+
+
+def test_external_edit_between_staging_and_commit(store):
+    changes = Changeset()
+    changes.remove(rule(store, "b.example.com"))
+    changes.remove(rule(store, "a.example.com"))
+    changes.add(Route("c.example.com", "http://localhost:3"))
+
+    # Another process (the CLI, another dashboard) edits the file meanwhile:
+    # b moves down and a is removed.
+    with ConfigStore(store.path).transaction() as config:
+        config["ingress"] = [{"hostname": "cli.example.com", "service": "http://localhost:7"},
+                             {"hostname": "b.example.com", "service": "http://localhost:2"},
+                             {"service": CATCH_ALL_SERVICE}]
+
+    result = changes.commit(store)
+    assert (result.added, result.removed, result.skipped) == (1, 1, ["a.example.com"])
+    assert hosts(store) == [("cli.example.com", "http://localhost:7"), ("c.example.com", "http://localhost:3"),
+                            (None, CATCH_ALL_SERVICE)]
+
+
+def test_removal_prefers_the_staged_position_among_duplicates(store):
+    with store.transaction() as config:
+        config["ingress"].insert(2, {"hostname": "a.example.com", "service": "http://localhost:1"})
+    changes = Changeset()
+    second = [r for r in store.ingress() if r.hostname == "a.example.com"][1]
+    changes.remove(second)
+    changes.add(Route("b.example.com", "http://localhost:5"))
+    changes.commit(store)
+    assert hosts(store) == [("a.example.com", "http://localhost:1"), ("b.example.com", "http://localhost:5"),
+                            (None, CATCH_ALL_SERVICE)]
+
+
+def test_failed_write_keeps_the_edits_staged(store, monkeypatch):
+    before = store.path.read_text()
+    changes = Changeset()
+    changes.add(Route("c.example.com", "http://localhost:3"))
+
+    def fail(config):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(store, "_write", fail)
+    with pytest.raises(OSError):
+        changes.commit(store)
+    assert len(changes) == 1
+    assert store.path.read_text() == before
@@ -0,0 +1,83 @@
+import os
+
+import pytest
+
+from config import ConfigStore
+
+
+def write(path, text):
+    path.write_text(text)
+
+
+@pytest.fixture
+def store(tmp_path):
+    path = tmp_path / "config.yml"
+    write(path, "tunnel: abc\ningress:\n- hostname: a.example.com\n  service: http://localhost:1\n- service: http_status:404\n")
+    return ConfigStore(path)
+
+
+def test_load_is_cached_until_the_file_changes(store):
+    first = store.load()
+    assert store.load() is first
+    assert [r.hostname for r in store.ingress()] == ["a.example.com", None]
+
+    write(store.path, "tunnel: xyz\ningress:\n- service: http_status:404\n")
+    assert store.load()["tunnel"] == "xyz"
+    assert [r.hostname for r in store.ingress()] == [None]
+
+
+def test_external_replace_is_noticed(store):
+    store.load()
+    other = store.path.with_name("other.yml")
+    write(other, "tunnel: abc\ningress:\n- service: http_status:404\n") # Rename over it, as an editor would
+    os.replace(other, store.path)
+    assert len(store.ingress()) == 1
+    assert store.ingress_index().match("a.example.com").service == "http_status:404"
+
+
+def test_missing_file_loads_as_none(tmp_path):
+    store = ConfigStore(tmp_path / "missing.yml")
+    assert store.load() is None
+    assert store.ingress() == []
+
+
+def test_transaction_writes_only_changes(store):
+    before = os.stat(store.path).st_ino
+    with store.transaction() as config:
+        pass
+    assert os.stat(store.path).st_ino == before # Unchanged: not rewritten
+
+    with store.transaction() as config:
+        config["tunnel"] = "new"
+    assert store.load()["tunnel"] == "new"
+    assert ConfigStore(store.path).load()["tunnel"] == "new"
+    assert os.stat(store.path).st_mode & 0o777 == 0o600
+
+
+def test_transaction_rolls_back_on_exception(store):
+    text = store.path.read_text()
+    with pytest.raises(RuntimeError):
+        with store.transaction() as config:
+            config["tunnel"] = "half-done"
+            raise RuntimeError("boom")
+    assert store.path.read_text() == text
+    assert store.load()["tunnel"] == "abc"
+    assert store.load() is not config
+    assert [p.name for p in store.path.parent.iterdir() if p.name.startswith(".config.yml.")] == []
+
+
+def test_transaction_sees_edits_made_since_the_last_load(store):
+    store.load()
+    other = ConfigStore(store.path)
+    other.save({"tunnel": "abc", "ingress": [{"hostname": "b.example.com", "service": "http://localhost:2"}]})
+    with store.transaction() as config:
+        config["ingress"].append({"service": "http_status:404"})
+    assert [r.get("hostname") for r in store.load()["ingress"]] == ["b.example.com", None]
+
+
+def test_transaction_on_a_new_file(tmp_path):
+    store = ConfigStore(tmp_path / "sub" / "config.yml")
+    with store.transaction() as config:
+        assert config == {}
+        config["tunnel"] = "abc"
+    assert store.load() == {"tunnel": "abc"}
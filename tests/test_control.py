@@ -0,0 +1,75 @@
+import selectors
+import socket
+import threading
+import time
+
+from control import SOCKET_TIMEOUT, ControlServer, query
+
+
+def ask(server, path, command="status"):
+    """query() from a thread while pumping `server` the way the supervisor does."""
+    result = {}
+    thread = threading.Thread(target=lambda: result.update(query(path, command)))
+    selector = selectors.DefaultSelector()
+    server.attach(selector)
+    try:
+        thread.start()
+        while thread.is_alive():
+            for key, _ in selector.select(0.01):
+                server.handle(key)
+            server.expire()
+    finally:
+        server.detach()
+        selector.close()
+    return result
+
+
+def test_socket_comes_back_after_a_rolled_back_replacement(tmp_path):
+    path = tmp_path / "control.sock"
+    old = ControlServer(path, lambda command: {"who": "old"})
+    new = ControlServer(path, lambda command: {"who": "new"}) # Replica taking over
+    assert not old.stale()
+    assert ask(new, path) == {"who": "new"}
+
+    new.close() # The replica failed and exited
+    assert old.stale()
+    old.reclaim()
+    assert not old.stale()
+    assert ask(old, path) == {"who": "old"}
+    old.close()
+    assert not path.exists()
+
+
+def test_closing_a_replaced_server_keeps_the_new_socket(tmp_path):
+    path = tmp_path / "control.sock"
+    old = ControlServer(path, lambda command: {"who": "old"})
+    new = ControlServer(path, lambda command: {"who": "new"})
+    old.close()
+    assert ask(new, path) == {"who": "new"}
+    new.close()
+
+
+def test_stalled_client_does_not_hold_up_others(tmp_path):
+    path = tmp_path / "control.sock"
+    server = ControlServer(path, lambda command: {"command": command})
+    stalled = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stalled.connect(str(path))
+    stalled.sendall(b"sta") # ...and never finishes the line
+
+    started = time.monotonic()
+    assert ask(server, path, "status") == {"command": "status"}
+    assert time.monotonic() - started < SOCKET_TIMEOUT
+
+    server.expire(time.monotonic() + SOCKET_TIMEOUT)
+    stalled.settimeout(1)
+    assert stalled.recv(100) == b"" # Dropped
+    stalled.close()
+    server.close()
+
+
+def test_large_reply_is_sent_in_pieces(tmp_path):
+    path = tmp_path / "control.sock"
+    big = {"ingress": ["x" * 100] * 20000} # Larger than a socket buffer
+    server = ControlServer(path, lambda command: big)
+    assert ask(server, path) == big
+    server.close()
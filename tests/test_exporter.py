@@ -0,0 +1,51 @@
+import time
+
+import exporter
+from probe import ProbeResult
+from profiles import Profile
+
+
+def profile_at(path):
+    profile = Profile("test")
+    profile.dir = path
+    profile.config_file = path / "config.yml"
+    profile.pid_file = path / "tunnel.pid"
+    profile.log_file = path / "tunnel.log"
+    profile.state_file = path / "state.json"
+    profile.socket_file = path / "control.sock"
+    return profile
+
+
+def write_config(profile, rules):
+    ingress = "".join(f"- hostname: {host}\n  service: {service}\n" for host, service in rules)
+    profile.config_file.write_text(f"tunnel: abc\ningress:\n{ingress}- service: http_status:404\n")
+
+
+def probe_lines(body):
+    return [line for line in body.decode().splitlines() if line.startswith("tunnelflare_probe_up")]
+
+
+def test_series_follow_the_rules_in_the_config(tmp_path, monkeypatch):
+    profile = profile_at(tmp_path)
+    collector = exporter.Exporter([profile])
+
+    def run(specs):
+        return {spec.rule_id: ProbeResult(spec.rule_id, spec.url, True, 200, 0.01, None, time.time())
+                for spec in specs}
+
+    monkeypatch.setattr(collector.engine, "run", run)
+    try:
+        write_config(profile, [("a.example.com", "http://localhost:1"), ("b.example.com", "http://localhost:2")])
+        collector.collect()
+        assert len(probe_lines(collector.body)) == 2
+
+        # b removed, a moved to another origin
+        time.sleep(0.01)
+        write_config(profile, [("a.example.com", "http://localhost:3")])
+        collector.collect()
+        assert probe_lines(collector.body) == [
+            'tunnelflare_probe_up{profile="test",rule="a.example.com",service="http://localhost:3"} 1']
+        assert 'tunnelflare_probe_duration_seconds_count{profile="test",rule="a.example.com",' \
+               'service="http://localhost:3"} 1' in collector.body.decode()
+    finally:
+        collector.close()
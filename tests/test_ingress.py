@@ -0,0 +1,105 @@
+from config import CATCH_ALL_SERVICE, build_ingress
+from ingress import IngressIndex, lint
+
+
+def rules_of(*entries):
+    """Ingress rules from (hostname, path) pairs, services numbered in order."""
+    ingress = []
+    for number, (hostname, path) in enumerate(entries):
+        raw = {"service": f"http://localhost:{number}"}
+        if hostname is not None:
+            raw["hostname"] = hostname
+        if path is not None:
+            raw["path"] = path
+        ingress.append(raw)
+    return build_ingress({"ingress": ingress})
+
+
+def service(rule):
+    return rule.service if rule else None
+
+
+def kinds(issues):
+    return [(issue.kind, issue.rule.index) for issue in issues]
+
+
+def test_exact_and_wildcard_hosts():
+    index = IngressIndex(rules_of(("app.example.com", None), ("*.example.com", None)))
+    assert service(index.match("app.example.com")) == "http://localhost:0"
+    assert service(index.match("APP.Example.com")) == "http://localhost:0"
+    assert service(index.match("api.example.com")) == "http://localhost:1"
+    assert service(index.match("a.b.example.com")) == "http://localhost:1" # Any depth
+    assert index.match("example.com") is None # Not the apex
+    assert index.match("example.org") is None
+
+
+def test_first_match_wins():
+    index = IngressIndex(rules_of(("*.example.com", None), ("app.example.com", None), (None, None)))
+    assert service(index.match("app.example.com")) == "http://localhost:0"
+    assert service(index.match("example.org")) == "http://localhost:2"
+    assert index.host_candidates("app.example.com") == [0, 1, 2]
+    assert index.host_candidates("example.org") == [2]
+
+
+def test_path_regex_is_searched():
+    index = IngressIndex(rules_of(("app.example.com", "^/api/"), ("app.example.com", r"\.png$"),
+                                  ("app.example.com", None)))
+    assert service(index.match("app.example.com", "/api/users")) == "http://localhost:0"
+    assert service(index.match("app.example.com", "/img/logo.png")) == "http://localhost:1"
+    assert service(index.match("app.example.com", "/v1/api/")) == "http://localhost:2" # Anchored by the rule
+    assert service(index.match("app.example.com")) == "http://localhost:2"
+
+
+def test_match_url():
+    index = IngressIndex(rules_of(("app.example.com", "^/api"), (None, None)))
+    host, path, rule = index.match_url("app.example.com/api/x")
+    assert (host, path, service(rule)) == ("app.example.com", "/api/x", "http://localhost:0")
+    host, path, rule = index.match_url("https://App.example.com:8443")
+    assert (host, path, service(rule)) == ("app.example.com", "/", "http://localhost:1")
+
+
+def test_invalid_rules_never_match():
+    index = IngressIndex(rules_of(("app.example.com", "("), ("app.*.example.com", None), (None, None)))
+    assert set(index.invalid) == {0, 1}
+    assert service(index.match("app.example.com")) == "http://localhost:2"
+    assert kinds(lint(index.rules, index)) == [("invalid", 0), ("invalid", 1)]
+
+
+def test_clean_config_has_no_issues():
+    rules = rules_of(("app.example.com", "^/api"), ("app.example.com", None), ("*.example.com", None),
+                     (None, None))
+    assert lint(rules) == []
+
+
+def test_duplicate_and_unreachable():
+    rules = rules_of(("app.example.com", None), ("app.example.com", None), ("*.example.com", None),
+                     ("api.example.com", None), ("*.a.example.com", None), (None, None),
+                     ("late.example.org", None), (None, None))
+    issues = lint(rules)
+    assert kinds(issues) == [("duplicate", 1), ("unreachable", 3), ("unreachable", 4),
+                             ("unreachable", 6), ("duplicate", 7)]
+    assert issues[0].other is rules[0]
+    assert issues[1].other is rules[2]
+    assert issues[3].other is rules[5] # The catch-all in the middle
+
+
+def test_path_rule_behind_same_host_without_path_is_unreachable():
+    rules = rules_of(("app.example.com", None), ("app.example.com", "^/api"), (None, None))
+    assert kinds(lint(rules)) == [("unreachable", 1)]
+
+
+def test_wildcard_with_path_partly_overlaps_exact_host():
+    rules = rules_of(("*.example.com", "^/static"), ("app.example.com", None), (None, None))
+    issues = lint(rules)
+    assert kinds(issues) == [("overlap", 1)]
+    assert issues[0].level == "warning"
+    assert issues[0].other is rules[0]
+
+
+def test_missing_catch_all():
+    rules = rules_of(("app.example.com", None), (None, "^/health"))
+    issues = lint(rules)
+    assert kinds(issues) == [("no-catch-all", 1)]
+    assert issues[0].level == "error"
+    assert lint(build_ingress({"ingress": [{"service": CATCH_ALL_SERVICE}]})) == []
+    assert lint([]) == []
@@ -0,0 +1,33 @@
+import multiprocessing
+
+from profiles import Profile
+
+
+def profile_at(path):
+    profile = Profile("test")
+    profile.dir = path
+    profile.state_file = path / "state.json"
+    return profile
+
+
+def _bump(path, key, times):
+    profile = profile_at(path)
+    for i in range(times):
+        profile.write_state(**{key: i + 1})
+
+
+def test_write_state_merges_updates(tmp_path):
+    profile = profile_at(tmp_path)
+    profile.write_state(pid=1, metrics="127.0.0.1:1")
+    assert profile.write_state(pid=None) == {"pid": None, "metrics": "127.0.0.1:1"}
+    assert profile.read_state() == {"pid": None, "metrics": "127.0.0.1:1"}
+
+
+def test_concurrent_writers_keep_each_others_updates(tmp_path):
+    workers = [multiprocessing.Process(target=_bump, args=(tmp_path, f"key{n}", 50)) for n in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    assert profile_at(tmp_path).read_state() == {f"key{n}": 50 for n in range(4)}
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["state.json", "state.json.lock"]
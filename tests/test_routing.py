@@ -0,0 +1,30 @@
+from config import CATCH_ALL_SERVICE
+from routing import Route, merge_ingress
+
+
+def hostnames(config):
+    return [rule.get("hostname") for rule in config["ingress"]]
+
+
+def test_specific_host_goes_before_wildcard_in_same_batch():
+    config = {"ingress": [{"service": CATCH_ALL_SERVICE}]}
+    added, updated = merge_ingress(config, [Route("*.example.com", "http://localhost:1"),
+                                            Route("app.example.com", "http://localhost:2")])
+    assert (added, updated) == (2, 0)
+    assert hostnames(config) == ["app.example.com", "*.example.com", None]
+
+
+def test_batch_shadow_ahead_of_existing_one():
+    config = {"ingress": [{"hostname": "*.example.com", "service": "http://localhost:1"},
+                          {"service": CATCH_ALL_SERVICE}]}
+    merge_ingress(config, [Route("*.a.example.com", "http://localhost:2"),
+                           Route("b.a.example.com", "http://localhost:3")])
+    assert hostnames(config) == ["b.a.example.com", "*.a.example.com", "*.example.com", None]
+
+
+def test_unrelated_hosts_are_appended_in_order():
+    config = {"ingress": [{"hostname": "a.example.com", "service": "http://localhost:1"},
+                          {"service": CATCH_ALL_SERVICE}]}
+    merge_ingress(config, [Route("b.example.com", "http://localhost:2"),
+                           Route("c.example.com", "http://localhost:3")])
+    assert hostnames(config) == ["a.example.com", "b.example.com", "c.example.com", None]
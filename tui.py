@@ -1,29 +1,52 @@
 from textual.app import App, ComposeResult
 from textual.containers import Container, Horizontal, Vertical, Grid
-from textual.widgets import Header, Footer, Static, Button, DataTable, Log, Label, Input
+from textual.widgets import Header, Footer, Static, Button, DataTable, Log, Label, Input, Select, Sparkline
 from textual.screen import ModalScreen
 from textual.binding import Binding
-from textual import work
+from textual import events, work
+from rich.markup import escape
 from rich.text import Text
-from rich.panel import Panel
 from rich.align import Align
-from rich.table import Table
 from rich.layout import Layout
-import yaml
-import subprocess
+import asyncio
 import os
 import signal
 import time
 import socket
 import requests
+from collections import Counter, deque
 from pathlib import Path
 
+from bluegreen import blue_green_restart, restart_lock_async
+from changeset import Changeset
+from config import CATCH_ALL_SERVICE
+from history import HistoryStore, downsample, format_value
+from httpclient import ConnectionPool
+from inventory import get_inventory
+from latency import SLOT_SECONDS, SLOTS, SPARKLINE_POINTS, LatencyHistogram, format_ms, sparkline
+from logparse import LogMonitor
+from logtail import LogTailer
+from metrics import DASHBOARD_METRICS, METRICS_PATH, MetricsParser, TrafficStats
+from probe import ProbeEngine, build_specs, summarize
+from profiles import DEFAULT_PROFILE, STOP_TIMEOUT, Profile, list_profiles, wait_for_exit_async
+from routing import Route
+
 # Constants
-TUNNEL_DIR = Path.home() / ".tunnelflare"
-PID_FILE = TUNNEL_DIR / "tunnel.pid"
-LOG_FILE = TUNNEL_DIR / "tunnel.log"
-CONFIG_FILE = TUNNEL_DIR / "config.yml"
 CLOUDFLARE_ORANGE = "#F38020"
+LOG_MAX_LINES = 5000 # Ring buffer size of the log pane
+# Resources table: (column key, label, width); None fits the content
+RESOURCE_COLUMNS = (("pos", "#", 4), ("rule", "Rule", None), ("service", "Service", None),
+                    ("status", "Status", 6), ("p50", "p50", 8), ("p99", "p99", 8), ("ok", "OK", 5),
+                    ("latency", "Latency", SPARKLINE_POINTS))
+# Orders the table can be sorted in; the health orders put the worst rules first.
+RESOURCE_SORTS = ("pos", "status", "p50", "p99", "ok")
+# DataTable.remove_row renumbers every row, so past this many removals
+# (e.g. narrowing a filter) refilling the table is cheaper.
+RESOURCE_REFILL_AT = 32
+FILTER_DEBOUNCE = 0.15 # Seconds of no typing before the filter is applied
+# Seconds after the last staged ingress edit before the batch is written
+# and the tunnel reloaded, so a burst of edits costs one restart.
+COMMIT_DEBOUNCE = 3.0
 
 class AddDNSScreen(ModalScreen):
     """Screen for adding a new DNS record."""
@@ -92,25 +115,257 @@ class AddDNSScreen(ModalScreen):
     def action_cancel(self):
         self.dismiss(None)
 
-class TopologyWidget(Static):
+class HistoryScreen(ModalScreen):
+    """The last day of a tunnel's recorded health, from its history store."""
+
+    CSS = """
+    HistoryScreen {
+        align: center middle;
+    }
+
+    #history_dialog {
+        padding: 1 2;
+        width: 120;
+        max-width: 95%;
+        height: auto;
+        max-height: 90%;
+        border: thick $background 80%;
+        background: $surface;
+    }
+    """
+
+    BINDINGS = [("escape", "close", "Close"), ("h", "close", "Close")]
+    SPAN = 86400
+    WIDTH = 40
+
+    def __init__(self, profile: Profile):
+        super().__init__()
+        self.profile = profile
+
+    def compose(self) -> ComposeResult:
+        with Vertical(id="history_dialog"):
+            yield Static(self.render_history(), id="history_body")
+
+    def render_history(self):
+        from rich.table import Table
+
+        store = HistoryStore.open_readonly(self.profile.history_file)
+        if store is None:
+            return Text("No history recorded yet: it is written while the tunnel runs.")
+        end = time.time()
+        start = end - self.SPAN
+        table = Table(title=f"{self.profile.name}: last 24h", expand=True, border_style=CLOUDFLARE_ORANGE)
+        table.add_column("Series", style="bold", no_wrap=True)
+        for column in ("Min", "Avg", "Max"):
+            table.add_column(column, justify="right", no_wrap=True, min_width=9)
+        table.add_column("Trend", no_wrap=True, min_width=self.WIDTH)
+        try:
+            for name, (count, low, avg, high) in store.summary(start, end).items():
+                trend = sparkline(downsample(store.query(name, start, end), start, end, self.WIDTH), " ")
+                table.add_row(name, format_value(name, low), format_value(name, avg), format_value(name, high), trend)
+        except Exception as e:
+            return Text(f"Cannot read history: {e}")
+        finally:
+            store.close()
+        return table
+
+    def action_close(self):
+        self.dismiss(None)
+
+class ProfileView:
+    """Per-profile dashboard state, created the first time a profile is shown."""
+
+    def __init__(self, profile: Profile):
+        self.profile = profile
+        self.log_tailer = LogTailer(profile.log_file)
+        self.log_monitor = LogMonitor()
+        self.lines = deque(maxlen=LOG_MAX_LINES)
+        self.traffic = TrafficStats()
+        self.metrics_pid = None # Process the traffic history belongs to
+        self.latency = {} # rule id -> LatencyHistogram of origin probes
+        self.changes = Changeset() # Ingress edits staged but not yet written
+        self.seed_latency()
+
+    def seed_latency(self):
+        """Fill the latency window from the recorded history, so it shows at once."""
+        store = HistoryStore.open_readonly(self.profile.history_file)
+        if store is None:
+            return
+        end = time.time()
+        start = end - SLOTS * SLOT_SECONDS
+        try:
+            for name in store.series():
+                if not name.startswith("origin_up:"):
+                    continue
+                rule_id = name.split(":", 1)[1]
+                latencies = {p.time: p.avg / 1000 for p in store.query(f"latency_ms:{rule_id}", start, end, 60)}
+                histogram = LatencyHistogram()
+                for point in store.query(name, start, end, 60):
+                    latency = latencies.get(point.time)
+                    histogram.record(latency, latency is not None and point.avg >= 0.5, now=point.time)
+                if histogram.last_ok is not None:
+                    self.latency[rule_id] = histogram
+        except Exception:
+            pass # History is a nicety; the probes fill the window anyway
+        finally:
+            store.close()
+
+    def poll_logs(self):
+        """Read new log lines, feed the monitor, and return them."""
+        lines = self.log_tailer.read_lines()
+        if lines:
+            self.log_monitor.feed(lines)
+            self.lines.extend(lines)
+        return lines
+
+    def metrics_address(self, pid):
+        """Where the running process serves metrics: recorded at spawn, else from its log."""
+        state = self.profile.read_state()
+        if state.get("pid") == pid and state.get("metrics"):
+            return state["metrics"]
+        return self.log_monitor.metrics_address
+
+# Retro Icons (Unicode Art), filled in with the node's status color
+ICON_CLIENT = """[cyan]
+ ╔══════╗ 
+ ║ >_   ║ 
+ ╚╦════╦╝ 
+  ╚════╝  
+  CLIENT  [/cyan]"""
+
+ICON_INTERNET = """[{color}]
+ ╔══════╗ 
+ ║ WWW  ║ 
+ ║      ║ 
+ ╚══════╝ 
+ INTERNET [/]"""
+
+ICON_CLOUDFLARE = f"""[bold {CLOUDFLARE_ORANGE}]
+   _  _   
+ (  )( )  
+(______ ) 
+          
+CLOUDFLARE[/]"""
+
+ICON_TUNNEL = """[{color}]
+ ╔══════╗ 
+ ║TUNNEL║ 
+ ║>>>>>>║ 
+ ╚══════╝ 
+  TUNNEL  [/]"""
+
+ICON_SERVER = """[{color}]
+ ╔══════╗ 
+ ║[||||]║ 
+ ║[||||]║ 
+ ╚══════╝ 
+  SERVER  [/]"""
+
+FLOW_WIDTH = 10
+METRICS_INTERVAL = 2 # Seconds between metrics scrapes
+METRICS_TIMEOUT = 1
+ANIMATION_INTERVAL = 0.2 # Seconds per animation frame
+IDLE_TIMEOUT = 300 # Pause the animation after this long without input
+
+class NodeWidget(Static):
+    """One topology node: icon plus details, re-rendered only when they change."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._markup = None
+
+    def show(self, markup: str):
+        if markup != self._markup:
+            self._markup = markup
+            self.update(Text.from_markup(markup, justify="center"))
+
+class FlowLine(Static):
+    """Animated packet flow between two nodes; only this redraws each frame."""
+
+    # (Modern Retro Packet Flow) Pattern: · · ● · · ● · ·
+    # The pattern repeats every 4 frames, so every frame is prebuilt once.
+    FRAMES = {
+        style: [Text("\n\n" + "".join("●" if (i - t) % 4 == 0 else "·" for i in range(FLOW_WIDTH)),
+                     style=style, justify="center") for t in range(4)]
+        for style in ("bold green", "bold red blink")
+    }
+    IDLE_LINE = Text("\n\n" + "─" * FLOW_WIDTH, style="dim white", justify="center")
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.active = False
+        self.warning = False
+        self._shown = None
+
+    def set_state(self, active: bool, warning: bool = False):
+        self.active = active
+        self.warning = warning
+        if not active:
+            self._show(self.IDLE_LINE)
+
+    def tick(self, frame: int):
+        if self.active:
+            style = "bold red blink" if self.warning else "bold green"
+            self._show(self.FRAMES[style][frame % 4])
+
+    def _show(self, renderable: Text):
+        if renderable is not self._shown:
+            self._shown = renderable
+            self.update(renderable)
+
+class TopologyWidget(Horizontal):
     """Widget to display the network topology."""
     
+    DEFAULT_CSS = f"""
+    TopologyWidget {{
+        border: round {CLOUDFLARE_ORANGE};
+        border-title-color: white;
+        border-title-style: bold;
+    }}
+    
+    TopologyWidget NodeWidget, TopologyWidget FlowLine {{
+        width: 1fr;
+        height: 100%;
+        text-align: center;
+    }}
+    """
+    
     public_ip = "Loading..."
     local_ip = "Loading..."
-    tunnel_id = "Unknown"
+    tunnel_id = "Unknown" # Tunnel name when the inventory knows it, else a short UUID
     
     # Diagnostics
     internet_status = "checking" # checking, ok, error
     tunnel_status = "checking"
     local_status = "checking"
     log_status = "ok" # ok, warning, error
+    probe_results = {} # rule id -> ProbeResult
+
+    NODES = ("client", "internet", "cloudflare", "tunnel", "local")
+    
+    def compose(self) -> ComposeResult:
+        for i, node in enumerate(self.NODES):
+            if i:
+                yield FlowLine(id=f"flow_{i}")
+            yield NodeWidget(id=f"node_{node}")
     
     def on_mount(self) -> None:
+        self.border_title = "NETWORK DIAGNOSTICS"
+        self.nodes = {node: self.query_one(f"#node_{node}", NodeWidget) for node in self.NODES}
+        self.flows = [self.query_one(f"#flow_{i}", FlowLine) for i in range(1, len(self.NODES))]
+        self.frame = 0
+        self._state_key = None
+        self._paused = set() # Reasons the animation is paused
+        self.probe_engine = ProbeEngine()
+        self.animation = self.set_interval(ANIMATION_INTERVAL, self.animate_flows) # Packet flow only
+        self.refresh_topology()
         self.fetch_ips()
         self.check_health()
-        self.set_interval(0.2, self.refresh_topology) # Faster refresh for smooth animation
         self.set_interval(5, self.check_health) # Re-check health every 5s
 
+    def on_unmount(self) -> None:
+        self.probe_engine.close()
+
     @work(thread=True)
     def fetch_ips(self):
         # Fetch Public IP
@@ -128,38 +383,42 @@ class TopologyWidget(Static):
         except:
             self.local_ip = "127.0.0.1"
             
-        # Get Tunnel ID from config
-        if CONFIG_FILE.exists():
-            try:
-                with open(CONFIG_FILE, "r") as f:
-                    config = yaml.safe_load(f)
-                    self.tunnel_id = config.get("tunnel", "Unknown")[:8] + "..."
-            except:
-                pass
+        self.load_tunnel_id(fetch=True)
+        self.app.call_from_thread(self.refresh_topology)
 
-    def check_log_errors(self):
-        """Scan the last 20 lines of the log file for errors."""
-        if not LOG_FILE.exists(): return "ok"
+    def load_tunnel_id(self, fetch: bool = False):
+        # Get Tunnel ID from config, and its name from the tunnel inventory
+        self.tunnel_id = "Unknown"
         try:
-            with open(LOG_FILE, "r") as f:
-                # Read last 2000 bytes approx
-                f.seek(0, 2)
-                size = f.tell()
-                f.seek(max(0, size - 2000))
-                lines = f.readlines()[-20:] # Last 20 lines
-                
-                for line in lines:
-                    line_lower = line.lower()
-                    if "err" in line_lower or "error" in line_lower or "failed" in line_lower or "terminated" in line_lower:
-                        return "error"
-                    if "warn" in line_lower or "retrying" in line_lower:
-                        return "warning"
+            tunnel_id = self.app.profile.store.get("tunnel")
+            if tunnel_id:
+                self.tunnel_id = tunnel_id[:8] + "..."
+                tunnel = get_inventory().by_id(tunnel_id, fetch=fetch)
+                if tunnel:
+                    self.tunnel_id = tunnel.name if len(tunnel.name) <= 16 else tunnel.name[:15] + "…"
         except:
             pass
-        return "ok"
+
+    def reset_status(self):
+        """Forget the previous profile's diagnostics after a tunnel switch."""
+        self.tunnel_status = "checking"
+        self.local_status = "checking"
+        self.log_status = "ok"
+        self.probe_results = {}
+        self.load_tunnel_id()
+        self.refresh_topology()
+        self.check_health()
+
+    def check_log_errors(self):
+        """Health from the rolling log counters kept by the app's LogMonitor."""
+        monitor = getattr(self.app, "log_monitor", None)
+        if monitor is None: return "ok"
+        return monitor.status()
 
     @work(thread=True)
     def check_health(self):
+        profile = self.app.profile
+
         # 1. Internet Check
         try:
             requests.get("https://1.1.1.1", timeout=2)
@@ -168,178 +427,191 @@ class TopologyWidget(Static):
             self.internet_status = "error"
             
         # 2. Tunnel Check (Process)
-        if PID_FILE.exists():
-            try:
-                with open(PID_FILE, "r") as f:
-                    pid = int(f.read().strip())
-                os.kill(pid, 0)
-                self.tunnel_status = "ok"
-            except:
-                self.tunnel_status = "error"
+        if profile.pid_file.exists():
+            tunnel_status = "ok" if profile.running_pid() else "error"
         else:
-            self.tunnel_status = "stopped"
+            tunnel_status = "stopped"
             
-        # 3. Local Service Check (First one in config)
-        self.local_status = "ok" # Default to OK if no service to check
-        if CONFIG_FILE.exists():
-            try:
-                with open(CONFIG_FILE, "r") as f:
-                    config = yaml.safe_load(f)
-                if "ingress" in config:
-                    for rule in config["ingress"]:
-                        service = rule.get("service", "")
-                        if service.startswith("http"):
-                            try:
-                                requests.get(service, timeout=1)
-                                self.local_status = "ok"
-                                break
-                            except:
-                                self.local_status = "error"
-            except:
-                pass
+        # 3. Local Service Check (every ingress origin, concurrently)
+        try:
+            specs = build_specs(profile.store.ingress())
+            probe_results = self.probe_engine.run(specs)
+            local_status = summarize(probe_results)
+        except:
+            probe_results, local_status = {}, "error"
+        self.app.call_from_thread(self.app.record_probes, profile, probe_results)
+
+        if profile != self.app.profile:
+            return # Switched tunnels while checking; these results are stale
+        self.tunnel_status = tunnel_status
+        self.probe_results = probe_results
+        self.local_status = local_status
         
         # 4. Log Check
         self.log_status = self.check_log_errors()
+        self.app.call_from_thread(self.refresh_topology)
+
+    def pause_animation(self, reason: str):
+        if not self._paused:
+            self.animation.pause()
+        self._paused.add(reason)
+
+    def resume_animation(self, reason: str):
+        if reason in self._paused:
+            self._paused.discard(reason)
+            if not self._paused:
+                self.animation.resume()
+
+    def animate_flows(self):
+        self.frame += 1
+        for flow in self.flows:
+            flow.tick(self.frame)
+
+    def state_key(self):
+        monitor = getattr(self.app, "log_monitor", None)
+        conns = len(monitor.connections) if monitor is not None else 0
+        failed = sum(1 for r in self.probe_results.values() if not r.ok)
+        return (self.internet_status, self.tunnel_status, self.local_status, self.log_status,
+                self.public_ip, self.local_ip, self.tunnel_id, conns, failed, len(self.probe_results))
 
     def refresh_topology(self):
-        self.update(self.generate_topology())
+        """Rebuild the static icons and details, but only if the health state changed."""
+        key = self.state_key()
+        if key == self._state_key:
+            return
+        self._state_key = key
+        (internet_status, tunnel_status, local_status, log_status,
+         public_ip, local_ip, tunnel_id, conns, failed, probed) = key
 
-    def generate_topology(self):
         # Colors based on status
-        color_internet = "green" if self.internet_status == "ok" else "red"
-        color_tunnel = "green" if self.tunnel_status == "ok" else "red"
-        if self.tunnel_status == "stopped": color_tunnel = "yellow"
+        color_internet = "green" if internet_status == "ok" else "red"
+        color_tunnel = "green" if tunnel_status == "ok" else "red"
+        if tunnel_status == "stopped": color_tunnel = "yellow"
         
         # Local status depends on Tunnel status too now
-        if self.tunnel_status != "ok":
+        if tunnel_status != "ok":
              # If tunnel is down, local is effectively isolated from the outside
              color_local = "yellow" 
              status_local_text = "Isolated"
+        elif local_status == "warning":
+             # Some origins answer, some don't
+             color_local = "yellow"
+             status_local_text = f"Degraded ({failed}/{probed} down)"
         else:
-             color_local = "green" if self.local_status == "ok" else "red"
-             status_local_text = "Reachable" if self.local_status == "ok" else "Unreachable"
+             color_local = "green" if local_status == "ok" else "red"
+             status_local_text = "Reachable" if local_status == "ok" else "Unreachable"
 
         # Log Status Effect
-        if self.log_status == "error":
+        if log_status == "error":
             color_tunnel = "red" # Override tunnel color on error
-        elif self.log_status == "warning":
+        elif log_status == "warning":
             color_tunnel = "yellow"
 
-        # Retro Icons (Unicode Art)
+        # Status Text
+        status_internet = "Connected" if internet_status == "ok" else "Disconnected"
+        status_tunnel = "Active" if tunnel_status == "ok" else ("Stopped" if tunnel_status == "stopped" else "Error")
         
-        # Client (Retro PC)
-        icon_client = Text.from_markup(f"""[cyan]
- ╔══════╗ 
- ║ >_   ║ 
- ╚╦════╦╝ 
-  ╚════╝  
-  CLIENT  [/cyan]""")
-
-        # Internet (Retro Browser Window)
-        icon_internet = Text.from_markup(f"""[{color_internet}]
- ╔══════╗ 
- ║ WWW  ║ 
- ║      ║ 
- ╚══════╝ 
- INTERNET [/]""")
+        # Registered edge connections, as seen in the log
+        if tunnel_status == "ok" and conns:
+            status_tunnel += f" ({conns} conns)"
 
-        # Cloudflare (Retro Cloud)
-        icon_cloudflare = Text.from_markup(f"""[bold {CLOUDFLARE_ORANGE}]
-   _  _   
- (  )( )  
-(______ ) 
-          
-CLOUDFLARE[/]""")
-
-        # Tunnel (Retro Pipe/Gate)
-        icon_tunnel = Text.from_markup(f"""[{color_tunnel}]
- ╔══════╗ 
- ║TUNNEL║ 
- ║>>>>>>║ 
- ╚══════╝ 
-  TUNNEL  [/]""")
+        # Append Log Status
+        if log_status == "error":
+            status_tunnel += " (Errors)"
+        elif log_status == "warning":
+            status_tunnel += " (Unstable)"
 
-        # Localhost (Retro Server Rack)
-        icon_local = Text.from_markup(f"""[{color_local}]
- ╔══════╗ 
- ║[||||]║ 
- ║[||||]║ 
- ╚══════╝ 
-  SERVER  [/]""")
-
-        # Connectivity Animation (Modern Retro Packet Flow)
-        # Pattern: · · ● · · ● · ·
-        t = int(time.time() * 10) # Fast ticker
-        width = 10
-        
-        def get_flow_line(active=True, warning=False):
-            if not active:
-                return Text("──────────", style="dim white")
-            
-            chars = []
-            for i in range(width):
-                # Create a moving wave/packet effect
-                if (i - t) % 4 == 0:
-                    chars.append("●") # Packet
-                else:
-                    chars.append("·") # Trail
-            
-            line_str = "".join(chars)
-            style = "bold red blink" if warning else "bold green"
-            return Text.from_markup(f"\n\n[{style}]{line_str}[/]\n", justify="center")
+        # Icons with their details underneath
+        self.nodes["client"].show(ICON_CLIENT + "\n[dim cyan]Client[/]")
+        self.nodes["internet"].show(ICON_INTERNET.format(color=color_internet)
+                                    + f"\nPublic IP:\n{public_ip}\n[{color_internet}]{status_internet}[/]")
+        self.nodes["cloudflare"].show(ICON_CLOUDFLARE + f"\n[dim {CLOUDFLARE_ORANGE}]Anycast\nNetwork[/]")
+        self.nodes["tunnel"].show(ICON_TUNNEL.format(color=color_tunnel)
+                                  + f"\nTunnel:\n{tunnel_id}\n[{color_tunnel}]{status_tunnel}[/]")
+        self.nodes["local"].show(ICON_SERVER.format(color=color_local)
+                                 + f"\nLocal IP:\n{local_ip}\n[{color_local}]{status_local_text}[/]")
 
         # Determine if flow is active based on health
-        flow_internet = self.internet_status == "ok"
-        flow_tunnel = self.tunnel_status == "ok"
-        flow_local = self.local_status == "ok" and self.tunnel_status == "ok" # Local flow depends on tunnel
+        flow_internet = internet_status == "ok"
+        flow_tunnel = tunnel_status == "ok"
+        flow_local = local_status in ("ok", "warning") and tunnel_status == "ok" # Local flow depends on tunnel
         
         # Warning state for lines
-        warn_tunnel = self.log_status == "error"
-
-        conn_1 = get_flow_line(flow_internet)
-        conn_2 = get_flow_line(flow_internet and flow_tunnel, warning=warn_tunnel) 
-        conn_3 = get_flow_line(flow_tunnel, warning=warn_tunnel)
-        conn_4 = get_flow_line(flow_local)
-
-        grid = Table.grid(expand=True, padding=0)
-        grid.add_column(justify="center", ratio=1)
-        grid.add_column(justify="center", ratio=1)
-        grid.add_column(justify="center", ratio=1)
-        grid.add_column(justify="center", ratio=1)
-        grid.add_column(justify="center", ratio=1)
-        grid.add_column(justify="center", ratio=1)
-        grid.add_column(justify="center", ratio=1)
-        grid.add_column(justify="center", ratio=1)
-        grid.add_column(justify="center", ratio=1)
-
-        grid.add_row(
-            icon_client, conn_1, icon_internet, conn_2, icon_cloudflare, conn_3, icon_tunnel, conn_4, icon_local
-        )
-        
-        # Status Text
-        status_internet = "Connected" if self.internet_status == "ok" else "Disconnected"
-        status_tunnel = "Active" if self.tunnel_status == "ok" else ("Stopped" if self.tunnel_status == "stopped" else "Error")
-        
-        # Append Log Status
-        if self.log_status == "error":
-            status_tunnel += " (Errors)"
-        elif self.log_status == "warning":
-            status_tunnel += " (Unstable)"
+        warn_tunnel = log_status == "error"
 
-        # Details Row
-        grid.add_row(
-            Text("Client", style="dim cyan", justify="center"),
-            "",
-            Text.from_markup(f"Public IP:\n{self.public_ip}\n[{color_internet}]{status_internet}[/]", style="white", justify="center"),
-            "",
-            Text("Anycast\nNetwork", style=f"dim {CLOUDFLARE_ORANGE}", justify="center"),
-            "",
-            Text.from_markup(f"UUID:\n{self.tunnel_id}\n[{color_tunnel}]{status_tunnel}[/]", style="white", justify="center"),
-            "",
-            Text.from_markup(f"Local IP:\n{self.local_ip}\n[{color_local}]{status_local_text}[/]", style="white", justify="center")
-        )
+        self.flows[0].set_state(flow_internet)
+        self.flows[1].set_state(flow_internet and flow_tunnel, warning=warn_tunnel)
+        self.flows[2].set_state(flow_tunnel, warning=warn_tunnel)
+        self.flows[3].set_state(flow_local, warning=local_status == "warning")
+
+        # Nothing to animate while every line is down
+        if any(flow.active for flow in self.flows):
+            self.resume_animation("inactive")
+        else:
+            self.pause_animation("inactive")
+        self.animate_flows()
+
+class MetricCell(Vertical):
+    """A traffic figure with its sparkline."""
+
+    def __init__(self, title: str, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.title = title
+
+    def compose(self) -> ComposeResult:
+        yield Label(f"[dim]{self.title}[/]")
+        yield Static("-", classes="value")
+        yield Sparkline([], summary_function=max)
+
+    def show(self, value: str, series=None):
+        self.query_one(".value", Static).update(value)
+        if series is not None:
+            self.query_one(Sparkline).data = list(series)
 
-        return Panel(grid, title="[bold white]NETWORK DIAGNOSTICS[/]", border_style=CLOUDFLARE_ORANGE)
+class TrafficPanel(Horizontal):
+    """Throughput, response codes, streams, edge connections and RTT from cloudflared metrics."""
+
+    DEFAULT_CSS = f"""
+    TrafficPanel {{
+        border: round {CLOUDFLARE_ORANGE};
+        border-title-color: white;
+        border-title-style: bold;
+    }}
+
+    TrafficPanel MetricCell {{
+        width: 1fr;
+        height: 100%;
+        padding: 0 1;
+    }}
+
+    TrafficPanel Sparkline {{
+        height: 1fr;
+    }}
+    """
+
+    def compose(self) -> ComposeResult:
+        yield MetricCell("Requests/s", id="metric_requests")
+        yield MetricCell("Responses", id="metric_codes")
+        yield MetricCell("Active streams", id="metric_streams")
+        yield MetricCell("HA connections", id="metric_connections")
+        yield MetricCell("Edge RTT", id="metric_rtt")
+
+    def on_mount(self) -> None:
+        self.border_title = "TRAFFIC"
+
+    def show(self, stats: TrafficStats, address=None):
+        self.border_subtitle = f"metrics: {address}" if address else "metrics unavailable"
+        latest = stats.latest
+        self.query_one("#metric_requests", MetricCell).show(
+            f"[bold]{latest(stats.requests):.1f}[/]  [red]{latest(stats.errors):.1f} err/s[/]", stats.requests)
+        mix = stats.code_mix()
+        total = sum(mix.values())
+        colors = {"2xx": "green", "3xx": "cyan", "4xx": "yellow", "5xx": "red"}
+        codes = "  ".join(f"[{colors.get(k, 'white')}]{k} {v / total:.0%}[/]" for k, v in mix.items()) if total else "[dim]no requests[/]"
+        self.query_one("#metric_codes", MetricCell).show(codes, stats.errors)
+        self.query_one("#metric_streams", MetricCell).show(f"[bold]{latest(stats.streams):.0f}[/]", stats.streams)
+        self.query_one("#metric_connections", MetricCell).show(f"[bold]{latest(stats.connections):.0f}[/]", stats.connections)
+        self.query_one("#metric_rtt", MetricCell).show(f"[bold]{latest(stats.rtt):.0f}[/] ms", stats.rtt)
 
 class TunnelFlareApp(App):
     """The main TUI application."""
@@ -348,22 +620,57 @@ class TunnelFlareApp(App):
     Screen {
         layout: grid;
         grid-size: 2;
-        grid-rows: 3fr 2fr;
+        grid-rows: 3fr 8 2fr;
         grid-columns: 1fr 1fr;
         grid-gutter: 1;
         padding: 1;
     }
     
+    #switcher_bar {
+        dock: top;
+        height: auto;
+        padding: 0 1;
+    }
+    
+    #switcher_bar Label {
+        padding: 1 1 0 0;
+    }
+    
+    #tunnel_switcher {
+        width: 40;
+    }
+    
     #topology {
         column-span: 2;
         height: 100%;
     }
     
+    #traffic {
+        column-span: 2;
+        height: 100%;
+    }
+    
     #resources {
         height: 100%;
         border: solid blue;
     }
     
+    #resources_bar {
+        height: 1;
+    }
+    
+    #resources_title {
+        width: auto;
+        padding-right: 2;
+    }
+    
+    #resource_filter {
+        width: 1fr;
+        height: 1;
+        border: none;
+        padding: 0 1;
+    }
+    
     #logs {
         height: 100%;
         border: solid green;
@@ -389,6 +696,13 @@ class TunnelFlareApp(App):
     Button {
         margin: 0 1;
     }
+    
+    #lifecycle_status {
+        dock: bottom;
+        width: 100%;
+        content-align: center middle;
+        color: $warning;
+    }
     """
     
     BINDINGS = [
@@ -396,78 +710,352 @@ class TunnelFlareApp(App):
         ("a", "add_dns", "Add DNS"),
         ("s", "toggle_tunnel", "Start/Stop Tunnel"),
         ("r", "restart_tunnel", "Restart Tunnel"),
+        ("h", "history", "History"),
+        ("/", "filter_resources", "Filter"),
+        ("o", "sort_resources", "Sort"),
+        ("c", "commit_changes", "Commit"),
+        ("x", "discard_changes", "Discard"),
     ]
 
+    def __init__(self, profile_name: str = DEFAULT_PROFILE):
+        super().__init__()
+        self.profile = Profile(profile_name)
+        self._views = {}
+        self.resource_filter = ""
+        self.resource_sort = "pos"
+        self.resource_reverse = False
+        self._resource_cells = {} # rule id -> cells as last shown
+        self._resource_order = {} # rule position -> sort key as last applied
+        self._resource_rows = {} # rule id -> (inputs, cells, sort key), to skip unchanged rules
+        self._filter_timer = None
+        self._commit_timer = None
+        self._busy = Counter() # Profile name -> reloads, stops and restarts under way
+        self._quit_armed = False
+
+    @property
+    def view(self) -> ProfileView:
+        """State for the profile on screen; built on first use."""
+        view = self._views.get(self.profile.name)
+        if view is None:
+            view = self._views[self.profile.name] = ProfileView(self.profile)
+        return view
+
+    @property
+    def log_monitor(self) -> LogMonitor:
+        return self.view.log_monitor
+
     def compose(self) -> ComposeResult:
         yield Header(show_clock=True)
+        names = [p.name for p in list_profiles()]
+        if self.profile.name not in names:
+            names.insert(0, self.profile.name)
+        with Horizontal(id="switcher_bar"):
+            yield Label("Tunnel:")
+            yield Select([(name, name) for name in names], value=self.profile.name,
+                         allow_blank=False, id="tunnel_switcher")
         yield TopologyWidget(id="topology")
+        yield TrafficPanel(id="traffic")
         
         with Container(id="resources"):
-            yield Label("[bold white]ACTIVE RESOURCES[/]")
+            with Horizontal(id="resources_bar"):
+                yield Label("[bold white]ACTIVE RESOURCES[/]", id="resources_title")
+                yield Input(placeholder="/ to filter", id="resource_filter")
             yield DataTable(id="resource_table")
             with Horizontal(id="controls"):
                 yield Button("Add DNS", id="btn_add", variant="primary")
                 yield Button("Remove Selected", id="btn_remove", variant="error")
                 yield Button("Start/Stop", id="btn_toggle", variant="warning")
                 yield Button("Restart", id="btn_restart", variant="default")
+            yield Label("", id="lifecycle_status")
         
         with Container(id="logs"):
             yield Label("[bold white]TUNNEL LOGS[/]")
-            yield Log(id="log_view")
+            yield Log(id="log_view", max_lines=LOG_MAX_LINES)
             
         yield Footer()
 
     def on_mount(self) -> None:
         self.title = "TunnelFlare Dashboard"
+        self.sub_title = self.profile.name
+        self.last_input = time.monotonic()
+        self.user_idle = False
         self.refresh_resources()
+        self.set_interval(10, self.check_user_idle)
         self.set_interval(1, self.update_logs)
         self.set_interval(2, self.check_tunnel_status)
+        self.metrics_pool = ConnectionPool(per_host=1)
+        self.scrape_metrics()
+        self.set_interval(METRICS_INTERVAL, self.scrape_metrics)
+
+    def on_unmount(self) -> None:
+        self.metrics_pool.close()
+
+    def record_probes(self, profile: Profile, results):
+        """Add a round of origin probe results to the profile's latency histograms."""
+        view = self._views.get(profile.name)
+        if view is None: return
+        for rule_id, result in results.items():
+            histogram = view.latency.get(rule_id)
+            if histogram is None:
+                histogram = view.latency[rule_id] = LatencyHistogram()
+            histogram.record(result.latency, result.ok, result.error, result.checked_at)
+        for rule_id in [r for r in view.latency if r not in results]:
+            del view.latency[rule_id] # Rule removed from the config
+        if profile == self.profile:
+            self.refresh_resources()
+
+    def resource_row(self, rule, histogram):
+        """(cells, sort key) of one rule's row in the resources table."""
+        # Percentiles only move when a probe is recorded or the window slides.
+        inputs = (rule.index, rule.hostname, rule.path, rule.service, self.resource_sort, histogram,
+                  histogram and histogram.version, histogram and histogram.window_id())
+        cached = self._resource_rows.get(rule.id)
+        if cached is not None and cached[0] == inputs:
+            return cached[1], cached[2]
+        cells, key = self._resource_row(rule, histogram)
+        self._resource_rows[rule.id] = (inputs, cells, key)
+        return cells, key
+
+    def _resource_row(self, rule, histogram):
+        name = escape(str(rule.hostname or "*"))
+        if rule.path:
+            name = f"{name} [dim]{escape(str(rule.path))}[/]" # Path regexes often contain [brackets]
+        service = escape(rule.service) if rule.service else "N/A"
+        if histogram is None or histogram.last_ok is None:
+            # Not probed (yet), e.g. http_status services; last in the health orders
+            cells = (rule.index + 1, name, service, "-", "-", "-", "-", "")
+            return cells, (rule.index if self.resource_sort == "pos" else (True, 0, rule.index))
+        p50, p99 = histogram.percentiles((0.5, 0.99))
+        rate = histogram.success_rate()
+        status = "[green]Up[/]" if histogram.last_ok else "[red]Down[/]"
+        cells = (rule.index + 1, name, service, status, format_ms(p50), format_ms(p99),
+                 f"{rate:.0%}" if rate is not None else "-", sparkline(histogram.recent()))
+        if self.resource_sort == "pos":
+            return cells, rule.index
+        # Down before up, slowest first, lowest success rate first
+        value = {"status": histogram.last_ok, "p50": p50 and -p50, "p99": p99 and -p99,
+                 "ok": rate}[self.resource_sort]
+        return cells, (value is None, value or 0, rule.index)
 
     def refresh_resources(self):
-        table = self.query_one(DataTable)
-        table.clear(columns=True)
-        table.add_columns("Hostname", "Service", "Status")
-        table.cursor_type = "row"
-        
-        if CONFIG_FILE.exists():
-            try:
-                with open(CONFIG_FILE, "r") as f:
-                    config = yaml.safe_load(f)
-                    if "ingress" in config:
-                        for rule in config["ingress"]:
-                            hostname = rule.get("hostname", "*")
-                            service = rule.get("service", "N/A")
-                            if service == "http_status:404": continue
-                            table.add_row(hostname, service, "Active")
-            except:
-                pass
+        """
+        Bring the resources table up to date by diff. Rows are keyed by
+        rule id, and only rows and cells whose text changed are touched,
+        so a probe round over thousands of rules costs a few cell updates
+        instead of a rebuild, and the cursor and scroll position stay put.
+        """
+        table = self.query_one("#resource_table", DataTable)
+        if not table.columns:
+            for key, label, width in RESOURCE_COLUMNS:
+                table.add_column(label, key=key, width=width)
+            table.cursor_type = "row"
+        cursor_key = cursor_row = None
+        if table.row_count:
+            cursor_row = table.cursor_row
+            cursor_key = table.coordinate_to_cell_key(table.cursor_coordinate).row_key.value
+
+        try:
+            rules = self.profile.store.ingress()
+        except:
+            rules = []
+        query = self.resource_filter.lower()
+        latency = self.view.latency
+        changes = self.view.changes
+        wanted = {}
+        order = {} # (pos, rule) cells -> sort key; pending adds have no position yet
+        total = 0
+        for rule in rules:
+            if rule.service == CATCH_ALL_SERVICE: continue
+            total += 1
+            if query and query not in f"{rule.hostname or '*'} {rule.path or ''} {rule.service}".lower():
+                continue
+            cells, key = self.resource_row(rule, latency.get(rule.id))
+            if changes:
+                cells = self.staged_cells(rule, cells)
+            wanted[rule.id] = cells
+            order[cells[:2]] = key
+        existing = {(rule.hostname, rule.path) for rule in rules} if changes.adds else ()
+        for number, route in enumerate(changes.adds.values(), len(rules)):
+            if (route.hostname, route.path) in existing: continue # Shown as an update of that rule
+            if query and query not in f"{route.hostname} {route.path or ''} {route.service}".lower():
+                continue
+            name = escape(route.hostname) + (f" [dim]{escape(route.path)}[/]" if route.path else "")
+            cells = ("+", name, escape(route.service), "[yellow]add[/]", "-", "-", "-", "")
+            wanted[f"+{route.hostname}{route.path or ''}"] = cells
+            order[cells[:2]] = number if self.resource_sort == "pos" else (True, 0, number)
+        if len(self._resource_rows) > total: # Rules were removed from the config
+            ids = {rule.id for rule in rules}
+            self._resource_rows = {k: v for k, v in self._resource_rows.items() if k in ids}
+
+        shown = self._resource_cells
+        removed = [r for r in shown if r not in wanted]
+        if len(removed) > RESOURCE_REFILL_AT:
+            table.clear()
+            shown.clear()
+            self._resource_order = {}
+        for rule_id in removed if shown else ():
+            table.remove_row(rule_id)
+            del shown[rule_id]
+        for rule_id, cells in wanted.items():
+            before = shown.get(rule_id)
+            if before is None:
+                table.add_row(*cells, key=rule_id)
+            elif before != cells:
+                for (column, _, width), new, old in zip(RESOURCE_COLUMNS, cells, before):
+                    if new != old:
+                        table.update_cell(rule_id, column, new, update_width=width is None)
+            shown[rule_id] = cells
+        if order != self._resource_order:
+            # New rows land at the end, and health changes move rows: re-sort.
+            table.sort("pos", "rule", key=order.__getitem__, reverse=self.resource_reverse)
+            self._resource_order = order
+
+        if cursor_key in shown:
+            row = table.get_row_index(cursor_key)
+            if row != cursor_row:
+                table.move_cursor(row=row)
+        title = "[bold white]ACTIVE RESOURCES[/]"
+        if query:
+            title += f" [dim]{len(wanted)}/{total}[/]"
+        if self.resource_sort != "pos":
+            arrow = "↑" if self.resource_reverse else "↓"
+            title += f" [dim]by {dict((k, l) for k, l, _ in RESOURCE_COLUMNS)[self.resource_sort]} {arrow}[/]"
+        if changes:
+            title += f" [yellow]{len(changes)} pending (c commit, x discard)[/]"
+        self.query_one("#resources_title", Label).update(title)
+
+    def staged_cells(self, rule, cells):
+        """A rule's row cells with its staged edit, if any, marked."""
+        pending = self.view.changes.pending(rule)
+        if pending == "remove":
+            return (cells[0], f"[strike]{cells[1]}[/]", cells[2], "[yellow]remove[/]") + cells[4:]
+        if pending == "update":
+            service = escape(self.view.changes.adds[(rule.hostname, rule.path)].service)
+            return cells[:2] + (f"[yellow]{service}[/]", "[yellow]update[/]") + cells[4:]
+        return cells
+
+    def reset_resources(self):
+        """Empty the resources table, e.g. for another profile's rules."""
+        self.query_one("#resource_table", DataTable).clear()
+        self._resource_cells = {}
+        self._resource_order = {}
+        self._resource_rows = {}
+        self.refresh_resources()
+
+    def sort_resources(self, column: str, reverse: bool = False):
+        self.resource_sort = column
+        self.resource_reverse = reverse
+        self._resource_order = {} # Sort keys differ per column: recompute them all
+        self.refresh_resources()
+
+    def action_sort_resources(self):
+        """Cycle through the sort orders."""
+        position = RESOURCE_SORTS.index(self.resource_sort)
+        self.sort_resources(RESOURCE_SORTS[(position + 1) % len(RESOURCE_SORTS)])
+
+    def on_data_table_header_selected(self, event: DataTable.HeaderSelected) -> None:
+        column = event.column_key.value
+        if column not in RESOURCE_SORTS: return
+        # A second click on the same header reverses the order.
+        self.sort_resources(column, not self.resource_reverse if column == self.resource_sort else False)
+
+    def action_filter_resources(self):
+        self.query_one("#resource_filter", Input).focus()
+
+    def on_input_changed(self, event: Input.Changed) -> None:
+        if event.input.id == "resource_filter":
+            self.resource_filter = event.value.strip()
+            # Apply once typing pauses, not on every keystroke.
+            if self._filter_timer is not None:
+                self._filter_timer.stop()
+            self._filter_timer = self.set_timer(FILTER_DEBOUNCE, self.refresh_resources)
+
+    def on_input_submitted(self, event: Input.Submitted) -> None:
+        if event.input.id == "resource_filter":
+            if self._filter_timer is not None:
+                self._filter_timer.stop()
+            self.refresh_resources()
+            self.query_one("#resource_table", DataTable).focus()
 
     def update_logs(self):
-        log_view = self.query_one(Log)
-        if LOG_FILE.exists():
+        # Only the bytes appended since the last tick are read; the Log
+        # widget keeps at most LOG_MAX_LINES lines.
+        try:
+            lines = self.view.poll_logs()
+        except OSError:
+            return
+        if lines:
+            self.query_one(Log).write_lines(lines)
+            self.query_one(TopologyWidget).refresh_topology()
+
+    @work(exclusive=True, group="metrics")
+    async def scrape_metrics(self):
+        """Pull cloudflared's Prometheus metrics into the profile's traffic history."""
+        view = self.view
+        pid = view.profile.running_pid()
+        if pid != view.metrics_pid:
+            view.traffic.reset() # New process, new counters
+            view.metrics_pid = pid
+        address = view.metrics_address(pid) if pid else None
+        if address:
             try:
-                with open(LOG_FILE, "r") as f:
-                    # Read new lines only - simplified for now by just reading last 1KB
-                    f.seek(0, 2)
-                    size = f.tell()
-                    f.seek(max(0, size - 2000))
-                    lines = f.read()
-                    log_view.clear()
-                    log_view.write(lines)
-            except:
-                pass
+                response = await asyncio.wait_for(
+                    self.metrics_pool.request("GET", f"http://{address}{METRICS_PATH}"), METRICS_TIMEOUT)
+                parser = MetricsParser(DASHBOARD_METRICS)
+                parser.feed(response.body.decode("utf-8", errors="replace"))
+                view.traffic.update(parser.close(), time.monotonic())
+            except Exception:
+                address = None
+        if view is self.view:
+            self.query_one(TrafficPanel).show(view.traffic, address)
+
+    async def on_event(self, event: events.Event) -> None:
+        if isinstance(event, events.InputEvent):
+            self.last_input = time.monotonic()
+            if self.user_idle:
+                self.user_idle = False
+                self.query_one(TopologyWidget).resume_animation("idle")
+        await super().on_event(event)
+
+    def check_user_idle(self):
+        if not self.user_idle and time.monotonic() - self.last_input > IDLE_TIMEOUT:
+            self.user_idle = True
+            self.query_one(TopologyWidget).pause_animation("idle")
+
+    def on_app_blur(self) -> None:
+        # Terminal lost focus: nobody is watching the animation
+        self.query_one(TopologyWidget).pause_animation("blur")
+
+    def on_app_focus(self) -> None:
+        self.query_one(TopologyWidget).resume_animation("blur")
+
+    def on_select_changed(self, event: Select.Changed) -> None:
+        if event.select.id == "tunnel_switcher" and event.value != self.profile.name:
+            self.switch_profile(event.value)
+
+    def switch_profile(self, name: str):
+        """Show another tunnel; its state is loaded lazily on first view."""
+        # Staged edits belong to the tunnel being left: write them now; its
+        # reload is bound to that profile and waits out one in progress.
+        self.commit_changes(wait=False)
+        self.profile = Profile(name)
+        self.sub_title = name
+        log_view = self.query_one(Log)
+        log_view.clear()
+        if self.view.lines:
+            log_view.write_lines(list(self.view.lines))
+        else:
+            self.update_logs()
+        self.reset_resources()
+        topology = self.query_one(TopologyWidget)
+        topology.reset_status()
+        self.query_one(TrafficPanel).show(self.view.traffic)
+        self.scrape_metrics()
+        self.check_tunnel_status()
 
     def check_tunnel_status(self):
         # Check if tunnel is running
-        is_running = False
-        if PID_FILE.exists():
-            try:
-                with open(PID_FILE, "r") as f:
-                    pid = int(f.read().strip())
-                os.kill(pid, 0)
-                is_running = True
-            except:
-                pass
+        is_running = self.profile.running_pid() is not None
         
         btn = self.query_one("#btn_toggle", Button)
         if is_running:
@@ -485,6 +1073,9 @@ class TunnelFlareApp(App):
                 
         self.push_screen(AddDNSScreen(), check_add)
         
+    def action_history(self):
+        self.push_screen(HistoryScreen(self.profile))
+
     def on_button_pressed(self, event: Button.Pressed) -> None:
         if event.button.id == "btn_add":
             self.action_add_dns()
@@ -493,178 +1084,299 @@ class TunnelFlareApp(App):
         elif event.button.id == "btn_toggle":
             self.toggle_tunnel()
         elif event.button.id == "btn_restart":
-            self.restart_tunnel()
+            self.action_restart_tunnel()
 
     def add_dns_record(self, hostname, service):
-        if not CONFIG_FILE.exists(): return
+        store = self.profile.store
+        if not store.exists(): return
         
         try:
-            with open(CONFIG_FILE, "r") as f:
-                config = yaml.safe_load(f)
-            
-            # Insert before the 404 rule
-            new_rule = {"hostname": hostname, "service": service}
-            if "ingress" in config:
-                config["ingress"].insert(-1, new_rule)
+            changes = self.view.changes
+            existing = [r for r in store.ingress() if r.hostname == hostname and not r.path]
+            for rule in existing:
+                changes.keep(rule) # Adding a rule back cancels its removal
+            if any(r.service == service for r in existing):
+                changes.unstage((hostname, None))
+                self.notify(f"{hostname} already routes to {service}")
             else:
-                config["ingress"] = [new_rule]
-                
-            with open(CONFIG_FILE, "w") as f:
-                yaml.dump(config, f, sort_keys=False)
-                
-            # Restart tunnel to apply changes
-            self.restart_tunnel()
-            self.refresh_resources()
-            self.notify(f"Added {hostname} -> {service}")
+                # Written ahead of the catch-all and of any rule that would hide it
+                changes.add(Route(hostname, service))
+                self.notify(f"Staged {'update' if existing else 'add'}: {hostname} -> {service}")
+            self.schedule_commit()
             
         except Exception as e:
             self.notify(f"Error adding DNS: {e}", severity="error")
 
     def remove_selected_dns(self):
-        table = self.query_one(DataTable)
+        table = self.query_one("#resource_table", DataTable)
+        if not table.row_count: return
         row_key = table.coordinate_to_cell_key(table.cursor_coordinate).row_key
         if not row_key: return
         
-        row = table.get_row(row_key)
-        hostname_to_remove = row[0]
-        
-        if not CONFIG_FILE.exists(): return
+        store = self.profile.store
+        if not store.exists(): return
         
         try:
-            with open(CONFIG_FILE, "r") as f:
-                config = yaml.safe_load(f)
-            
-            if "ingress" in config:
-                config["ingress"] = [r for r in config["ingress"] if r.get("hostname") != hostname_to_remove]
-                
-            with open(CONFIG_FILE, "w") as f:
-                yaml.dump(config, f, sort_keys=False)
-                
-            self.restart_tunnel()
-            self.refresh_resources()
-            self.notify(f"Removed {hostname_to_remove}")
+            changes = self.view.changes
+            # A staged add is simply dropped.
+            key = next((k for k in changes.adds if f"+{k[0]}{k[1] or ''}" == row_key.value), None)
+            if key is not None:
+                changes.unstage(key)
+                self.notify(f"Unstaged add of {key[0]}")
+                self.schedule_commit()
+                return
+
+            # Rows are keyed by rule id, so duplicate hostnames and path rules remove just this one.
+            rule = next((r for r in store.ingress() if r.id == row_key.value), None)
+            if rule is None: return
+            label = f"{rule.hostname or '*'}{' ' + rule.path if rule.path else ''}"
+            if changes.keep(rule):
+                self.notify(f"Kept {label}") # Removing it again undoes the staged removal
+            else:
+                changes.unstage((rule.hostname, rule.path))
+                changes.remove(rule)
+                self.notify(f"Staged removal: {label}")
+            self.schedule_commit()
             
         except Exception as e:
             self.notify(f"Error removing DNS: {e}", severity="error")
 
+    def schedule_commit(self):
+        """(Re)start the commit countdown after a staged edit, and show the edit."""
+        if self._commit_timer is not None:
+            self._commit_timer.stop()
+            self._commit_timer = None
+        if self.view.changes:
+            self._commit_timer = self.set_timer(COMMIT_DEBOUNCE, self.commit_changes)
+        self._quit_armed = False
+        self.refresh_resources()
+
+    def action_commit_changes(self):
+        self.commit_changes()
+
+    def commit_changes(self, wait: bool = True):
+        """
+        Write the staged edits in one locked, atomic transaction and reload
+        once. With `wait`, a reload still in progress postpones the commit;
+        without, the new reload queues behind it (see reload_tunnel).
+        """
+        if self._commit_timer is not None:
+            self._commit_timer.stop()
+            self._commit_timer = None
+        changes = self.view.changes
+        if not changes: return
+        if wait and self._busy[self.profile.name]:
+            # One lifecycle operation at a time: try again once the current one is done
+            self._commit_timer = self.set_timer(COMMIT_DEBOUNCE, self.commit_changes)
+            return
+        profile = self.profile
+        try:
+            result = changes.commit(profile.store)
+        except Exception as e:
+            self.notify(f"Error saving config: {e}", severity="error")
+            return
+        if result.changed:
+            self.reload_tunnel(profile)
+        self.refresh_resources()
+        summary = f"{result.added} added, {result.updated} updated, {result.removed} removed"
+        self.notify(f"Ingress committed: {summary}" if result.changed else "Ingress unchanged")
+        if result.skipped:
+            self.notify(f"Already removed elsewhere: {', '.join(result.skipped)}", severity="warning")
+
+    def action_discard_changes(self):
+        changes = self.view.changes
+        if not changes: return
+        count = len(changes)
+        changes.clear()
+        self.schedule_commit()
+        self.notify(f"Discarded {count} staged edit(s)")
+
+    async def action_quit(self):
+        # Staged edits would be lost: ask for a second q first.
+        count = len(self.view.changes)
+        if count and not self._quit_armed:
+            self._quit_armed = True
+            self.notify(f"{count} staged edit(s) not committed: c to commit, x to discard, q again to quit",
+                        severity="warning")
+            return
+        self.exit()
+
+    def lifecycle_busy(self) -> bool:
+        """Whether a reload, stop or restart of the current tunnel is under way; says so if it is."""
+        if self._busy[self.profile.name]:
+            self.notify("Busy: wait for the current reload, stop or restart to finish", severity="warning")
+            return True
+        return False
+
+    def lifecycle_done(self, profile):
+        self._busy[profile.name] -= 1
+        self.set_progress()
+
+    def set_progress(self, message: str = ""):
+        """Show lifecycle progress inline, next to the control buttons."""
+        self.query_one("#lifecycle_status", Label).update(message)
+        busy = bool(message)
+        for button_id in ("#btn_toggle", "#btn_restart"):
+            self.query_one(button_id, Button).disabled = busy
+
+    async def stop_process(self, pid: int) -> bool:
+        """SIGINT the tunnel and await its exit without blocking the UI."""
+        # Use SIGINT for graceful shutdown (better for Cloudflare)
+        os.kill(pid, signal.SIGINT)
+        self.set_progress(f"Stopping tunnel (PID {pid})...")
+        if await wait_for_exit_async(pid, STOP_TIMEOUT):
+            return True
+        self.set_progress(f"PID {pid} did not stop in {STOP_TIMEOUT}s, killing...")
+        try:
+            os.kill(pid, signal.SIGKILL)
+        except ProcessLookupError:
+            return True
+        return await wait_for_exit_async(pid, STOP_TIMEOUT)
+
+    def action_toggle_tunnel(self):
+        self.toggle_tunnel()
+
     def toggle_tunnel(self):
-        is_running = False
-        pid = None
-        if PID_FILE.exists():
-            try:
-                with open(PID_FILE, "r") as f:
-                    pid = int(f.read().strip())
-                os.kill(pid, 0)
-                is_running = True
-            except:
-                pass
-        
-        if is_running:
-            # Stop
-            try:
-                # Use SIGINT for graceful shutdown (better for Cloudflare)
-                os.kill(pid, signal.SIGINT)
-                # Wait for process to die
-                for _ in range(10): # Wait up to 5 seconds
-                    try:
-                        os.kill(pid, 0)
-                        time.sleep(0.5)
-                    except OSError:
-                        break # Process died
-                
-                if PID_FILE.exists(): PID_FILE.unlink()
-                
-                # Force immediate status update
-                self.query_one(TopologyWidget).tunnel_status = "stopped"
-                self.query_one(TopologyWidget).refresh_topology()
-                self.check_tunnel_status() # Update button
-                
-                self.notify("Tunnel Stopped")
-            except Exception as e:
-                self.notify(f"Failed to stop: {e}", severity="error")
+        if self.lifecycle_busy(): return
+        if self.profile.running_pid():
+            self._busy[self.profile.name] += 1
+            self.stop_tunnel(self.profile)
         else:
             # Start
             self.start_tunnel()
 
-    def start_tunnel(self):
-        if not CONFIG_FILE.exists(): return
-        
+    @work(group="lifecycle")
+    async def stop_tunnel(self, profile):
+        self.set_progress("Stopping tunnel...")
         try:
-            with open(CONFIG_FILE, "r") as f:
-                config = yaml.safe_load(f)
-            tunnel_id = config.get("tunnel")
-            cred_file = config.get("credentials-file")
+            # Under the restart lock: a reload in progress finishes first
+            # instead of bringing up a replica behind our back.
+            async with restart_lock_async(profile):
+                pid = profile.running_pid()
+                if pid:
+                    profile.release() # Before signalling, so the supervisor doesn't restart it
+                    await self.stop_process(pid)
             
-            if not tunnel_id:
-                self.notify("No Tunnel ID found in config", severity="error")
-                return
+            # Force immediate status update
+            self.query_one(TopologyWidget).tunnel_status = "stopped"
+            self.query_one(TopologyWidget).refresh_topology()
+            self.check_tunnel_status() # Update button
             
-            if not cred_file:
-                 self.notify("No Credentials File found in config", severity="error")
-                 return
+            self.notify("Tunnel Stopped")
+        except Exception as e:
+            self.notify(f"Failed to stop: {e}", severity="error")
+        finally:
+            self.lifecycle_done(profile)
 
-            if not Path(cred_file).exists():
-                 self.notify(f"Credentials file missing: {cred_file}", severity="error")
-                 self.notify("Please run 'tunnelflare reset' then 'setup'", severity="warning")
-                 return
+    def launch_params(self, profile=None):
+        """(tunnel_id, cred_path) for `profile` (the current one), or None after notifying why not."""
+        store = (profile or self.profile).store
+        if not store.exists(): return None
 
-            TUNNEL_DIR.mkdir(exist_ok=True)
-            
-            cmd = [
-                "cloudflared", 
-                "tunnel", 
-                "--config", str(CONFIG_FILE), 
-                "--cred-file", str(cred_file),
-                "run", 
-                tunnel_id
-            ]
-            
-            with open(LOG_FILE, "w") as log:
-                process = subprocess.Popen(
-                    cmd,
-                    stdout=log,
-                    stderr=subprocess.STDOUT,
-                    start_new_session=True
-                )
-            
-            with open(PID_FILE, "w") as f:
-                f.write(str(process.pid))
+        tunnel_id = store.get("tunnel")
+        cred_file = store.get("credentials-file")
+        
+        if not tunnel_id:
+            self.notify("No Tunnel ID found in config", severity="error")
+            return None
+        
+        if not cred_file:
+             self.notify("No Credentials File found in config", severity="error")
+             return None
+
+        if not Path(cred_file).exists():
+             self.notify(f"Credentials file missing: {cred_file}", severity="error")
+             self.notify("Please run 'tunnelflare reset' then 'setup'", severity="warning")
+             return None
+        return tunnel_id, Path(cred_file)
+
+    def start_tunnel(self, profile=None):
+        profile = profile or self.profile
+        try:
+            params = self.launch_params(profile)
+            if params is None: return
+
+            pid = profile.spawn(*params)
             
             # Force immediate status update
             self.query_one(TopologyWidget).tunnel_status = "ok"
             self.query_one(TopologyWidget).refresh_topology()
             self.check_tunnel_status() # Update button
             
-            self.notify(f"Tunnel Started (PID: {process.pid})")
+            self.notify(f"Tunnel Started (PID: {pid})")
             
         except Exception as e:
             self.notify(f"Failed to start: {e}", severity="error")
 
+    def reload_tunnel(self, profile=None):
+        """Apply config changes with a blue/green restart, if `profile`'s (the current) tunnel is running."""
+        profile = profile or self.profile
+        if not profile.running_pid():
+            return
+        try:
+            params = self.launch_params(profile)
+        except Exception as e:
+            self.notify(f"Failed to reload: {e}", severity="error")
+            return
+        if params is None: return
+        self.set_progress("Reloading: waiting for replacement to connect...")
+        # blue_green_restart takes the per-profile restart lock, so a reload
+        # started while another one, a stop or a restart is running waits for
+        # it instead of racing it.
+        self._busy[profile.name] += 1
+        self.blue_green_reload(profile, *params)
+
+    @work(thread=True, group="lifecycle")
+    def blue_green_reload(self, profile, tunnel_id, cred_path):
+        try:
+            report = blue_green_restart(profile, tunnel_id, cred_path, if_running=True)
+        except Exception as e:
+            self.call_from_thread(self.lifecycle_done, profile)
+            self.call_from_thread(self.notify, f"Failed to reload: {e}", severity="error")
+            return
+        self.call_from_thread(self.on_reload_done, profile, report)
+
+    def on_reload_done(self, profile, report):
+        self.lifecycle_done(profile)
+        if report is None:
+            return # Stopped while the reload waited its turn
+        if report.mode == "rolled-back":
+            self.notify(f"Reload failed ({report.error}); old tunnel kept running", severity="error")
+        elif report.new_pid is None:
+            self.notify(f"Tunnel failed to start: {report.error}", severity="error")
+        else:
+            self.notify(f"Tunnel reloaded (PID {report.new_pid}): downtime {report.downtime:.2f}s, "
+                        f"{report.dropped} in-flight request(s) dropped")
+        self.check_tunnel_status()
+
     def action_restart_tunnel(self):
-        self.restart_tunnel()
+        if self.lifecycle_busy(): return
+        self._busy[self.profile.name] += 1
+        self.restart_tunnel(self.profile)
 
-    def restart_tunnel(self):
+    @work(group="lifecycle")
+    async def restart_tunnel(self, profile):
         self.notify("Restarting Tunnel...")
-        # Stop if running
-        if PID_FILE.exists():
-            try:
-                with open(PID_FILE, "r") as f:
-                    pid = int(f.read().strip())
-                os.kill(pid, signal.SIGINT) # Graceful
-                # Wait for process to die
-                for _ in range(10):
-                    try:
-                        os.kill(pid, 0)
-                        time.sleep(0.5)
-                    except OSError:
-                        break
-                if PID_FILE.exists(): PID_FILE.unlink()
-            except:
-                pass
-        
-        # Start
-        self.start_tunnel()
+        self.set_progress("Restarting tunnel...")
+        try:
+            async with restart_lock_async(profile):
+                try:
+                    # Stop if running
+                    pid = profile.running_pid()
+                    profile.release()
+                    if pid:
+                        await self.stop_process(pid)
+                except Exception as e:
+                    self.notify(f"Failed to stop: {e}", severity="error")
+                finally:
+                    self.set_progress()
+
+                # Start
+                self.start_tunnel(profile)
+        finally:
+            self.lifecycle_done(profile)
 
 if __name__ == "__main__":
-    app = TunnelFlareApp()
+    import sys
+    app = TunnelFlareApp(sys.argv[1] if len(sys.argv) > 1 else DEFAULT_PROFILE)
     app.run()